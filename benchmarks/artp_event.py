@@ -0,0 +1,55 @@
+"""
+Micro-benchmark of creating and serializing ArtP events, comparing the
+event models with the pre-serialized template and uuid.uuid4 with the
+batched UUID generator.
+
+Run from the repository root: python benchmarks/artp_event.py
+"""
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eiffelactory import eiffel  # noqa: E402
+
+NUMBER = 100000
+
+ARTC_ID = '5de6f82d-52b6-44ae-bdbb-0be4fc213184'
+URI = 'https://artifactory.example.com/artifactory/repo/path/artifact.zip'
+
+
+def models():
+    return eiffel.create_artifact_published_event(
+        ARTC_ID, [eiffel.Location(URI)]).to_json()
+
+
+def template():
+    return eiffel.render_artifact_published_event(
+        ARTC_ID, [eiffel.Location(URI)])
+
+
+def uuid4():
+    return str(uuid.uuid4())
+
+
+def report(name, baseline, optimized):
+    baseline_time = timeit.timeit(baseline, number=NUMBER)
+    optimized_time = timeit.timeit(optimized, number=NUMBER)
+    print('{:<10} {:>8.2f} us {:>8.2f} us {:>6.1f}x'.format(
+        name,
+        baseline_time / NUMBER * 1e6,
+        optimized_time / NUMBER * 1e6,
+        baseline_time / optimized_time))
+
+
+def main():
+    print('{:<10} {:>11} {:>11} {:>7}'.format('', 'before', 'after',
+                                              'speedup'))
+    report('uuid', uuid4, eiffel.new_event_id)
+    report('artp', models, template)
+
+
+if __name__ == '__main__':
+    main()
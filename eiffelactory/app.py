@@ -2,30 +2,71 @@
 Main module that starts RabbitMQ connection and publishes ArtifactPublished
 events
 """
+import asyncio
+import collections
+import functools
 import logging
 import signal
-import sys
 import os
-import json
+import time
 
 from eiffelactory import artifactory
+from eiffelactory import batching
+from eiffelactory import codec
 from eiffelactory import config
+from eiffelactory import dedup
 from eiffelactory import eiffel
+from eiffelactory import flowcontrol
+from eiffelactory import metrics
 from eiffelactory import rabbitmq
+from eiffelactory import retry
+from eiffelactory import tracing
 from eiffelactory import utils
+from eiffelactory import workers
 
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
 
+CFG = config.Config()
+
+# the options of utils.setup_logger for the event and app logs
+LOG_OPTIONS = {'json_lines': CFG.eiffelactory.log_format == 'json',
+               'background': CFG.eiffelactory.log_background,
+               'max_bytes': CFG.eiffelactory.log_max_bytes,
+               'when': CFG.eiffelactory.log_rotate_when,
+               'backup_count': CFG.eiffelactory.log_backup_count}
+
 LOGGER_ARTIFACTS = utils.setup_event_logger('artifacts', 'artifacts.log',
-                                            logging.DEBUG)
+                                            logging.DEBUG,
+                                            **LOG_OPTIONS)
 LOGGER_PUBLISHED = utils.setup_event_logger('published', 'published.log',
-                                            logging.INFO)
-LOGGER_RECEIVED = utils.setup_event_logger('received', 'received.log', logging.INFO)
-LOGGER_APP = utils.setup_app_logger('app', 'eiffelactory.log', logging.DEBUG)
+                                            logging.INFO,
+                                            **LOG_OPTIONS)
+LOGGER_RECEIVED = utils.setup_event_logger(
+    'received', 'received.log', logging.INFO,
+    sample_rate=CFG.eiffelactory.received_log_sample_rate,
+    **LOG_OPTIONS)
+LOGGER_APP = utils.setup_app_logger('app', 'eiffelactory.log',
+                                    logging.DEBUG, **LOG_OPTIONS)
 
-CFG = config.Config()
+# seconds between checks for due lookup retries
+RETRY_CHECK_INTERVAL = 1.0
+
+# seconds between checks if consuming should be paused or resumed because of
+# the Artifactory circuit breaker
+CIRCUIT_BREAKER_CHECK_INTERVAL = 1.0
+
+# the maximum number of seconds AsyncApp blocks its event loop waiting for
+# RabbitMQ messages
+ASYNC_POLL_INTERVAL = 0.05
+
+# the maximum number of seconds between a worker finishing an event and
+# WorkerApp acking its message while the queue is idle
+WORKER_CHECK_INTERVAL = 0.05
+
+# the processing stages whose latency is measured
+STAGES = ('decode', 'validate', 'parse', 'lookup', 'build', 'publish')
 
 
 class App:
@@ -34,48 +75,584 @@ class App:
     events
     """
     def __init__(self):
-        self.rmq_connection = rabbitmq.RabbitMQConnection(CFG.rabbitmq,
-                                                          self.on_event_received)
+        self.validate_event = eiffel.create_event_validator(
+            eiffel.EVENT_FIELDS)
+        self.validate_artc_event = eiffel.create_event_validator(
+            eiffel.ARTIFACT_CREATED_FIELDS)
+        self.rejections = collections.Counter()
+        self.in_flight = 0
+        # artc_meta_id -> (message, reconnects) of the accepted events whose
+        # message hasn't been settled
+        self.unsettled = {}
+        self._create_metrics()
+        self.tracer = self._create_tracer()
+        self.profiler = tracing.SamplingProfiler(
+            'logs', CFG.eiffelactory.profile_interval)
+        self.rmq_connection = self._create_rmq_connection()
         self.artifactory_connection = artifactory.ArtifactoryConnection(
             CFG.artifactory)
+        self.lookup_batcher = None
+        if CFG.artifactory.batch_size > 1:
+            self.lookup_batcher = batching.LookupBatcher(
+                self._find_batched_artifacts,
+                self._on_batched_lookup_done,
+                self._on_batched_lookup_failed,
+                CFG.artifactory.batch_size,
+                CFG.artifactory.batch_window)
+            self.rmq_connection.add_tick_callback(
+                self.lookup_batcher.flush_if_due, CFG.artifactory.batch_window)
+        self.retry_scheduler = None
+        if CFG.eiffelactory.retry_max_pending > 0:
+            self.retry_scheduler = retry.RetryScheduler(
+                CFG.eiffelactory.retry_max_pending,
+                CFG.eiffelactory.retry_initial_delay,
+                CFG.eiffelactory.retry_max_delay,
+                CFG.eiffelactory.retry_backoff,
+                CFG.eiffelactory.retry_max_age)
+            self.rmq_connection.add_tick_callback(self._retry_due_lookups,
+                                                  RETRY_CHECK_INTERVAL)
+        self.broker_retries = CFG.eiffelactory.retry_mode == 'broker'
+        self.duplicate_filter = None
+        if CFG.eiffelactory.dedup_size > 0:
+            self.duplicate_filter = dedup.DuplicateFilter(
+                CFG.eiffelactory.dedup_size, CFG.eiffelactory.dedup_window)
+        self.rmq_connection.add_tick_callback(self._check_circuit_breaker,
+                                              CIRCUIT_BREAKER_CHECK_INTERVAL)
+        self.artifactory_connection.start_index_sync()
+        self._add_stats_metrics()
+        self.metrics_server = self._start_metrics_server()
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._profile_signal_handler)
+        if CFG.eiffelactory.profile_at_startup:
+            self.profiler.start(CFG.eiffelactory.profile_duration)
+
+    @staticmethod
+    def _create_tracer():
+        """
+        :return: a Tracer writing to traces.log if trace_sample_rate is set,
+        otherwise a no-op tracer
+        """
+        if CFG.eiffelactory.trace_sample_rate <= 0:
+            return tracing.NULL_TRACER
+        logger = utils.setup_event_logger('traces', 'traces.log',
+                                          logging.INFO, **LOG_OPTIONS)
+        return tracing.Tracer(logger, CFG.eiffelactory.trace_sample_rate,
+                              CFG.eiffelactory.trace_min_duration)
+
+    def _profile_signal_handler(self, signal_received, frame):
+        """
+        Profiles the app for profile_duration seconds on SIGUSR1.
+        """
+        if not self.profiler.start(CFG.eiffelactory.profile_duration):
+            LOGGER_APP.info("Ignoring signal %d, already profiling.",
+                            signal_received)
+
+    def _create_metrics(self):
+        """
+        Creates the instruments of the app, which are no-ops unless
+        metrics_port is set.
+        """
+        self.metrics = metrics.Metrics(
+            enabled=CFG.eiffelactory.metrics_port is not None)
+        stage_seconds = self.metrics.histogram(
+            'eiffelactory_stage_seconds',
+            'Seconds spent in each processing stage of an event',
+            label='stage')
+        self.stages = {stage: stage_seconds.labels(stage)
+                       for stage in STAGES}
+        self.received = self.metrics.counter(
+            'eiffelactory_received_total', 'Events received')
+        self.filtered = self.metrics.counter(
+            'eiffelactory_filtered_total',
+            'Events received that are not wanted ArtCs')
+        self.rejected = self.metrics.counter(
+            'eiffelactory_rejected_total', 'Invalid events rejected')
+        self.found = self.metrics.counter(
+            'eiffelactory_found_total', 'Lookups that found one artifact')
+        self.not_found = self.metrics.counter(
+            'eiffelactory_not_found_total',
+            'Lookups that found no artifact or failed')
+        self.ambiguous = self.metrics.counter(
+            'eiffelactory_ambiguous_total',
+            'Lookups that found more than one artifact')
+        self.published = self.metrics.counter(
+            'eiffelactory_published_total', 'ArtP events published')
+        self.errors = self.metrics.counter(
+            'eiffelactory_errors_total',
+            'Events requeued or rejected because processing failed')
+        self.metrics.gauge('eiffelactory_in_flight',
+                           'Events received whose message is not settled',
+                           lambda: self.in_flight)
+        self.metrics.gauge('eiffelactory_prefetch_usage',
+                           'Events in flight as a fraction of prefetch_count',
+                           self._prefetch_usage)
+
+    def _prefetch_usage(self):
+        if not CFG.rabbitmq.prefetch_count:
+            return 0.0
+        return self.in_flight / CFG.rabbitmq.prefetch_count
+
+    def _add_stats_metrics(self):
+        """
+        Exposes the stats of the app components as gauges.
+        """
+        self.metrics.add_stats('eiffelactory_rabbitmq',
+                               self.rmq_connection.connection_stats)
+        self.metrics.add_stats('eiffelactory_raw_filter',
+                               self.rmq_connection.filter_stats)
+        self.metrics.add_stats('eiffelactory_artifactory_pool',
+                               self.artifactory_connection.pool_stats)
+        self.metrics.add_stats('eiffelactory_artifactory_flow',
+                               self.artifactory_connection.flow_stats)
+        if len(self.artifactory_connection.endpoints) > 1:
+            self.metrics.add_stats(
+                'eiffelactory_artifactory_node',
+                self.artifactory_connection.endpoints.stats, label='node')
+        if self.artifactory_connection.cache is not None:
+            self.metrics.add_stats('eiffelactory_lookup_cache',
+                                   self.artifactory_connection.cache.stats)
+        if self.retry_scheduler is not None:
+            self.metrics.add_stats('eiffelactory_retry',
+                                   self.retry_scheduler.stats)
+        if self.duplicate_filter is not None:
+            self.metrics.add_stats('eiffelactory_dedup',
+                                   self.duplicate_filter.stats)
 
-    def on_event_received(self, event):
+    def _start_metrics_server(self):
+        """
+        Serves the metrics if metrics_port is set. The workers run by the
+        supervisor serve them on metrics_port plus their worker index.
+        :return: the MetricsServer, or None
+        """
+        if not self.metrics.enabled:
+            return None
+        port = CFG.eiffelactory.metrics_port + \
+            (utils.worker_index() or 0)
+        try:
+            server = metrics.MetricsServer(
+                self.metrics, CFG.eiffelactory.metrics_host, port)
+        except OSError as ex:
+            LOGGER_APP.error("Can't serve metrics on port %d: %s", port, ex)
+            return None
+        server.start()
+        return server
+
+    def _create_rmq_connection(self):
+        raw_filter = None
+        if CFG.eiffelactory.raw_filter:
+            raw_filter = eiffel.create_raw_event_filter(
+                eiffel.EIFFEL_ARTIFACT_CREATED_EVENT,
+                CFG.eiffelactory.event_sources)
+        bindings = rabbitmq.derive_bindings(
+            CFG.rabbitmq,
+            eiffel.EIFFEL_ARTIFACT_CREATED_EVENT,
+            CFG.eiffelactory.event_sources)
+        retry_queues = CFG.eiffelactory.retry_mode == 'broker'
+        dead_lettering = CFG.eiffelactory.invalid_events == 'dead-letter'
+        return rabbitmq.RabbitMQConnection(CFG.rabbitmq,
+                                           self.on_message_received,
+                                           raw_filter=raw_filter,
+                                           bindings=bindings,
+                                           retry_queues=retry_queues,
+                                           dead_lettering=dead_lettering,
+                                           decode_latency=self.stages[
+                                               'decode'])
+
+    @staticmethod
+    def _is_from_event_sources(event):
+        """
+        Checks if a validated ArtC event is sent from one of the configured
+        event sources.
+        :param event: the Eiffel event
+        :return: True if the event should be processed
+        """
+        return not CFG.eiffelactory.event_sources or \
+            eiffel.is_sent_from_sources(event, CFG.eiffelactory.event_sources)
+
+    def _accept_event(self, event, message):
+        """
+        Validates a received event and settles the message if the event
+        isn't processed: invalid events are rejected, other events than the
+        wanted ArtCs and duplicates are acked. ArtCs are validated before
+        their source is checked, so that the source filter only reads
+        fields that have been validated.
+        :param event: the decoded Eiffel event
+        :param message: the RabbitMQ message
+        :return: True if the event should be processed
+        """
+        self.received.inc()
+        with self.stages['validate'].time():
+            reason = self.validate_event(event)
+            wanted = False
+            if reason is None and eiffel.is_artifact_created_event(event):
+                reason = self.validate_artc_event(event)
+                wanted = reason is None and self._is_from_event_sources(event)
+        if reason is not None:
+            self._reject_invalid_event(message, reason)
+            return False
+        if not wanted:
+            self.filtered.inc()
+            message.ack()
+            return False
+
+        LOGGER_RECEIVED.info(self._received_body(event, message))
+        if self._is_duplicate(event['meta']['id']):
+            message.ack()
+            return False
+        self.unsettled[event['meta']['id']] = \
+            (message, self.rmq_connection.reconnects)
+        self.tracer.start(event['meta']['id'])
+        self.in_flight += 1
+        return True
+
+    @staticmethod
+    def _received_body(event, message):
+        """
+        :param event: the decoded Eiffel event
+        :param message: the RabbitMQ message
+        :return: the JSON body of the message as received, so that it is
+        logged without being serialized again, or the event serialized
+        compactly if the body isn't plain JSON bytes or spans several lines,
+        which would break the one record per line of the logs
+        """
+        body = message.body
+        if isinstance(body, bytes) and \
+                message.content_type == codec.CONTENT_TYPE and \
+                'compression' not in (message.headers or {}) and \
+                b'\n' not in body and b'\r' not in body:
+            return body
+        return codec.dumps(event)
+
+    def _reject_invalid_event(self, message, reason):
+        """
+        Moves the message of an invalid event to the dead-letter queue with
+        the reason in a header, or rejects it if invalid_events is reject,
+        instead of having it redelivered forever.
+        :param message: the RabbitMQ message
+        :param reason: why the event is invalid
+        """
+        self.rejections[reason] += 1
+        self.rejected.inc()
+        LOGGER_APP.warning("Rejecting invalid event, %s, %d rejected so far",
+                           reason, sum(self.rejections.values()))
+        try:
+            if CFG.eiffelactory.invalid_events == 'dead-letter':
+                self.rmq_connection.dead_letter_message(message, reason)
+                message.ack()
+            else:
+                message.reject()
+        except self.rmq_connection.republish_errors as ex:
+            LOGGER_APP.warning("Couldn't reject invalid event, it will be "
+                               "redelivered: %s", ex)
+
+    def rejection_stats(self):
+        """
+        :return: dict with the number of rejected invalid events per reason
+        """
+        return dict(self.rejections)
+
+    def _is_duplicate(self, artc_meta_id):
+        """
+        Checks if an ArtC event has already been received, remembering it
+        if it hasn't. An event that was received on a connection that has
+        been lost since, and whose message was never settled, isn't a
+        duplicate: the broker has redelivered it.
+        :param artc_meta_id: the id of the ArtC event
+        :return: True if the event is a duplicate and should be skipped
+        """
+        if self.duplicate_filter is None:
+            return False
+        unsettled = self.unsettled.get(artc_meta_id)
+        if unsettled is not None and \
+                unsettled[1] != self.rmq_connection.reconnects:
+            LOGGER_APP.info("Processing ArtC '%s' again, it was redelivered "
+                            "after a lost connection", artc_meta_id)
+            return False
+        if not self.duplicate_filter.check(artc_meta_id):
+            return False
+        LOGGER_APP.info("Skipping duplicate ArtC '%s', %d duplicates so far",
+                        artc_meta_id, self.duplicate_filter.duplicates)
+        return True
+
+    @staticmethod
+    def _is_parked(message):
+        """
+        Checks if a message has come back from the parking queue, in which
+        case its lookup bypasses the lookup cache like other retries.
+        :param message: the RabbitMQ message
+        :return: True if the message has been parked for a retry
+        """
+        return rabbitmq.RETRIES_HEADER in (message.headers or {})
+
+    def _settle_message(self, artc_meta_id, message, processed,
+                        requeue=True):
+        """
+        Acks a message whose event has been processed, or requeues or
+        rejects it. An event that wasn't processed is forgotten by the
+        duplicate filter, so that it is processed when it is redelivered.
+        Every event accepted for processing is settled here once, a message
+        that has already been settled is left as it is, e.g. when the error
+        of a failed publisher batch reaches the caller after the batch has
+        requeued the message.
+        :param artc_meta_id: the id of the ArtC event
+        :param message: the RabbitMQ message
+        :param processed: True if the event has been processed and its ArtP
+        event, if any, has been published
+        :param requeue: False to reject a message that wasn't processed
+        instead of requeuing it
+        """
+        if message.acknowledged:
+            return
+        if self.unsettled.get(artc_meta_id, (None,))[0] is message:
+            del self.unsettled[artc_meta_id]
+        self.in_flight -= 1
+        self.tracer.finish(artc_meta_id, 'ack' if processed else
+                           'requeue' if requeue else 'reject')
+        if not processed:
+            self.errors.inc()
+            if self.duplicate_filter is not None:
+                self.duplicate_filter.forget(artc_meta_id)
+        try:
+            if processed:
+                message.ack()
+            elif requeue:
+                message.requeue()
+            else:
+                message.reject()
+        except self.rmq_connection.connection_errors as ex:
+            # the message was received on a connection that has been lost
+            # since, the broker redelivers it
+            LOGGER_APP.warning("Couldn't settle ArtC '%s', it will be "
+                               "redelivered: %s", artc_meta_id, ex)
+
+    def on_message_received(self, event, message):
         """
         Callback method passed to RabbitMQConnection and that processes
-        received messages
-        :param event: RabbitMQ message
+        received messages. The message is acked when the event has been
+        processed and its ArtP event has been published, and requeued if
+        Artifactory is unavailable.
+        :param event: the decoded Eiffel event
+        :param message: the RabbitMQ message
         :return:
         """
-        if not eiffel.is_artifact_created_event(event) or (
-            CFG.eiffelactory.event_sources and
-            not eiffel.is_sent_from_sources(event,
-                                            CFG.eiffelactory.event_sources)):
+        if not self._accept_event(event, message):
             return
 
-        LOGGER_RECEIVED.info(event)
-
         artc_meta_id = event['meta']['id']
-        artc_data_identity = event['data']['identity']
+        with self.stages['parse'].time():
+            lookup = self._create_lookup(event['data']['identity'])
+
+        if self.lookup_batcher is not None:
+            self.tracer.mark(artc_meta_id, 'lookup_start')
+            self.lookup_batcher.add(artc_meta_id, lookup, message)
+            return
+
+        self.tracer.mark(artc_meta_id, 'lookup_start')
+        try:
+            with self.stages['lookup'].time():
+                artifact = self.artifactory_connection.\
+                    find_artifact_on_artifactory(
+                        *lookup, use_cache=not self._is_parked(message))
+        except artifactory.ArtifactoryUnavailableError as ex:
+            LOGGER_APP.error("Requeuing ArtC '%s', Artifactory is "
+                             "unavailable: %s", artc_meta_id, ex)
+            self._settle_message(artc_meta_id, message, False)
+            return
+        self.tracer.mark(artc_meta_id, 'lookup_end')
+        self._on_artifact_lookup_done(artc_meta_id, lookup, artifact,
+                                      message)
+
+    @staticmethod
+    def _create_lookup(artc_data_identity):
+        """
+        Creates the lookup tuple for an ArtC identity purl: the artifact
+        filename and the build path substring, plus the intermediate
+        directories in exact resolution mode.
+        :param artc_data_identity: the data.identity purl of the ArtC event
+        :return: tuple
+        """
+        lookup = utils.parse_purl(artc_data_identity)
+        if CFG.artifactory.resolution_mode == 'exact':
+            lookup += (utils.parse_purl_directories(artc_data_identity),)
+        return lookup
 
-        artifact = self.artifactory_connection.\
-            find_artifact_on_artifactory(*utils.parse_purl(artc_data_identity))
+    def _find_batched_artifacts(self, lookups):
+        """
+        Lookup function for the LookupBatcher.
+        :param lookups: list of (artifact_filename, build_path_substring)
+        :return: dict mapping each lookup to its results, or None if
+        Artifactory is unavailable
+        """
+        try:
+            return self.artifactory_connection.find_artifacts_on_artifactory(
+                lookups)
+        except artifactory.ArtifactoryUnavailableError as ex:
+            LOGGER_APP.error("Batched lookup failed, Artifactory is "
+                             "unavailable: %s", ex)
+            return None
+
+    def _on_batched_lookup_done(self, artc_meta_id, lookup, artifact,
+                                message):
+        """
+        Result callback of the LookupBatcher, the message is settled like
+        the one of an event that is looked up on its own.
+        """
+        self.tracer.mark(artc_meta_id, 'lookup_end')
+        self._on_artifact_lookup_done(artc_meta_id, lookup, artifact,
+                                      message)
 
+    def _on_batched_lookup_failed(self, artc_meta_id, lookup, message):
+        """
+        Failure callback of the LookupBatcher, the message is requeued since
+        Artifactory was unavailable.
+        """
+        self._settle_message(artc_meta_id, message, False)
+
+    def _on_artifact_lookup_done(self, artc_meta_id, lookup, artifact,
+                                 message=None):
+        """
+        Publishes an ArtP event if the lookup found exactly one artifact, and
+        schedules a retry if it found none or failed. The message of the ArtC
+        event, if it hasn't been acked yet, is acked when the event has been
+        processed, which is when its ArtP event has been published if one is
+        published, and requeued if publishing failed.
+        :param artc_meta_id: the id of ArtifactCreated event
+        :param lookup: tuple: the artifact filename and the build path
+        substring
+        :param artifact: the results list returned from Artifactory by the
+        AQL query, or None if the query failed
+        :param message: the RabbitMQ message of the ArtC event, or None if it
+        has already been acked
+        """
+        on_done = None
+        if message is not None:
+            on_done = functools.partial(self._settle_message, artc_meta_id,
+                                        message)
+        if artifact and len(artifact) == 1:
+            self.found.inc()
+            self._publish_artp_event(artc_meta_id, artifact[0], on_done)
+            return
         if artifact:
-            if len(artifact) > 1:
-                LOGGER_APP.error("AQL query returned '%d' artifacts",
-                                 len(artifact))
-                return
+            self.ambiguous.inc()
+        else:
+            self.not_found.inc()
+        if not artifact and message is not None and self.broker_retries:
+            self._park_message(artc_meta_id, message)
+            return
+        if not artifact and self.retry_scheduler:
+            self.retry_scheduler.schedule(artc_meta_id, lookup)
+        elif artifact:
+            LOGGER_APP.error("AQL query returned more than one "
+                             "artifact for ArtC '%s'", artc_meta_id)
+        if on_done:
+            on_done(True)
+
+    def _park_message(self, artc_meta_id, message):
+        """
+        Retries an ArtC event whose artifact wasn't found by parking its
+        message on the broker, which redelivers it after the retry delay,
+        or dead-letters it when retry_max_attempts is used up. The parked
+        event is forgotten by the duplicate filter, so that it is processed
+        when it comes back. The message is acked once the broker has
+        confirmed the parked copy, and requeued if it wasn't confirmed.
+        :param artc_meta_id: the id of the ArtC event
+        :param message: the RabbitMQ message of the ArtC event
+        """
+        retries = (message.headers or {}).get(rabbitmq.RETRIES_HEADER, 0)
+        try:
+            if retries >= CFG.eiffelactory.retry_max_attempts:
+                LOGGER_APP.warning("Dead-lettering ArtC '%s', no artifact "
+                                   "found after %d retries",
+                                   artc_meta_id, retries)
+                self.tracer.mark(artc_meta_id, 'dead_letter')
+                self.rmq_connection.dead_letter_message(
+                    message, 'artifact not found')
+            else:
+                delay = min(CFG.eiffelactory.retry_initial_delay *
+                            CFG.eiffelactory.retry_backoff ** retries,
+                            CFG.eiffelactory.retry_max_delay)
+                self.tracer.mark(artc_meta_id, 'park')
+                self.rmq_connection.park_message(message, retries + 1, delay)
+                if self.duplicate_filter is not None:
+                    self.duplicate_filter.forget(artc_meta_id)
+        except self.rmq_connection.republish_errors as ex:
+            LOGGER_APP.error("Requeuing ArtC '%s', parking it failed: %s",
+                             artc_meta_id, ex)
+            self._settle_message(artc_meta_id, message, False)
+            return
+        self._settle_message(artc_meta_id, message, True)
+
+    def _retry_due_lookups(self):
+        """
+        Retries all lookups that are due, bypassing the lookup cache. Due
+        lookups for the same artifact share one query. Retries wait until
+        the Artifactory circuit breaker is closed, leaving the trial query
+        of a half-open breaker to consumed events.
+        """
+        if self._artifactory_is_unavailable():
+            return
+        due_entries = self.retry_scheduler.pop_due()
+        if not due_entries:
+            return
+
+        lookups = list({entry.lookup: None for entry in due_entries})
+        try:
+            results = self.artifactory_connection.\
+                find_artifacts_on_artifactory(lookups, use_cache=False)
+        except artifactory.ArtifactoryUnavailableError as ex:
+            LOGGER_APP.error("Retried lookups failed, Artifactory is "
+                             "unavailable: %s", ex)
+            results = {}
+        self._on_retried_lookups_done(due_entries, results)
+
+    def _on_retried_lookups_done(self, due_entries, results):
+        """
+        Publishes ArtP events for the retried lookups that found their
+        artifact and reschedules the others.
+        :param due_entries: the retried RetryEntry objects
+        :param results: dict mapping each lookup to its results
+        """
+        for entry in due_entries:
+            artifact = results.get(entry.lookup)
+            if artifact:
+                self._on_artifact_lookup_done(entry.artc_meta_id,
+                                              entry.lookup, artifact)
             else:
-                self._publish_artp_event(artc_meta_id, artifact[0])
+                self.retry_scheduler.reschedule(entry)
+
+        LOGGER_APP.debug("Retried %d lookups, retry queue stats: %s",
+                         len(due_entries), self.retry_scheduler.stats())
+
+    def _artifactory_is_unavailable(self):
+        return self.artifactory_connection.circuit_breaker.state != \
+            flowcontrol.CLOSED
 
-    def _publish_artp_event(self, artc_meta_id, artifact):
+    def _check_circuit_breaker(self):
+        """
+        Pauses consuming while the Artifactory circuit breaker is open, so
+        that events stay on the broker instead of failing. While the breaker
+        is half-open the consumer takes one message at a time, whose lookup
+        is the trial query, and it gets its full prefetch_count back once
+        the breaker is closed.
+        """
+        state = self.artifactory_connection.circuit_breaker.state
+        if state == flowcontrol.OPEN:
+            self.rmq_connection.pause_consuming()
+        elif state == flowcontrol.HALF_OPEN:
+            self.rmq_connection.resume_consuming(prefetch_count=1)
+        else:
+            self.rmq_connection.resume_consuming()
+
+    def _publish_artp_event(self, artc_meta_id, artifact, on_published=None):
         """
         Creates and ArtifactPublished event and sends it to RabbitMQ exchange
         :param artc_meta_id: the id of ArtifactCreated event
-        :param artifact: the results dictionary returned from Artifactory by the
-        AQL query.
+        :param artifact: the results dictionary returned from Artifactory by
+        the AQL query.
+        :param on_published: called with True when the event has been
+        published, or False if the broker didn't confirm it
         """
 
         location = '{}/{}/{}/{}'.format(CFG.artifactory.url,
@@ -83,29 +660,320 @@ class App:
                                         artifact['path'],
                                         artifact['name'])
 
-        artp_event = eiffel.create_artifact_published_event(
-            artc_meta_id, [eiffel.Location(location)])
-
-        artp_event_json = json.dumps(utils.remove_none_from_dict(artp_event))
+        with self.stages['build'].time():
+            artp_event_body = eiffel.render_artifact_published_event(
+                artc_meta_id, [eiffel.Location(location)])
 
-        self.rmq_connection.publish_message(json.loads(artp_event_json))
+        self.tracer.mark(artc_meta_id, 'publish')
+        with self.stages['publish'].time():
+            self.rmq_connection.publish_message(artp_event_body,
+                                                on_published)
+        self.published.inc()
 
         LOGGER_ARTIFACTS.info(artifact)
-        LOGGER_PUBLISHED.info(artp_event_json)
+        LOGGER_PUBLISHED.info(artp_event_body)
 
     def run(self):
         """
-        Starts the app by starting to listen to RabbitMQ messages.
+        Starts the app by starting to listen to RabbitMQ messages. When
+        consuming stops, the pending lookups are flushed before the
+        connections are closed.
         """
         self.rmq_connection.read_messages()
+        if self.lookup_batcher is not None:
+            self.lookup_batcher.flush()
+        self.rmq_connection.close_connection()
+        self.artifactory_connection.close()
 
     def _signal_handler(self, signal_received, frame):
         """
-        Method for handling Ctrl-C. The two unused arguments have to be there,
-        otherwise it won't work
+        Method for handling Ctrl-C and SIGTERM. Only stops consuming, run then
+        finishes up and closes the connections. The two unused arguments have
+        to be there, otherwise it won't work
         :param signal_received:
         :param frame:
         :return:
         """
+        self.rmq_connection.consuming = False
+
+
+class AsyncApp(App):
+    """
+    App that processes events on an asyncio event loop. Artifactory lookups
+    for different events run concurrently, up to the configured concurrency,
+    while RabbitMQ messages keep being consumed and acknowledged.
+    """
+    def __init__(self):
+        super().__init__()
+        self.async_artifactory_connection = \
+            artifactory.AsyncArtifactoryConnection(
+                self.artifactory_connection, CFG.artifactory.concurrency)
+        if self.lookup_batcher is not None:
+            LOGGER_APP.warning("Lookup batching is not used in async mode.")
+            self.rmq_connection.tick_callbacks.remove(
+                self.lookup_batcher.flush_if_due)
+            self.lookup_batcher = None
+        self.loop = None
+        self.tasks = set()
+
+    def on_message_received(self, event, message):
+        """
+        Callback method passed to RabbitMQConnection. Starts a task that
+        processes the event and acks the message when it's done.
+        :param event: the decoded Eiffel event
+        :param message: the RabbitMQ message
+        :return:
+        """
+        if not self._accept_event(event, message):
+            return
+        self._start_task(self._process_event(event, message))
+
+    async def _process_event(self, event, message):
+        artc_meta_id = event['meta']['id']
+        try:
+            with self.stages['parse'].time():
+                lookup = self._create_lookup(event['data']['identity'])
+            self.tracer.mark(artc_meta_id, 'lookup_start')
+            with self.stages['lookup'].time():
+                artifact = await self.async_artifactory_connection.\
+                    find_artifact_on_artifactory(
+                        *lookup, use_cache=not self._is_parked(message))
+            self.tracer.mark(artc_meta_id, 'lookup_end')
+            self._on_artifact_lookup_done(artc_meta_id, lookup, artifact,
+                                          message)
+        except artifactory.ArtifactoryUnavailableError as ex:
+            LOGGER_APP.error("Requeuing ArtC '%s', Artifactory is "
+                             "unavailable: %s", artc_meta_id, ex)
+            self._settle_message(artc_meta_id, message, False)
+        except Exception:
+            LOGGER_APP.exception("Failed to process event: %s", event)
+            self._settle_message(artc_meta_id, message, False,
+                                 requeue=False)
+
+    def _retry_due_lookups(self):
+        if self._artifactory_is_unavailable():
+            return
+        due_entries = self.retry_scheduler.pop_due()
+        if due_entries:
+            self._start_task(self._retry_lookups(due_entries))
+
+    async def _retry_lookups(self, due_entries):
+        lookups = list({entry.lookup: None for entry in due_entries})
+        try:
+            results = await self.async_artifactory_connection.\
+                find_artifacts_on_artifactory(lookups, use_cache=False)
+        except artifactory.ArtifactoryUnavailableError as ex:
+            LOGGER_APP.error("Retried lookups failed, Artifactory is "
+                             "unavailable: %s", ex)
+            results = {}
+        self._on_retried_lookups_done(due_entries, results)
+
+    def _start_task(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def run(self):
+        """
+        Starts the app by running the event loop until a signal is received.
+        """
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        await self.rmq_connection.read_messages_async(ASYNC_POLL_INTERVAL)
+        if self.tasks:
+            LOGGER_APP.info("Waiting for %d events in progress.",
+                            len(self.tasks))
+            await asyncio.gather(*self.tasks, return_exceptions=True)
         self.rmq_connection.close_connection()
-        sys.exit(0)
+        self.async_artifactory_connection.close()
+
+    def _signal_handler(self, signal_received, frame):
+        """
+        Stops consuming, the event loop then finishes the events in progress
+        and closes the connections.
+        """
+        self.rmq_connection.consuming = False
+
+
+class WorkerApp(App):
+    """
+    App that looks up artifacts on a pool of worker threads or processes,
+    while RabbitMQ messages keep being consumed. Each message is acked when
+    its own event has been processed, in any order, and at most
+    prefetch_count events are in progress.
+    """
+    def __init__(self):
+        super().__init__()
+        if self.lookup_batcher is not None:
+            LOGGER_APP.warning("Lookup batching is not used in workers mode.")
+            self.rmq_connection.tick_callbacks.remove(
+                self.lookup_batcher.flush_if_due)
+            self.lookup_batcher = None
+        self.process_workers = CFG.eiffelactory.worker_type == 'process'
+        limit = None
+        if self.process_workers:
+            # the worker processes have their own Artifactory connections,
+            # the lookups are limited and their outcomes recorded here so
+            # that the flow control of the app covers them
+            limit = lambda: self.artifactory_connection.limiter.current_limit
+        self.worker_pool = workers.WorkerPool(
+            CFG.eiffelactory.worker_type,
+            CFG.eiffelactory.workers,
+            CFG.rabbitmq.prefetch_count or CFG.eiffelactory.workers,
+            CFG.filename,
+            limit)
+        if self.process_workers:
+            self.find_artifact = workers.find_artifact_in_process
+        else:
+            self.find_artifact = self._find_artifact
+        self.rmq_connection.add_tick_callback(self.worker_pool.handle_done,
+                                              WORKER_CHECK_INTERVAL)
+
+    def _find_artifact(self, lookup, use_cache=True):
+        return self.artifactory_connection.find_artifact_on_artifactory(
+            *lookup, use_cache=use_cache)
+
+    def on_message_received(self, event, message):
+        """
+        Callback method passed to RabbitMQConnection. Hands the lookup of the
+        event to the worker pool.
+        :param event: the decoded Eiffel event
+        :param message: the RabbitMQ message
+        :return:
+        """
+        if not self._accept_event(event, message):
+            return
+        try:
+            with self.stages['parse'].time():
+                lookup = self._create_lookup(event['data']['identity'])
+        except Exception:
+            LOGGER_APP.exception("Rejecting invalid event: %s", event)
+            self._settle_message(event['meta']['id'], message, False,
+                                 requeue=False)
+            return
+        if self.process_workers and self._process_indexed_lookup(
+                event, message, lookup):
+            return
+        if self.process_workers and not self._start_process_lookup():
+            LOGGER_APP.error("Requeuing ArtC '%s', the Artifactory circuit "
+                             "breaker is open", event['meta']['id'])
+            self._settle_message(event['meta']['id'], message, False)
+            return
+        self.tracer.mark(event['meta']['id'], 'lookup_start')
+        self.worker_pool.submit(
+            functools.partial(self._on_worker_done, event, message, lookup,
+                              time.perf_counter()),
+            self.find_artifact, lookup, not self._is_parked(message))
+
+    def _on_worker_done(self, event, message, lookup, submitted, future):
+        """
+        Publishes the ArtP event for a finished lookup and acks the message.
+        The message is requeued if Artifactory was unavailable and rejected
+        if processing failed in any other way.
+        """
+        self.stages['lookup'].observe(time.perf_counter() - submitted)
+        artc_meta_id = event['meta']['id']
+        self.tracer.mark(artc_meta_id, 'lookup_end')
+        try:
+            self._on_artifact_lookup_done(
+                artc_meta_id, lookup,
+                self._lookup_result(future, time.perf_counter() - submitted),
+                message)
+        except artifactory.ArtifactoryUnavailableError as ex:
+            LOGGER_APP.error("Requeuing ArtC '%s', Artifactory is "
+                             "unavailable: %s", artc_meta_id, ex)
+            self._settle_message(artc_meta_id, message, False)
+        except Exception:
+            LOGGER_APP.exception("Rejecting ArtC '%s', processing failed",
+                                 artc_meta_id)
+            self._settle_message(artc_meta_id, message, False,
+                                 requeue=False)
+
+    def _process_indexed_lookup(self, event, message, lookup):
+        """
+        Processes the event right away if the artifact index of the app
+        answers its lookup. The worker processes don't open the index.
+        :return: True if the lookup was answered from the index
+        """
+        artifact = self.artifactory_connection.find_artifact_in_index(
+            *lookup[:2])
+        if artifact is None:
+            return False
+        artc_meta_id = event['meta']['id']
+        try:
+            self._on_artifact_lookup_done(artc_meta_id, lookup, artifact,
+                                          message)
+        except Exception:
+            LOGGER_APP.exception("Rejecting ArtC '%s', processing failed",
+                                 artc_meta_id)
+            self._settle_message(artc_meta_id, message, False,
+                                 requeue=False)
+        return True
+
+    def _start_process_lookup(self):
+        """
+        Asks the circuit breaker and the concurrency limiter of the app for
+        a lookup in a worker process. The limiter doesn't block, since
+        finished lookups are handled first until fewer than its limit are in
+        flight.
+        :return: False if the circuit breaker is open
+        """
+        self.worker_pool.wait_for_capacity()
+        if not self.artifactory_connection.circuit_breaker.allow_request():
+            return False
+        self.artifactory_connection.limiter.acquire()
+        return True
+
+    def _lookup_result(self, future, elapsed):
+        """
+        :param future: the future of a finished lookup
+        :param elapsed: seconds since the lookup was submitted
+        :return: the results of the lookup. The outcome and latency of a
+        lookup in a worker process are fed to the circuit breaker and the
+        concurrency limiter of the app.
+        :raises ArtifactoryUnavailableError: if the lookup failed
+        """
+        if not self.process_workers:
+            return future.result()
+        connection = self.artifactory_connection
+        try:
+            artifact, latency = future.result()
+        except Exception:
+            connection.limiter.release(elapsed, False)
+            connection.circuit_breaker.record_failure()
+            raise
+        connection.limiter.release(latency)
+        connection.circuit_breaker.record_success(latency)
+        return artifact
+
+    def run(self):
+        """
+        Starts the app by starting to listen to RabbitMQ messages. When
+        consuming stops, the events in progress are finished and acked
+        before the connections are closed.
+        """
+        self.rmq_connection.read_messages()
+        self.worker_pool.shutdown()
+        self.rmq_connection.close_connection()
+        self.artifactory_connection.close()
+
+    def _signal_handler(self, signal_received, frame):
+        """
+        Stops consuming, run then finishes the events in progress and closes
+        the connections.
+        """
+        self.rmq_connection.consuming = False
+
+
+def create_app():
+    """
+    Creates the App for the mode configured in the eiffelactory section.
+    :return: an App, an AsyncApp or a WorkerApp
+    """
+    if CFG.eiffelactory.mode == 'async':
+        return AsyncApp()
+    if CFG.eiffelactory.mode == 'workers':
+        return WorkerApp()
+    return App()
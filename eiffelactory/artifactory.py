@@ -2,15 +2,155 @@
 Module for querying Artifactory to confirm the presence of the artifacts from
 the received Eiffel ArtC events.
 """
+import asyncio
+import codecs
+import concurrent.futures
+import datetime
+import functools
+import itertools
+import json
 import logging
+import re
+import threading
+import time
 
 import requests
-from requests.auth import HTTPBasicAuth
-from kombu.utils import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from eiffelactory import cache
+from eiffelactory import codec
+from eiffelactory import endpoints
+from eiffelactory import flowcontrol
+from eiffelactory import index
+from eiffelactory import utils
+
+# AQL searches are read-only, so retrying the POST is safe
+_RETRY_METHODS = frozenset(['GET', 'POST'])
+_RETRY_STATUSES = (502, 503, 504)
+
+_AQL_FIND_PATTERN = re.compile(r'^\s*(\w+\.find)\(\s*')
+_AQL_CRITERIA_DECODER = json.JSONDecoder()
+_AQL_RESULTS_START = re.compile(r'"results"\s*:\s*\[')
+_AQL_LIMIT_PATTERN = re.compile(r'\.limit\(\s*\d+\s*\)\s*$')
+
+# One result is a match, a second one is enough to know that the lookup is
+# ambiguous, so single lookups never need more than two results
+MAX_LOOKUP_RESULTS = 2
+
+_RESPONSE_CHUNK_SIZE = 8192
+# Fetches the items modified since the last index sync, with the build urls
+# the items are related to
+_INDEX_SYNC_QUERY = 'items.find({{"modified":{{"$gte":"{since}"}}}})' \
+                    '.include("name","repo","path","modified",' \
+                    '"artifact.module.build.url")'
+# number of items parsed before they are added to the index
+_INDEX_SYNC_CHUNK_SIZE = 500
+# Artifactory attaches build info to items after they are deployed, without
+# changing their modification time, so every sync fetches the items modified
+# within this window again to pick up their build urls
+_INDEX_RESYNC_WINDOW = datetime.timedelta(minutes=10)
+# the index isn't used if it hasn't been synced for this many poll intervals
+_INDEX_MAX_MISSED_SYNCS = 2
+
+# returned when batched results can't be mapped back to their lookups
+_NAME_MISSING = object()
+# the rest of a response is read after an early stop if it is smaller than
+# this, so the connection can go back to the pool instead of being dropped
+_RESPONSE_DRAIN_LIMIT = 65536
+
+
+class ArtifactoryUnavailableError(Exception):
+    """
+    Raised when Artifactory can't be reached, fails with a server error or
+    is considered overloaded.
+    """
+
+
+class CircuitOpenError(ArtifactoryUnavailableError):
+    """
+    Raised instead of sending a query while the circuit breaker is open.
+    """
+
+
+def _dump_criteria(criteria):
+    return codec.dumps(criteria).decode(codec.CONTENT_ENCODING)
+
+
+def iter_aql_results(chunks):
+    """
+    Incrementally parses the results array of an AQL response, yielding each
+    result as soon as it has been received. Only the unparsed part of the
+    response is kept in memory.
+
+    :param chunks: iterable of bytes making up the AQL response body
+    :return: generator of result dicts
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    in_results = False
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        if not in_results:
+            match = _AQL_RESULTS_START.search(buffer)
+            if not match:
+                continue
+            in_results = True
+            buffer = buffer[match.end():]
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == ']':
+                return
+            try:
+                result, position = _AQL_CRITERIA_DECODER.raw_decode(buffer,
+                                                                    position)
+            except ValueError:
+                # the result hasn't been received completely yet
+                break
+            yield result
+        buffer = buffer[position:]
+
+    if in_results and buffer.strip():
+        raise ValueError('AQL response ended in the middle of the results')
+
+
+def _create_retry(max_retries):
+    """
+    Creates the connection-level retry policy for the Artifactory session.
+    Supports both the old and the new urllib3 keyword for retried methods.
+
+    :param max_retries: the maximum number of retries per request
+    :return: a urllib3 Retry object
+    """
+    options = dict(total=max_retries,
+                   backoff_factor=0.2,
+                   status_forcelist=_RETRY_STATUSES,
+                   raise_on_status=False)
+    try:
+        return Retry(allowed_methods=_RETRY_METHODS, **options)
+    except TypeError:
+        return Retry(method_whitelist=_RETRY_METHODS, **options)
+
+
+def _close_hedged_response(future):
+    """
+    Closes the response of the slower of two hedged queries, so that its
+    connection is released.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    response = future.result()
+    if response is not None:
+        response.close()
 
 
 class ArtifactoryConnection:
-    def __init__(self, artifactory_config):
+    def __init__(self, artifactory_config, use_index=True):
         self.artifacts_logger = logging.getLogger('artifacts')
         self.app_logger = logging.getLogger('app')
         self.aql_domain_search_string = artifactory_config.aql_search_string
@@ -18,45 +158,723 @@ class ArtifactoryConnection:
             '/api/search/aql/'
         self.username = artifactory_config.username
         self.password = artifactory_config.password
+        self.timeout = (artifactory_config.connect_timeout,
+                        artifactory_config.read_timeout)
+        self.pool_stats_interval = artifactory_config.pool_stats_interval
+        self.query_count = 0
+        self.endpoints = endpoints.EndpointPool(
+            artifactory_config.urls,
+            artifactory_config.eject_failures,
+            artifactory_config.eject_duration,
+            artifactory_config.hedge_percentile)
+        self.hedged_queries = 0
+        self.hedge_executor = None
+        if artifactory_config.hedging and len(self.endpoints) > 1:
+            self.hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=artifactory_config.pool_size)
+        self.session = self._create_session(artifactory_config.pool_size,
+                                            artifactory_config.max_retries)
+        self.limiter = flowcontrol.AimdLimiter(
+            artifactory_config.concurrency,
+            artifactory_config.min_concurrency,
+            artifactory_config.concurrency,
+            artifactory_config.target_latency)
+        self.circuit_breaker = flowcontrol.CircuitBreaker(
+            artifactory_config.breaker_failure_threshold,
+            artifactory_config.breaker_latency_threshold,
+            artifactory_config.breaker_reset_timeout)
+        self.index = None
+        # connections of worker processes leave the index to the app process
+        if use_index and artifactory_config.index != 'none':
+            self.index = index.create_index(
+                artifactory_config.index,
+                utils.worker_filename(artifactory_config.index_path))
+            self.index_history = datetime.timedelta(
+                seconds=artifactory_config.index_history)
+            self.index_poll_interval = artifactory_config.index_poll_interval
+            self.index_synced_at = None
+            self.index_hits = 0
+            self._index_thread = None
+            self._index_stopped = threading.Event()
+        self.exact_resolution = artifactory_config.resolution_mode == 'exact'
+        self.exact_repo_template = artifactory_config.exact_repo
+        self.exact_path_template = artifactory_config.exact_path
+        self.cache = None
+        if artifactory_config.cache_size > 0:
+            self.cache = cache.LookupCache(artifactory_config.cache_size,
+                                           artifactory_config.cache_hit_ttl,
+                                           artifactory_config.cache_miss_ttl)
+
+    def _create_session(self, pool_size, max_retries):
+        """
+        Creates a keep-alive session with a connection pool that is reused
+        for every AQL query.
+        :param pool_size: the maximum number of pooled connections
+        :param max_retries: the maximum number of retries per request
+        :return: a requests Session
+        """
+        session = requests.Session()
+        session.auth = (self.username, self.password)
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints),
+                              pool_maxsize=pool_size,
+                              max_retries=_create_retry(max_retries))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def pool_stats(self):
+        """
+        Collects connection statistics from the session's connection pools.
+        :return: dict with the number of requests, new and reused connections
+        """
+        requests_sent = 0
+        new_connections = 0
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                new_connections += pool.num_connections
+        return {'requests': requests_sent,
+                'new_connections': new_connections,
+                'reused_connections': max(requests_sent - new_connections, 0)}
+
+    def log_pool_stats(self):
+        stats = self.pool_stats()
+        self.app_logger.info("Artifactory connection pool: %d requests, "
+                             "%d new connections, %d reused connections",
+                             stats['requests'], stats['new_connections'],
+                             stats['reused_connections'])
+        if self.cache is not None:
+            stats = self.cache.stats()
+            self.app_logger.info("Artifactory lookup cache: %d entries, "
+                                 "%d hits, %d misses, %d evictions, "
+                                 "%d expirations", stats['size'],
+                                 stats['hits'], stats['misses'],
+                                 stats['evictions'], stats['expirations'])
+        stats = self.flow_stats()
+        self.app_logger.info("Artifactory flow control: concurrency limit %d, "
+                             "%d in flight, circuit breaker %s (opened %d "
+                             "times)", stats['concurrency_limit'],
+                             stats['in_flight'], stats['breaker_state'],
+                             stats['breaker_opened'])
+        if len(self.endpoints) > 1:
+            for url, stats in self.endpoints.stats().items():
+                self.app_logger.info("Artifactory node %s: %d requests, %d "
+                                     "outstanding, ejected %d times%s", url,
+                                     stats['requests'], stats['outstanding'],
+                                     stats['times_ejected'],
+                                     ', currently ejected'
+                                     if stats['ejected'] else '')
+            self.app_logger.info("Artifactory hedged queries: %d",
+                                 self.hedged_queries)
+
+    def flow_stats(self):
+        """
+        :return: dict with the current concurrency limit, the number of
+        queries in flight and the circuit breaker state
+        """
+        return {'concurrency_limit': self.limiter.current_limit,
+                'in_flight': self.limiter.in_flight,
+                'breaker_state': self.circuit_breaker.state,
+                'breaker_opened': self.circuit_breaker.times_opened}
+
+    def close(self):
+        """
+        Logs the final pool statistics and closes the pooled connections.
+        """
+        self.log_pool_stats()
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=True)
+        self.session.close()
+        if self.index is not None:
+            self._index_stopped.set()
+            if self._index_thread is not None:
+                self._index_thread.join()
+            self.index.close()
+
+    def start_index_sync(self):
+        """
+        Starts a thread that syncs the artifact index every
+        index_poll_interval seconds until the connection is closed. Lookups
+        are sent to Artifactory until the first sync is done.
+        """
+        if self.index is None or self._index_thread is not None:
+            return
+        self._index_thread = threading.Thread(target=self._sync_index_forever,
+                                              name='artifact-index-sync',
+                                              daemon=True)
+        self._index_thread.start()
+
+    def _sync_index_forever(self):
+        while True:
+            try:
+                self.sync_index()
+            except ArtifactoryUnavailableError as ex:
+                self.app_logger.error("Failed to sync the artifact index: %s",
+                                      ex)
+            if self._index_stopped.wait(self.index_poll_interval):
+                return
+
+    def sync_index(self):
+        """
+        Adds the items modified since shortly before the newest indexed item
+        to the index, and removes items older than index_history. On the
+        first sync all items modified within index_history are fetched. The
+        sync query bypasses the concurrency limiter and the circuit breaker,
+        a slow sync must not hold back or pause lookups.
+        :raises ArtifactoryUnavailableError: if the query failed
+        """
+        started = time.monotonic()
+        oldest = datetime.datetime.now(datetime.timezone.utc) - \
+            self.index_history
+        newest = self.index.newest_modified()
+        since = max(newest - _INDEX_RESYNC_WINDOW, oldest) if newest \
+            else oldest
+        query_string = _INDEX_SYNC_QUERY.format(
+            since=index.format_modified(since))
+        self.artifacts_logger.debug(query_string)
+
+        added = self._read_aql_query(query_string, self._add_to_index)
+        self.index.prune(oldest)
+        self.index_synced_at = started
+        self.app_logger.debug("Artifact index synced, %s items fetched, "
+                              "%d items indexed", added, len(self.index))
+
+    def _add_to_index(self, results):
+        items = []
+        added = 0
+        for result in results:
+            items.extend(index.items_from_aql_result(result))
+            if len(items) >= _INDEX_SYNC_CHUNK_SIZE:
+                self.index.add(items)
+                added += len(items)
+                items = []
+        self.index.add(items)
+        return added + len(items)
+
+    def find_artifact_in_index(self, artifact_filename,
+                               build_path_substring):
+        """
+        Looks the artifact up in the artifact index only.
+        :param artifact_filename: the artifact filename
+        :param build_path_substring: the substring from the build path
+        :return: the indexed results, or None if the lookup has to be sent to
+        Artifactory
+        """
+        return self._find_in_index((artifact_filename, build_path_substring))
+
+    def _find_in_index(self, lookup):
+        """
+        :param lookup: tuple: the artifact filename and the build path
+        substring
+        :return: the indexed results, or None if the lookup isn't indexed or
+        the index is out of date, and has to be sent to Artifactory
+        """
+        if self.index is None or self.index_synced_at is None or \
+                time.monotonic() - self.index_synced_at > \
+                _INDEX_MAX_MISSED_SYNCS * self.index_poll_interval:
+            return None
+        results = self.index.find(lookup[0], lookup[1], MAX_LOOKUP_RESULTS)
+        if not results:
+            return None
+        self.index_hits += 1
+        return results
 
     def _format_aql_query(self, artifact_filename, build_path_substring):
         return self.aql_domain_search_string.format(
             artifact_name=artifact_filename,
             build_path_substring=build_path_substring).replace('\n', '')
 
-    def _execute_aql_query(self, query_string):
+    def _split_aql_query(self, query_string):
+        """
+        Splits a formatted AQL query into its domain, its find criteria and
+        the rest of the query (include, sort, limit etc.).
+        :param query_string: the formatted AQL query
+        :return: tuple: the domain, the criteria as a dict and the tail, or
+        None if the query can't be split
+        """
+        match = _AQL_FIND_PATTERN.match(query_string)
+        if not match:
+            return None
+        try:
+            criteria, end = _AQL_CRITERIA_DECODER.raw_decode(query_string,
+                                                              match.end())
+        except ValueError:
+            return None
+        tail = query_string[end:].lstrip()
+        if not isinstance(criteria, dict) or not tail.startswith(')'):
+            return None
+        return match.group(1), criteria, tail[1:]
+
+    def _format_batched_aql_query(self, lookups):
+        """
+        Combines the AQL queries for several lookups into a single query,
+        joining their find criteria with $or.
+        :param lookups: list of (artifact_filename, build_path_substring)
+        :return: the combined query, or None if the configured
+        aql_search_string can't be combined
+        """
+        domain, tail = None, None
+        criteria = []
+        for lookup in lookups:
+            split_query = self._split_aql_query(
+                self._format_aql_query(*lookup))
+            if split_query is None:
+                return None
+            domain, lookup_criteria, tail = split_query
+            criteria.append(lookup_criteria)
+        return '{}({}){}'.format(domain, _dump_criteria({'$or': criteria}),
+                                 tail)
+
+    def _format_exact_criteria(self, artifact_filename, build_path_substring,
+                               directories):
+        """
+        Maps the purl of a lookup to the repo, path and name of the artifact
+        with the configured exact_repo and exact_path templates.
+        :param artifact_filename: the artifact filename
+        :param build_path_substring: the build path from the purl
+        :param directories: the intermediate directories from the purl
+        :return: dict: the AQL find criteria for the artifact
+        """
+        directory_list = [directory for directory in directories.split('/')
+                          if directory]
+        fields = {'artifact_name': artifact_filename,
+                  'build_path': build_path_substring.strip('/'),
+                  'directories': '/'.join(directory_list),
+                  'first_directory': ''.join(directory_list[:1]),
+                  'other_directories': '/'.join(directory_list[1:])}
+        path = self.exact_path_template.format(**fields).strip('/')
+        return {'repo': self.exact_repo_template.format(**fields),
+                'path': path or '.',
+                'name': artifact_filename}
+
+    def _format_exact_aql_query(self, lookups):
+        """
+        Formats an AQL query matching repo, path and name exactly, which
+        Artifactory can answer from its database indexes.
+        :param lookups: list of (artifact_filename, build_path_substring,
+        directories), combined with $or if there are several
+        :return: the AQL query
+        """
+        criteria = [self._format_exact_criteria(*lookup) for lookup in lookups]
+        if len(criteria) > 1:
+            criteria = [{'$or': criteria}]
+        return 'items.find({}).include("name","repo","path")'.format(
+            _dump_criteria(criteria[0]))
+
+    @staticmethod
+    def _add_result_limit(query_string, max_results):
+        """
+        Appends a limit to the query so Artifactory stops searching once it
+        has found max_results items, unless the query already has a limit.
+        :param query_string: the formatted AQL query
+        :param max_results: the maximum number of results
+        :return: the query with a limit
+        """
+        if _AQL_LIMIT_PATTERN.search(query_string):
+            return query_string
+        return '{}.limit({})'.format(query_string, max_results)
+
+    def _post_aql_query(self, query_string):
+        """
+        Sends an AQL query to the least busy Artifactory node without reading
+        the response body. If hedging is enabled and the node hasn't answered
+        within the hedge delay, the query is also sent to a second node and
+        the first answer is used.
+        :param query_string: the AQL query
+        :return: the streamed response, or None if Artifactory rejected the
+        query
+        :raises ArtifactoryUnavailableError: if Artifactory can't be reached
+        or answers with a server error
+        """
+        self.query_count += 1
+        if self.pool_stats_interval and \
+                self.query_count % self.pool_stats_interval == 0:
+            self.log_pool_stats()
+        endpoint = self.endpoints.acquire()
+        if self.hedge_executor is None:
+            return self._post_to_endpoint(endpoint, query_string)
+        return self._post_hedged_query(endpoint, query_string)
+
+    def _post_hedged_query(self, endpoint, query_string):
+        """
+        Sends an AQL query to a node, and to a second node if the first one
+        is slower than the hedge delay.
+        :param endpoint: the node to send the query to first
+        :param query_string: the AQL query
+        :return: the first streamed response, or None if Artifactory
+        rejected the query
+        :raises ArtifactoryUnavailableError: if no node answered successfully
+        """
+        primary = self.hedge_executor.submit(self._post_to_endpoint,
+                                             endpoint, query_string)
+        hedge_delay = self.endpoints.hedge_delay()
+        if hedge_delay is None:
+            return primary.result()
+        try:
+            return primary.result(timeout=hedge_delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        hedge_endpoint = self.endpoints.acquire(exclude=endpoint)
+        if hedge_endpoint is None:
+            return primary.result()
+        self.hedged_queries += 1
+        hedge = self.hedge_executor.submit(self._post_to_endpoint,
+                                           hedge_endpoint, query_string)
+        error = None
+        for future in concurrent.futures.as_completed((primary, hedge)):
+            try:
+                response = future.result()
+            except ArtifactoryUnavailableError as ex:
+                error = ex
+                continue
+            other = hedge if future is primary else primary
+            other.add_done_callback(_close_hedged_response)
+            return response
+        raise error
+
+    def _post_to_endpoint(self, endpoint, query_string):
+        """
+        Sends an AQL query to a node and reports the outcome to the node pool.
+        :param endpoint: the Endpoint acquired from the node pool
+        :param query_string: the AQL query
+        :return: the streamed response, or None if Artifactory rejected the
+        query
+        :raises ArtifactoryUnavailableError: if the node can't be reached or
+        answers with a server error
+        """
+        start = time.monotonic()
+        success = False
         try:
-            response = requests.post(self.artifactory_search_url,
-                                     auth=HTTPBasicAuth(self.username,
-                                                        self.password),
-                                     data=query_string)
-            content = response.content.decode('utf-8')
+            try:
+                response = self.session.post(endpoint.search_url,
+                                             data=query_string,
+                                             timeout=self.timeout,
+                                             stream=True)
+            except OSError as ex:
+                raise ArtifactoryUnavailableError(str(ex)) from ex
             if response.status_code == 200:
-                return content
+                success = True
+                return response
+            response.close()
+            if response.status_code >= 500:
+                raise ArtifactoryUnavailableError(
+                    "Artifactory error: {}, {}".format(response.status_code,
+                                                       response.reason))
+            success = True
             self.app_logger.error("Artifactory error: %d, %s",
                                   response.status_code, response.reason)
             return None
-        except OSError as ex:
-            self.app_logger.error(ex)
+        finally:
+            self.endpoints.release(endpoint, time.monotonic() - start,
+                                   success)
+
+    @staticmethod
+    def _drain_response(chunks):
+        drained = 0
+        for chunk in chunks:
+            drained += len(chunk)
+            if drained > _RESPONSE_DRAIN_LIMIT:
+                break
+
+    def _read_aql_query(self, query_string, read_results):
+        """
+        Sends an AQL query and lets read_results consume the stream-parsed
+        results.
+        :param query_string: the AQL query
+        :param read_results: callable taking an iterator over the results
+        :return: the value returned by read_results, or None if Artifactory
+        rejected the query
+        :raises ArtifactoryUnavailableError: if the query failed
+        """
+        response = self._post_aql_query(query_string)
+        if response is None:
+            return None
+        chunks = response.iter_content(_RESPONSE_CHUNK_SIZE)
+        try:
+            value = read_results(iter_aql_results(chunks))
+            self._drain_response(chunks)
+        except (OSError, ValueError) as ex:
+            raise ArtifactoryUnavailableError(
+                "Failed to read AQL response: {}".format(ex)) from ex
+        finally:
+            response.close()
+        return value
+
+    def _run_aql_query(self, query_string, read_results):
+        """
+        Sends an AQL query under flow control and lets read_results consume
+        the stream-parsed results. The latency and outcome of the query are
+        fed to the concurrency limiter and the circuit breaker.
+        :param query_string: the AQL query
+        :param read_results: callable taking an iterator over the results
+        :return: the value returned by read_results, or None if Artifactory
+        rejected the query
+        :raises ArtifactoryUnavailableError: if the query failed or the
+        circuit breaker is open
+        """
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("Artifactory circuit breaker is open")
+        self.limiter.acquire()
+        start = time.monotonic()
+        success = False
+        try:
+            value = self._read_aql_query(query_string, read_results)
+            success = True
+            return value
+        finally:
+            latency = time.monotonic() - start
+            self.limiter.release(latency, success)
+            if success:
+                self.circuit_breaker.record_success(latency)
+            else:
+                self.circuit_breaker.record_failure()
+
+    def _execute_aql_query(self, query_string, max_results=None):
+        """
+        Sends an AQL query and stream-parses the results, stopping as soon
+        as max_results results have been read.
+        :param query_string: the AQL query
+        :param max_results: the maximum number of results to read, or None to
+        read all of them
+        :return: list of results, or None if Artifactory rejected the query
+        :raises ArtifactoryUnavailableError: if the query failed
+        """
+        return self._run_aql_query(
+            query_string,
+            lambda results: list(itertools.islice(results, max_results)))
 
     def find_artifact_on_artifactory(self, artifact_filename,
-                                     build_path_substring):
+                                     build_path_substring, directories=None,
+                                     use_cache=True):
         """
         Queries Artifactory for the artifact, using the filename and the path
         substring from the purl, where it tries to match it with the build url
         present on Artifactory
         :param artifact_filename: tuple: the artifact filename
         :param build_path_substring: the substring from the build path
+        :param directories: the intermediate directories from the purl, used
+        to look up the exact path first in exact resolution mode
+        :param use_cache: False to bypass the lookup cache for this lookup
         :return:
+        :raises ArtifactoryUnavailableError: if the query failed
+        """
+        lookup = (artifact_filename, build_path_substring, directories)
+        if use_cache and self.cache is not None:
+            results = self.cache.get(self._cache_key(lookup))
+            if results is not cache.MISSING:
+                return results
+
+        results = self._find_in_index(lookup)
+        if results is None:
+            results = self._query_artifact(artifact_filename,
+                                           build_path_substring, directories)
+        self._cache_results(lookup, results)
+        return results
+
+    def find_artifacts_on_artifactory(self, lookups, use_cache=True):
+        """
+        Queries Artifactory for several artifacts at once. Lookups with the
+        same artifact filename are sent in separate queries, since the
+        filename is used to map the results back to the lookups.
+        :param lookups: list of (artifact_filename, build_path_substring) or
+        (artifact_filename, build_path_substring, directories) tuples
+        :param use_cache: False to bypass the lookup cache for these lookups
+        :return: dict mapping each lookup to its results, or to None if
+        Artifactory rejected the query
+        :raises ArtifactoryUnavailableError: if a query failed
+        """
+        results = {}
+        if use_cache and self.cache is not None:
+            for lookup in lookups:
+                cached_results = self.cache.get(self._cache_key(lookup))
+                if cached_results is not cache.MISSING:
+                    results[lookup] = cached_results
+            lookups = [lookup for lookup in lookups if lookup not in results]
+
+        for lookup in lookups:
+            indexed_results = self._find_in_index(lookup)
+            if indexed_results is not None:
+                results[lookup] = indexed_results
+                self._cache_results(lookup, indexed_results)
+        lookups = [lookup for lookup in lookups if lookup not in results]
+
+        if lookups:
+            queried_results = self._query_artifacts(lookups)
+            for lookup, lookup_results in queried_results.items():
+                self._cache_results(lookup, lookup_results)
+            results.update(queried_results)
+        return results
+
+    def _cache_key(self, lookup):
+        # exact resolution finds the artifact by its directories too, so
+        # lookups that only differ in them can have different results
+        if self.exact_resolution and len(lookup) > 2 and \
+                lookup[2] is not None:
+            return tuple(lookup[:3])
+        return tuple(lookup[:2])
+
+    def _cache_results(self, lookup, results):
+        # failed queries (None) are never cached
+        if self.cache is not None and results is not None:
+            self.cache.put(self._cache_key(lookup), results)
+
+    def _query_artifact(self, artifact_filename, build_path_substring,
+                        directories=None):
+        if self.exact_resolution and directories is not None:
+            query_string = self._format_exact_aql_query(
+                [(artifact_filename, build_path_substring, directories)])
+            self.artifacts_logger.debug(query_string)
+            results = self._execute_aql_query(
+                self._add_result_limit(query_string, MAX_LOOKUP_RESULTS),
+                MAX_LOOKUP_RESULTS)
+            if results:
+                return results
+
+        query_string = self._add_result_limit(
+            self._format_aql_query(artifact_filename, build_path_substring),
+            MAX_LOOKUP_RESULTS)
+        self.artifacts_logger.debug(query_string)
+
+        return self._execute_aql_query(query_string, MAX_LOOKUP_RESULTS)
+
+    @staticmethod
+    def _chunk_by_filename(lookups):
+        """
+        Splits lookups into chunks with distinct artifact filenames.
+        :param lookups: list of lookup tuples
+        :return: generator of lists of lookup tuples
+        """
+        lookups = list(lookups)
+        while lookups:
+            chunk, filenames = [], set()
+            for lookup in lookups:
+                if lookup[0] not in filenames:
+                    filenames.add(lookup[0])
+                    chunk.append(lookup)
+            lookups = [lookup for lookup in lookups if lookup not in chunk]
+            yield chunk
+
+    def _query_artifacts(self, lookups):
+        """
+        Queries Artifactory for several artifacts, combining lookups with
+        distinct artifact filenames into the same AQL query. In exact
+        resolution mode the lookups with directories are first looked up by
+        their exact path, and only the ones not found there are looked up
+        with the wildcard query.
+        :param lookups: list of lookup tuples
+        :return: dict mapping each lookup to its results
+        """
+        results = {}
+        if self.exact_resolution:
+            exact_lookups = [lookup for lookup in lookups
+                             if len(lookup) > 2 and lookup[2] is not None]
+            for chunk in self._chunk_by_filename(exact_lookups):
+                query_string = self._format_exact_aql_query(chunk)
+                results.update(self._query_artifact_chunk(chunk, query_string))
+            lookups = [lookup for lookup in lookups if not results.get(lookup)]
+
+        for chunk in self._chunk_by_filename(lookups):
+            query_string = None
+            if len(chunk) > 1:
+                query_string = self._format_batched_aql_query(
+                    [lookup[:2] for lookup in chunk])
+            if query_string is None:
+                results.update({lookup: self._query_artifact(*lookup[:2])
+                                for lookup in chunk})
+            else:
+                results.update(self._query_artifact_chunk(chunk, query_string))
+        return results
+
+    def _query_artifact_chunk(self, lookups, query_string):
+        """
+        Sends a query combining lookups with distinct artifact filenames and
+        maps the results back to the lookups by filename.
+        :param lookups: list of lookup tuples
+        :param query_string: the combined AQL query
+        :return: dict mapping each lookup to its results
         """
-        query_string = self._format_aql_query(artifact_filename,
-                                              build_path_substring)
         self.artifacts_logger.debug(query_string)
+        results_by_name = self._run_aql_query(query_string,
+                                              self._group_results_by_name)
+        if results_by_name is _NAME_MISSING:
+            self.app_logger.warning("Batched AQL results don't include the "
+                                    "artifact name, querying one by one.")
+            return {lookup: self._query_artifact(*lookup[:2])
+                    for lookup in lookups}
+        if results_by_name is None:
+            return {lookup: None for lookup in lookups}
+        return {lookup: results_by_name.get(lookup[0], [])
+                for lookup in lookups}
+
+    @staticmethod
+    def _group_results_by_name(results):
+        results_by_name = {}
+        for result in results:
+            if 'name' not in result:
+                return _NAME_MISSING
+            name_results = results_by_name.setdefault(result['name'], [])
+            if len(name_results) < MAX_LOOKUP_RESULTS:
+                name_results.append(result)
+        return results_by_name
+
+
+class AsyncArtifactoryConnection:
+    """
+    Asyncio client for Artifactory. Runs the lookups of an
+    ArtifactoryConnection in a thread pool so that up to concurrency lookups
+    can be in flight at the same time, sharing the connection's session pool
+    and lookup cache.
+
+    :param artifactory_connection: the ArtifactoryConnection to use
+    :param concurrency: the maximum number of concurrent lookups
+    """
+
+    def __init__(self, artifactory_connection, concurrency):
+        self.connection = artifactory_connection
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix='artifactory')
+        self._semaphore = None
 
-        content = self._execute_aql_query(query_string)
+    async def _run(self, function, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                return await loop.run_in_executor(
+                    self._executor, functools.partial(function, *args,
+                                                      **kwargs))
+            finally:
+                self.in_flight -= 1
 
-        if content:
-            json_content = json.loads(content)
-            results = json_content['results']
-            return results
-        return None
+    async def find_artifact_on_artifactory(self, artifact_filename,
+                                           build_path_substring,
+                                           directories=None, use_cache=True):
+        """
+        Coroutine version of ArtifactoryConnection.find_artifact_on_artifactory
+        """
+        return await self._run(self.connection.find_artifact_on_artifactory,
+                               artifact_filename, build_path_substring,
+                               directories, use_cache=use_cache)
+
+    async def find_artifacts_on_artifactory(self, lookups, use_cache=True):
+        """
+        Coroutine version of
+        ArtifactoryConnection.find_artifacts_on_artifactory
+        """
+        return await self._run(self.connection.find_artifacts_on_artifactory,
+                               lookups, use_cache=use_cache)
+
+    def close(self):
+        """
+        Waits for running lookups and closes the underlying connection.
+        """
+        self._executor.shutdown(wait=True)
+        self.connection.close()
@@ -0,0 +1,101 @@
+"""
+Module for batching Artifactory lookups. Lookups from several ArtC events are
+collected for a short window and then resolved by a single AQL query.
+"""
+import collections
+import logging
+import time
+
+
+class LookupBatcher:
+    """
+    Collects pending artifact lookups and resolves them in batches.
+
+    A batch is flushed when it holds batch_size distinct lookups or when the
+    oldest pending lookup has waited for batch_window seconds. Lookups for the
+    same artifact filename with different build paths are never put in the
+    same batch, since the results can only be mapped back by filename.
+
+    :param lookup_many: callable taking a list of lookup tuples, starting
+    with the artifact filename and the build path substring, and returning a
+    dict with the results for each tuple, or None if the whole batch failed
+    :param on_result: callable called with (artc_meta_id, lookup, results,
+    message) for every lookup that has been resolved
+    :param on_failure: callable called with (artc_meta_id, lookup, message)
+    for every lookup of a batch that failed
+    :param batch_size: the maximum number of distinct lookups in one batch
+    :param batch_window: the maximum time in seconds a lookup may wait
+    """
+
+    def __init__(self, lookup_many, on_result, on_failure, batch_size,
+                 batch_window):
+        self.app_logger = logging.getLogger('app')
+        self.lookup_many = lookup_many
+        self.on_result = on_result
+        self.on_failure = on_failure
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        # lookup -> [(artc_meta_id, message), ...]
+        self._pending = collections.OrderedDict()
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, artc_meta_id, lookup, message=None):
+        """
+        Adds a lookup to the current batch, flushing it if it is full.
+        :param artc_meta_id: the id of the ArtC event the lookup belongs to
+        :param lookup: tuple starting with the artifact filename and the
+        build path substring
+        :param message: the RabbitMQ message of the ArtC event, handed back
+        with the result so that it is settled when the lookup is done
+        """
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.setdefault(lookup, []).append((artc_meta_id, message))
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush_if_due(self):
+        """
+        Flushes the pending lookups if the oldest one has waited for longer
+        than the batch window. Meant to be called periodically.
+        """
+        if self._pending and \
+                time.monotonic() - self._oldest >= self.batch_window:
+            self.flush()
+
+    def flush(self):
+        """
+        Resolves all pending lookups, in as few AQL queries as possible.
+        """
+        while self._pending:
+            batch = self._take_batch()
+            results = self.lookup_many(list(batch))
+            for key, entries in batch.items():
+                for artc_meta_id, message in entries:
+                    if results is None:
+                        self.on_failure(artc_meta_id, key, message)
+                    else:
+                        self.on_result(artc_meta_id, key, results.get(key),
+                                       message)
+        self._oldest = None
+
+    def _take_batch(self):
+        """
+        Removes and returns up to batch_size pending lookups with distinct
+        artifact filenames.
+        :return: OrderedDict mapping lookups to their ArtC ids and messages
+        """
+        batch = collections.OrderedDict()
+        filenames = set()
+        for key in list(self._pending):
+            if len(batch) >= self.batch_size:
+                break
+            if key[0] in filenames:
+                continue
+            filenames.add(key[0])
+            batch[key] = self._pending.pop(key)
+        return batch
@@ -0,0 +1,86 @@
+"""
+Module with an in-process cache for Artifactory lookups. Both found artifacts
+and lookups without results are cached, with separate time to live.
+"""
+import collections
+import threading
+import time
+
+# Returned by LookupCache.get when a key isn't cached
+MISSING = object()
+
+
+class LookupCache:
+    """
+    Size bounded LRU cache with separate TTLs for hits (lookups that returned
+    artifacts) and misses (lookups that returned no artifacts).
+
+    :param max_size: the maximum number of cached lookups
+    :param hit_ttl: seconds to keep lookups that returned artifacts
+    :param miss_ttl: seconds to keep lookups that returned no artifacts
+    """
+
+    def __init__(self, max_size, hit_ttl, miss_ttl):
+        self.max_size = max_size
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> (expiry time, results)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Gets the cached results for a lookup.
+        :param key: the lookup, as returned by utils.parse_purl
+        :return: the cached results or MISSING
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, results):
+        """
+        Caches the results for a lookup, evicting the least recently used
+        lookup if the cache is full.
+        :param key: the lookup, as returned by utils.parse_purl
+        :param results: the results list returned from Artifactory
+        """
+        ttl = self.hit_ttl if results else self.miss_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        :return: dict with the cache size and hit/miss/eviction counters
+        """
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
@@ -0,0 +1,55 @@
+"""
+Module with the JSON codec used for Eiffel events and AQL queries. Events are
+serialized once to bytes, which are published and logged as they are.
+orjson is used when it is installed, otherwise the standard library json
+with compact separators.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CONTENT_TYPE = 'application/json'
+CONTENT_ENCODING = 'utf-8'
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(obj):
+    # objects such as the Eiffel models are serialized as the dict returned
+    # by their json_fields method
+    json_fields = getattr(obj, 'json_fields', None)
+    if json_fields is None:
+        raise TypeError("Object of type {} is not JSON serializable".format(
+            type(obj).__name__))
+    return json_fields()
+
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'),
+                            default=_default)
+
+
+def dumps(obj):
+    """
+    Serializes an object to compact JSON, keeping the key order of dicts.
+    Other objects with a json_fields method are serialized as the dict it
+    returns.
+    :param obj: the object to serialize
+    :return: the UTF-8 encoded JSON as bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return _ENCODER.encode(obj).encode(CONTENT_ENCODING)
+
+
+def loads(data):
+    """
+    Deserializes JSON.
+    :param data: the JSON as bytes or str
+    :return: the deserialized object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -9,6 +9,7 @@ This allows for safer and easier access of config options.
 Parses option strings into collections or other formats if needed.
 """
 import configparser
+import os
 
 _DEFAULT_AQL_SEARCH_STRING = 'items.find({{"artifact.name":"{artifact_name}",' \
                              '"artifact.module.build.url":{{"$match":"*{' \
@@ -22,7 +23,77 @@ DEFAULT_CONFIG_OPTIONS = {
     'vhost': '/',
     'routing_key': '#',
     'event_sources': None,
-    'aql_search_string': _DEFAULT_AQL_SEARCH_STRING
+    'aql_search_string': _DEFAULT_AQL_SEARCH_STRING,
+    'pool_size': '10',
+    'connect_timeout': '5',
+    'read_timeout': '30',
+    'max_retries': '3',
+    'pool_stats_interval': '100',
+    'batch_size': '1',
+    'batch_window': '0.1',
+    'cache_size': '10000',
+    'cache_hit_ttl': '3600',
+    'cache_miss_ttl': '10',
+    'retry_max_pending': '1000',
+    'retry_initial_delay': '5',
+    'retry_max_delay': '120',
+    'retry_backoff': '2',
+    'retry_max_age': '900',
+    'mode': 'sync',
+    'concurrency': '10',
+    'min_concurrency': '1',
+    'target_latency': '2',
+    'breaker_failure_threshold': '5',
+    'breaker_latency_threshold': '20',
+    'breaker_reset_timeout': '30',
+    'index': 'none',
+    'index_path': 'artifact_index.sqlite',
+    'index_poll_interval': '30',
+    'index_history': '86400',
+    'resolution_mode': 'wildcard',
+    'exact_repo': '{first_directory}',
+    'exact_path': '{other_directories}',
+    'urls': None,
+    'eject_failures': '3',
+    'eject_duration': '30',
+    'hedging': 'false',
+    'hedge_percentile': '95',
+    'worker_type': 'thread',
+    'workers': '10',
+    'confirm_publish': 'false',
+    'publish_batch_size': '50',
+    'publish_batch_window': '0.05',
+    'confirm_timeout': '10',
+    'raw_filter': 'true',
+    'binding_mode': 'routing_key',
+    'binding_routing_key': 'eiffel.*.{event_type}.*.*',
+    'headers_exchange': None,
+    'type_header': 'eiffel-type',
+    'source_header': 'eiffel-source',
+    'processes': None,
+    'dedup_size': '100000',
+    'dedup_window': '3600',
+    'heartbeat': '60',
+    'reconnect_initial_delay': '1',
+    'reconnect_max_delay': '30',
+    'retry_mode': 'memory',
+    'retry_max_attempts': '10',
+    'parking_queue': None,
+    'dead_letter_queue': None,
+    'invalid_events': 'dead-letter',
+    'log_background': 'true',
+    'log_format': 'text',
+    'log_max_bytes': '0',
+    'log_rotate_when': None,
+    'log_backup_count': '5',
+    'received_log_sample_rate': '1',
+    'metrics_port': None,
+    'metrics_host': '127.0.0.1',
+    'trace_sample_rate': '0',
+    'trace_min_duration': '0',
+    'profile_duration': '30',
+    'profile_interval': '0.01',
+    'profile_at_startup': 'false'
 }
 
 
@@ -32,7 +103,9 @@ class Config:
     """
 
     def __init__(self, filename=DEFAULT_CONFIG_FILENAME):
-        self._config = configparser.ConfigParser(defaults=DEFAULT_CONFIG_OPTIONS)
+        self.filename = filename
+        self._config = configparser.ConfigParser(defaults=DEFAULT_CONFIG_OPTIONS,
+                                                 allow_no_value=True)
         self._config.read(filename)
 
         self.rabbitmq = RabbitMQConfig(self._config, 'rabbitmq')
@@ -64,6 +137,9 @@ class ConfigSection:
     def getboolean(self, key):
         return self._config.getboolean(self._section, key)
 
+    def getfloat(self, key):
+        return self._config.getfloat(self._section, key)
+
 
 class RabbitMQConfig(ConfigSection):
     """
@@ -118,6 +194,62 @@ class RabbitMQConfig(ConfigSection):
     def consumer_tag(self):
         return self.get('consumer_tag')
 
+    @property
+    def heartbeat(self):
+        return self.getfloat('heartbeat')
+
+    @property
+    def reconnect_initial_delay(self):
+        return self.getfloat('reconnect_initial_delay')
+
+    @property
+    def reconnect_max_delay(self):
+        return self.getfloat('reconnect_max_delay')
+
+    @property
+    def parking_queue(self):
+        return self.get('parking_queue') or self.queue + '.parking'
+
+    @property
+    def dead_letter_queue(self):
+        return self.get('dead_letter_queue') or self.queue + '.dead-letter'
+
+    @property
+    def binding_mode(self):
+        return self.get('binding_mode')
+
+    @property
+    def binding_routing_key(self):
+        return self.get('binding_routing_key')
+
+    @property
+    def headers_exchange(self):
+        return self.get('headers_exchange')
+
+    @property
+    def type_header(self):
+        return self.get('type_header')
+
+    @property
+    def source_header(self):
+        return self.get('source_header')
+
+    @property
+    def confirm_publish(self):
+        return self.getboolean('confirm_publish')
+
+    @property
+    def publish_batch_size(self):
+        return self.getint('publish_batch_size')
+
+    @property
+    def publish_batch_window(self):
+        return self.getfloat('publish_batch_window')
+
+    @property
+    def confirm_timeout(self):
+        return self.getfloat('confirm_timeout')
+
 
 class ArtifactoryConfig(ConfigSection):
     """
@@ -140,10 +272,125 @@ class ArtifactoryConfig(ConfigSection):
     def url(self):
         return self.get('url')
 
+    @property
+    def urls(self):
+        urls = self.get('urls')
+        if urls:
+            return urls.replace(' ', '').split(',')
+        return [self.url]
+
+    @property
+    def eject_failures(self):
+        return self.getint('eject_failures')
+
+    @property
+    def eject_duration(self):
+        return self.getfloat('eject_duration')
+
+    @property
+    def hedging(self):
+        return self.getboolean('hedging')
+
+    @property
+    def hedge_percentile(self):
+        return self.getfloat('hedge_percentile')
+
     @property
     def aql_search_string(self):
         return self.get('aql_search_string')
 
+    @property
+    def pool_size(self):
+        return self.getint('pool_size')
+
+    @property
+    def connect_timeout(self):
+        return self.getfloat('connect_timeout')
+
+    @property
+    def read_timeout(self):
+        return self.getfloat('read_timeout')
+
+    @property
+    def max_retries(self):
+        return self.getint('max_retries')
+
+    @property
+    def pool_stats_interval(self):
+        return self.getint('pool_stats_interval')
+
+    @property
+    def batch_size(self):
+        return self.getint('batch_size')
+
+    @property
+    def batch_window(self):
+        return self.getfloat('batch_window')
+
+    @property
+    def concurrency(self):
+        return self.getint('concurrency')
+
+    @property
+    def min_concurrency(self):
+        return self.getint('min_concurrency')
+
+    @property
+    def target_latency(self):
+        return self.getfloat('target_latency')
+
+    @property
+    def breaker_failure_threshold(self):
+        return self.getint('breaker_failure_threshold')
+
+    @property
+    def breaker_latency_threshold(self):
+        return self.getfloat('breaker_latency_threshold')
+
+    @property
+    def breaker_reset_timeout(self):
+        return self.getfloat('breaker_reset_timeout')
+
+    @property
+    def index(self):
+        return self.get('index')
+
+    @property
+    def index_path(self):
+        return self.get('index_path')
+
+    @property
+    def index_poll_interval(self):
+        return self.getfloat('index_poll_interval')
+
+    @property
+    def index_history(self):
+        return self.getfloat('index_history')
+
+    @property
+    def resolution_mode(self):
+        return self.get('resolution_mode')
+
+    @property
+    def exact_repo(self):
+        return self.get('exact_repo')
+
+    @property
+    def exact_path(self):
+        return self.get('exact_path')
+
+    @property
+    def cache_size(self):
+        return self.getint('cache_size')
+
+    @property
+    def cache_hit_ttl(self):
+        return self.getfloat('cache_hit_ttl')
+
+    @property
+    def cache_miss_ttl(self):
+        return self.getfloat('cache_miss_ttl')
+
 
 class EiffelactoryConfig(ConfigSection):
     """
@@ -160,3 +407,121 @@ class EiffelactoryConfig(ConfigSection):
         if event_sources:
             return event_sources.replace(' ', '').split(',')
         return None
+
+    @property
+    def raw_filter(self):
+        return self.getboolean('raw_filter')
+
+    @property
+    def dedup_size(self):
+        return self.getint('dedup_size')
+
+    @property
+    def dedup_window(self):
+        return self.getfloat('dedup_window')
+
+    @property
+    def processes(self):
+        processes = self.get('processes')
+        if processes:
+            return int(processes)
+        return os.cpu_count() or 1
+
+    @property
+    def mode(self):
+        return self.get('mode')
+
+    @property
+    def worker_type(self):
+        return self.get('worker_type')
+
+    @property
+    def workers(self):
+        return self.getint('workers')
+
+    @property
+    def trace_sample_rate(self):
+        return self.getfloat('trace_sample_rate')
+
+    @property
+    def trace_min_duration(self):
+        return self.getfloat('trace_min_duration')
+
+    @property
+    def profile_duration(self):
+        return self.getfloat('profile_duration')
+
+    @property
+    def profile_interval(self):
+        return self.getfloat('profile_interval')
+
+    @property
+    def profile_at_startup(self):
+        return self.getboolean('profile_at_startup')
+
+    @property
+    def metrics_port(self):
+        metrics_port = self.get('metrics_port')
+        if metrics_port:
+            return int(metrics_port)
+        return None
+
+    @property
+    def metrics_host(self):
+        return self.get('metrics_host')
+
+    @property
+    def log_background(self):
+        return self.getboolean('log_background')
+
+    @property
+    def log_format(self):
+        return self.get('log_format')
+
+    @property
+    def log_max_bytes(self):
+        return self.getint('log_max_bytes')
+
+    @property
+    def log_rotate_when(self):
+        return self.get('log_rotate_when')
+
+    @property
+    def log_backup_count(self):
+        return self.getint('log_backup_count')
+
+    @property
+    def received_log_sample_rate(self):
+        return self.getfloat('received_log_sample_rate')
+
+    @property
+    def invalid_events(self):
+        return self.get('invalid_events')
+
+    @property
+    def retry_mode(self):
+        return self.get('retry_mode')
+
+    @property
+    def retry_max_attempts(self):
+        return self.getint('retry_max_attempts')
+
+    @property
+    def retry_max_pending(self):
+        return self.getint('retry_max_pending')
+
+    @property
+    def retry_initial_delay(self):
+        return self.getfloat('retry_initial_delay')
+
+    @property
+    def retry_max_delay(self):
+        return self.getfloat('retry_max_delay')
+
+    @property
+    def retry_backoff(self):
+        return self.getfloat('retry_backoff')
+
+    @property
+    def retry_max_age(self):
+        return self.getfloat('retry_max_age')
@@ -0,0 +1,77 @@
+"""
+Module for suppressing duplicate ArtC events, e.g. messages redelivered after
+a reconnect or events sent twice by the upstream tool.
+"""
+import collections
+import threading
+import time
+
+
+class DuplicateFilter:
+    """
+    Remembers the ids of events received within a time window, oldest
+    first, forgetting the oldest ones when more than max_size ids are
+    remembered. Unlike a probabilistic filter it never reports an event as
+    a duplicate that hasn't been received.
+
+    :param max_size: the maximum number of remembered ids
+    :param window: seconds an id is remembered
+    """
+
+    def __init__(self, max_size, window):
+        self.max_size = max_size
+        self.window = window
+        self.duplicates = 0
+        self.evictions = 0
+        # id -> time received
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def check(self, event_id):
+        """
+        Checks if an event has been received within the window, and
+        remembers it if it hasn't.
+        :param event_id: the meta.id of the event
+        :return: True if the event is a duplicate
+        """
+        now = time.monotonic()
+        with self._lock:
+            received = self._seen.get(event_id)
+            if received is not None and now - received < self.window:
+                self.duplicates += 1
+                return True
+            self._seen[event_id] = now
+            self._seen.move_to_end(event_id)
+            self._expire(now)
+            return False
+
+    def _expire(self, now):
+        while self._seen:
+            event_id, received = next(iter(self._seen.items()))
+            if now - received < self.window and \
+                    len(self._seen) <= self.max_size:
+                return
+            del self._seen[event_id]
+            if now - received < self.window:
+                self.evictions += 1
+
+    def forget(self, event_id):
+        """
+        Forgets an event, so that it is processed again when it is
+        redelivered, e.g. because processing it failed.
+        :param event_id: the meta.id of the event
+        """
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def stats(self):
+        """
+        :return: dict with the number of remembered ids, duplicates and
+        evictions
+        """
+        return {'size': len(self._seen),
+                'duplicates': self.duplicates,
+                'evictions': self.evictions}
@@ -1,14 +1,19 @@
 """
 Module containing classes and methods for creating and handling Eiffel events.
 Eiffel events should be created using the corresponding create_<event>() method.
-All Eiffel model classes inherit from dict for easy json serialization.
+All Eiffel model classes are read-only mappings that serialize to JSON bytes
+with to_json(), leaving out their fields that are None.
 
 Parameter and class descriptions are often taken verbatim or shortened from
 the official Eiffel documentation found here:
 https://github.com/eiffel-community/eiffel
 """
-import uuid
+import collections
+import collections.abc
+import os
+import threading
 
+from eiffelactory import codec
 from eiffelactory import utils
 
 # Eiffel event types
@@ -21,8 +26,126 @@ VERSION_3_0_0 = "3.0.0"
 # Used to populate meta.source.name, identifies event sender
 EIFFELACTORY = 'EIFFELACTORY'
 
+# A field of an event that is validated: its dot-separated path, the type or
+# tuple of types of its value and whether it must be present
+Field = collections.namedtuple('Field', ['path', 'types', 'required'])
 
-class Event(dict):
+# the fields of every received event that eiffelactory reads
+EVENT_FIELDS = (Field('meta.type', str, True),)
+
+# the fields of a received ArtC event that eiffelactory reads
+ARTIFACT_CREATED_FIELDS = (Field('meta.id', str, True),
+                           Field('data.identity', str, True),
+                           Field('meta.source', dict, False),
+                           Field('meta.source.name', str, False))
+
+# the number of UUIDs generated from one read of random bytes from the OS
+UUID_BATCH_SIZE = 256
+
+
+# maps a random hex digit to a random RFC 4122 variant digit
+_VARIANT_DIGITS = {digit: '89ab'[int(digit, 16) % 4]
+                   for digit in '0123456789abcdef'}
+
+
+class UuidGenerator:
+    """
+    Generates random version 4 UUID strings, like str(uuid.uuid4()), from
+    random bytes read from the OS in batches. The batch is read again in a
+    forked process, so that parent and child never share ids.
+
+    :param batch_size: the number of UUIDs per read from the OS
+    """
+
+    def __init__(self, batch_size=UUID_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._digits = ''
+        self._offset = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._offset >= len(self._digits) or \
+                    self._pid != os.getpid():
+                self._digits = os.urandom(16 * self.batch_size).hex()
+                self._offset = 0
+                self._pid = os.getpid()
+            digits = self._digits
+            offset = self._offset
+            self._offset += 32
+        # the version digit is 4 and the variant digit one of 8, 9, a and b,
+        # as in uuid.uuid4
+        return '{}-{}-4{}-{}{}-{}'.format(
+            digits[offset:offset + 8],
+            digits[offset + 8:offset + 12],
+            digits[offset + 13:offset + 16],
+            _VARIANT_DIGITS[digits[offset + 16]],
+            digits[offset + 17:offset + 20],
+            digits[offset + 20:offset + 32])
+
+
+new_event_id = UuidGenerator()
+
+
+class Model(collections.abc.Mapping):
+    """
+    Base class of the Eiffel model classes, which store their fields in
+    slots. A model reads like a read-only dict of its fields that are not
+    None. Subclasses list their fields in _fields as (JSON key, attribute)
+    pairs, in the order they are serialized.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._attributes = dict(cls._fields)
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, self._attributes[key])
+        except KeyError:
+            raise KeyError(key) from None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key, attribute in self._fields:
+            if getattr(self, attribute) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self))
+
+    def json_fields(self):
+        """
+        Called by the codec to serialize the model. Nested models are left
+        as they are and serialized the same way, so the event tree is never
+        copied as a whole.
+        :return: dict of the fields that are not None, in serialization order
+        """
+        fields = {}
+        for key, attribute in self._fields:
+            value = getattr(self, attribute)
+            if value is not None:
+                fields[key] = value
+        return fields
+
+    def to_json(self):
+        """
+        :return: the model serialized to compact JSON bytes, without the
+        fields that are None
+        """
+        return codec.dumps(self)
+
+
+class Event(Model):
     """
     Represents an Eiffel event.
 
@@ -31,11 +154,16 @@ class Event(dict):
     :param meta: the event meta
     """
 
+    __slots__ = ('data', 'links', 'meta')
+    _fields = (('data', 'data'), ('links', 'links'), ('meta', 'meta'))
+
     def __init__(self, data, links, meta):
-        super().__init__(self, data=data, links=links, meta=meta)
+        self.data = data
+        self.links = links
+        self.meta = meta
 
 
-class Meta(dict):
+class Meta(Model):
     """
     Represents an Eiffel event's meta object.
     Parameters with None as default value are non-required fields.
@@ -46,6 +174,12 @@ class Meta(dict):
     :param source: a description of the source of the event
     """
 
+    __slots__ = ('event_id', 'event_type', 'version', 'time', 'tags',
+                 'source')
+    _fields = (('id', 'event_id'), ('type', 'event_type'),
+               ('version', 'version'), ('time', 'time'), ('tags', 'tags'),
+               ('source', 'source'))
+
     def __init__(self,
                  event_type,
                  version,
@@ -55,21 +189,20 @@ class Meta(dict):
                  source=None):
 
         if event_id is None:
-            event_id = str(uuid.uuid4())
+            event_id = new_event_id()
 
         if time is None:
             time = utils.current_time_millis()
 
-        super().__init__(self,
-                         id=event_id,
-                         type=event_type,
-                         version=version,
-                         time=time,
-                         tags=tags,
-                         source=source)
+        self.event_id = event_id
+        self.event_type = event_type
+        self.version = version
+        self.time = time
+        self.tags = tags
+        self.source = source
 
 
-class Source(dict):
+class Source(Model):
     """
     Represents an Eiffel event's meta.source object.
     Provides a description of the source of the event for traceability purposes.
@@ -82,6 +215,10 @@ class Source(dict):
     :param uri: URI of, related to or describing the event sender
     """
 
+    __slots__ = ('domain_id', 'host', 'name', 'serializer', 'uri')
+    _fields = (('domainId', 'domain_id'), ('host', 'host'), ('name', 'name'),
+               ('serializer', 'serializer'), ('uri', 'uri'))
+
     def __init__(self,
                  domain_id=None,
                  host=None,
@@ -89,15 +226,14 @@ class Source(dict):
                  serializer=None,
                  uri=None):
 
-        super().__init__(self,
-                         domainId=domain_id,
-                         host=host,
-                         name=name,
-                         serializer=serializer,
-                         uri=uri)
+        self.domain_id = domain_id
+        self.host = host
+        self.name = name
+        self.serializer = serializer
+        self.uri = uri
 
 
-class Link(dict):
+class Link(Model):
     """
     Represents an Eiffel link object.
 
@@ -107,22 +243,29 @@ class Link(dict):
 
     ARTIFACT = "ARTIFACT"
 
+    __slots__ = ('link_type', 'target')
+    _fields = (('type', 'link_type'), ('target', 'target'))
+
     def __init__(self, link_type, target):
-        super().__init__(self, type=link_type, target=target)
+        self.link_type = link_type
+        self.target = target
 
 
-class ArtifactPublishedData(dict):
+class ArtifactPublishedData(Model):
     """
     Represents an EiffelArtifactPublishedEvent's data object.
 
     :param locations: a list of locations at which the artifact may be retrieved
     """
 
+    __slots__ = ('locations',)
+    _fields = (('locations', 'locations'),)
+
     def __init__(self, locations):
-        super().__init__(self, locations=locations)
+        self.locations = locations
 
 
-class Location(dict):
+class Location(Model):
     """
     Represents a location at which an artifact may be retrieved.
 
@@ -132,8 +275,12 @@ class Location(dict):
 
     ARTIFACTORY = "ARTIFACTORY"
 
+    __slots__ = ('location_type', 'uri')
+    _fields = (('type', 'location_type'), ('uri', 'uri'))
+
     def __init__(self, uri, location_type=ARTIFACTORY):
-        super().__init__(self, type=location_type, uri=uri)
+        self.location_type = location_type
+        self.uri = uri
 
 
 def create_artifact_published_event(artc_event_id, locations):
@@ -153,6 +300,81 @@ def create_artifact_published_event(artc_event_id, locations):
     return event
 
 
+class ArtifactPublishedTemplate:
+    """
+    Renders EiffelArtifactPublishedEvents to JSON bytes from a template in
+    which only meta.id, meta.time, the ARTIFACT link target and the
+    locations change. The constant parts are serialized once, when the
+    template is created, and the output is the same as to_json() of the
+    event created by create_artifact_published_event.
+
+    :param source: the meta.source of the events
+    """
+
+    # serialized in place of each spliced-in value when the template is
+    # created
+    _PLACEHOLDER = '\x00splice\x00'
+
+    def __init__(self, source=None):
+        placeholder = self._PLACEHOLDER
+        sample = Event(ArtifactPublishedData(placeholder),
+                       [Link(Link.ARTIFACT, placeholder)],
+                       Meta(EIFFEL_ARTIFACT_PUBLISHED_EVENT, VERSION_3_0_0,
+                            event_id=placeholder, time=placeholder,
+                            source=source or Source()))
+        # locations, link target, meta.id, meta.time
+        self._parts = sample.to_json().split(codec.dumps(placeholder))
+        if len(self._parts) != 5:
+            raise ValueError("Unexpected ArtP template: {}".format(
+                sample.to_json()))
+
+    def render(self, artc_event_id, locations, event_id=None, time=None):
+        """
+        Renders an ArtP event.
+        :param artc_event_id: the target id of the required ARTIFACT link
+        :param locations: a list of Location objects
+        :param event_id: meta.id, generated if None
+        :param time: meta.time in milliseconds, the current time if None
+        :return: the event as JSON bytes
+        """
+        if event_id is None:
+            event_id = new_event_id()
+        if time is None:
+            time = utils.current_time_millis()
+        parts = self._parts
+        return b''.join((parts[0], _dump_locations(locations),
+                         parts[1], codec.dumps(artc_event_id),
+                         parts[2], codec.dumps(event_id),
+                         parts[3], codec.dumps(time),
+                         parts[4]))
+
+
+def _dump_locations(locations):
+    return b'[' + b','.join(map(_dump_location, locations)) + b']'
+
+
+def _dump_location(location):
+    if location.location_type is None or location.uri is None:
+        return location.to_json()
+    return b'{"type":' + codec.dumps(location.location_type) + \
+        b',"uri":' + codec.dumps(location.uri) + b'}'
+
+
+_ARTIFACT_PUBLISHED_TEMPLATE = ArtifactPublishedTemplate()
+
+
+def render_artifact_published_event(artc_event_id, locations):
+    """
+    Renders an EiffelArtifactPublishedEvent straight to JSON bytes, the same
+    bytes as create_artifact_published_event(...).to_json() but faster.
+
+    :param artc_event_id: the target id of the required ARTIFACT link
+    :param locations: a list of artifact locations
+    :return: the event as JSON bytes
+    """
+    return _ARTIFACT_PUBLISHED_TEMPLATE.render(artc_event_id, locations)
+
+
 def is_eiffel_event_type(event, event_type):
     """
     Checks if an event is of a given type.
@@ -192,3 +414,78 @@ def is_sent_from_sources(event, sources):
         return False
 
     return event['meta']['source']['name'] in sources
+
+
+def create_event_validator(fields):
+    """
+    Creates a validator that checks the given fields of a decoded event, and
+    nothing else, so that events are rejected before reading a field fails.
+    The field paths are split once, when the validator is created.
+
+    :param fields: a list of Field
+    :return: callable taking the decoded event and returning the reason the
+    event is invalid, or None if it is valid
+    """
+    checks = [_create_field_check(field) for field in fields]
+
+    def validate_event(event):
+        if not isinstance(event, dict):
+            return 'event is not an object'
+        for check in checks:
+            reason = check(event)
+            if reason is not None:
+                return reason
+        return None
+
+    return validate_event
+
+
+def _create_field_check(field):
+    keys = field.path.split('.')
+    missing = 'missing ' + field.path
+    types = field.types if isinstance(field.types, tuple) else (field.types,)
+    wrong_type = '{} is not {}'.format(
+        field.path, ' or '.join(cls.__name__ for cls in types))
+
+    def check_field(event):
+        value = event
+        for key in keys:
+            # a parent that isn't an object has been reported by the check
+            # of its own field, if it is checked
+            if not isinstance(value, dict):
+                return missing if field.required else None
+            value = value.get(key)
+            if value is None:
+                return missing if field.required else None
+        if not isinstance(value, types):
+            return wrong_type
+        return None
+
+    return check_field
+
+
+def create_raw_event_filter(event_type, sources=None):
+    """
+    Creates a filter that checks the raw body of a message for the event
+    type and, if given, one of the source names, without decoding the event.
+    The filter only looks for the quoted strings anywhere in the body, so it
+    can let through events that don't match, but it never drops a matching
+    event unless the sender escaped the strings in its JSON.
+
+    :param event_type: the Eiffel event type
+    :param sources: a list of source names, or None
+    :return: callable taking the message body as bytes and returning False if
+    the event can't be of the type or from one of the sources
+    """
+    type_token = codec.dumps(event_type)
+    source_tokens = None
+    if sources:
+        source_tokens = [codec.dumps(source) for source in sources]
+
+    def raw_event_filter(body):
+        if type_token not in body:
+            return False
+        return source_tokens is None or \
+            any(token in body for token in source_tokens)
+
+    return raw_event_filter
@@ -0,0 +1,138 @@
+"""
+Module for spreading AQL queries over the nodes of an Artifactory HA cluster.
+Queries go to the node with the fewest outstanding requests, and nodes that
+keep failing are ejected for a while.
+"""
+import collections
+import logging
+import threading
+import time
+
+# the number of latency samples the hedge delay is computed from
+_LATENCY_WINDOW = 200
+# no hedging until this many latency samples have been collected
+_MIN_LATENCY_SAMPLES = 20
+
+
+class Endpoint:
+    """
+    An Artifactory node.
+
+    :param url: the base url of the node
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.search_url = self.url + '/api/search/aql/'
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0
+        self.times_ejected = 0
+        self.requests = 0
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+
+class EndpointPool:
+    """
+    Least-outstanding-requests balancer with health-based ejection.
+
+    :param urls: the base urls of the nodes
+    :param eject_failures: consecutive failures that eject a node
+    :param eject_duration: seconds an ejected node is left out
+    :param hedge_percentile: the latency percentile used as hedge delay
+    """
+
+    def __init__(self, urls, eject_failures, eject_duration,
+                 hedge_percentile=95):
+        self.app_logger = logging.getLogger('app')
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.eject_failures = eject_failures
+        self.eject_duration = eject_duration
+        self.hedge_percentile = hedge_percentile
+        self._latencies = collections.deque(maxlen=_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude=None):
+        """
+        Picks the node for the next request and counts the request as
+        outstanding on it. Ejected nodes are only picked if every node is
+        ejected, in which case the one ejected first is picked.
+        :param exclude: a node that must not be picked, e.g. the node the
+        hedged request is already waiting for
+        :return: the Endpoint, or None if there is no node left to pick
+        """
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint is not exclude]
+            if not candidates:
+                return None
+            now = time.monotonic()
+            healthy = [endpoint for endpoint in candidates
+                       if not endpoint.is_ejected(now)]
+            if healthy:
+                # ties go to the node with the fewest requests, so an idle
+                # cluster is used round robin
+                endpoint = min(healthy,
+                               key=lambda e: (e.outstanding, e.requests))
+            elif exclude is not None:
+                # hedging to a node that is known to be down doesn't help
+                return None
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, latency, success=True):
+        """
+        Marks a request to a node as finished, ejecting the node if it has
+        failed eject_failures times in a row.
+        :param endpoint: the Endpoint returned by acquire
+        :param latency: the request latency in seconds
+        :param success: False if the request failed
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.failures = 0
+                self._latencies.append(latency)
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.eject_failures:
+                endpoint.failures = 0
+                endpoint.ejected_until = time.monotonic() + self.eject_duration
+                endpoint.times_ejected += 1
+                self.app_logger.warning("Ejecting Artifactory node %s for "
+                                        "%s seconds", endpoint.url,
+                                        self.eject_duration)
+
+    def hedge_delay(self):
+        """
+        :return: the configured percentile of the recent request latencies,
+        or None if too few requests have been made to tell
+        """
+        with self._lock:
+            if len(self._latencies) < _MIN_LATENCY_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1,
+                    int(len(latencies) * self.hedge_percentile / 100))
+        return latencies[index]
+
+    def stats(self):
+        """
+        :return: dict per node url with the number of requests, outstanding
+        requests, times ejected and whether the node is ejected
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {endpoint.url: {'requests': endpoint.requests,
+                                   'outstanding': endpoint.outstanding,
+                                   'ejected': endpoint.is_ejected(now),
+                                   'times_ejected': endpoint.times_ejected}
+                    for endpoint in self.endpoints}
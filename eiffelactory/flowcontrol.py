@@ -0,0 +1,146 @@
+"""
+Module for protecting Artifactory from overload: a latency-driven AIMD
+concurrency limiter and a circuit breaker.
+"""
+import logging
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class AimdLimiter:
+    """
+    Limits the number of concurrent requests. The limit is increased
+    additively while requests are fast and successful, and decreased
+    multiplicatively when a request fails or is slower than target_latency.
+
+    :param initial_limit: the limit to start with
+    :param min_limit: the lowest the limit can be decreased to
+    :param max_limit: the highest the limit can be increased to
+    :param target_latency: seconds above which a request counts as slow
+    :param decrease_factor: the factor the limit is multiplied with on a
+    slow or failed request
+    """
+
+    def __init__(self, initial_limit, min_limit, max_limit, target_latency,
+                 decrease_factor=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def acquire(self):
+        """
+        Blocks until a request may be started.
+        """
+        with self._condition:
+            while self.in_flight >= self.current_limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, success=True):
+        """
+        Marks a request as finished and adjusts the limit.
+        :param latency: the request latency in seconds
+        :param success: False if the request failed
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if not success or latency > self.target_latency:
+                self.limit = max(self.min_limit,
+                                 self.limit * self.decrease_factor)
+            else:
+                # grows the limit by about one per limit requests
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a failing service. The breaker opens after
+    failure_threshold consecutive failed or slow requests, rejects requests
+    for reset_timeout seconds and then lets a single trial request through.
+    The breaker closes again if the trial succeeds.
+
+    :param failure_threshold: consecutive failures that open the breaker
+    :param latency_threshold: seconds above which a request counts as failed
+    :param reset_timeout: seconds the breaker stays open
+    """
+
+    def __init__(self, failure_threshold, latency_threshold, reset_timeout):
+        self.app_logger = logging.getLogger('app')
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.times_opened = 0
+        self._state = CLOSED
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and \
+                time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self._state = state
+        self.app_logger.warning("Artifactory circuit breaker is %s", state)
+        if state == OPEN:
+            self.times_opened += 1
+            self._opened_at = time.monotonic()
+
+    def allow_request(self):
+        """
+        :return: True if a request may be sent
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self, latency):
+        """
+        Records a finished request, counting it as failed if it was slower
+        than latency_threshold.
+        :param latency: the request latency in seconds
+        """
+        if latency > self.latency_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self._set_state(OPEN)
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
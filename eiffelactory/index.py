@@ -0,0 +1,228 @@
+"""
+Module with a local index of recently deployed Artifactory items. The index
+lets lookups avoid Artifactory's wildcard build url search, and is kept up to
+date by polling Artifactory for items modified since the last poll.
+
+Items that have no build url yet are indexed as unbuilt items. Artifactory
+may attach build info to them later, so lookups for their name can't be
+answered from the index until it has been synced with their build urls.
+"""
+import collections
+import datetime
+import sqlite3
+import threading
+
+# the item fields returned by index lookups, same as the default AQL include
+ITEM_FIELDS = ('repo', 'path', 'name')
+# the build url of items that aren't related to a build yet
+NO_BUILD_URL = ''
+
+IndexItem = collections.namedtuple('IndexItem', ['repo', 'path', 'name',
+                                                 'build_url', 'modified'])
+
+
+def parse_modified(modified):
+    """
+    Parses an Artifactory timestamp like 2019-07-25T10:20:30.123+02:00.
+    :param modified: the timestamp string
+    :return: an aware datetime
+    """
+    return datetime.datetime.fromisoformat(modified.replace('Z', '+00:00'))
+
+
+def format_modified(timestamp):
+    """
+    Formats a datetime the way AQL expects it in date criteria.
+    :param timestamp: an aware datetime
+    :return: the timestamp string
+    """
+    return timestamp.astimezone(datetime.timezone.utc).isoformat(
+        timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _find_build_urls(value):
+    """
+    Finds the build urls in an item returned by an AQL query that includes
+    artifact.module.build.url. The urls are nested in the artifacts, modules
+    and builds lists of the item.
+    :param value: the item, or a nested part of it
+    :return: generator of build urls
+    """
+    if isinstance(value, dict):
+        for key, nested_value in value.items():
+            if key == 'build.url' and isinstance(nested_value, str):
+                yield nested_value
+            else:
+                yield from _find_build_urls(nested_value)
+    elif isinstance(value, list):
+        for nested_value in value:
+            yield from _find_build_urls(nested_value)
+
+
+def items_from_aql_result(result):
+    """
+    Converts an AQL result into index items, one per build url, or a single
+    unbuilt item if it has no build url.
+    :param result: a result dict from the index sync query
+    :return: list of IndexItem
+    """
+    build_urls = set(_find_build_urls(result.get('artifacts'))) or \
+        {NO_BUILD_URL}
+    return [IndexItem(result['repo'], result['path'], result['name'],
+                      build_url, parse_modified(result['modified']))
+            for build_url in build_urls]
+
+
+def _item_to_result(item):
+    return {'repo': item.repo, 'path': item.path, 'name': item.name}
+
+
+class MemoryArtifactIndex:
+    """
+    Artifact index held in a dict keyed by artifact name.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._newest_modified = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(items) for items in self._items.values())
+
+    def add(self, items):
+        with self._lock:
+            for item in items:
+                name_items = self._items.setdefault(item.name, {})
+                if item.build_url != NO_BUILD_URL:
+                    name_items.pop((item.repo, item.path, NO_BUILD_URL),
+                                   None)
+                name_items[(item.repo, item.path, item.build_url)] = item
+                if self._newest_modified is None or \
+                        item.modified > self._newest_modified:
+                    self._newest_modified = item.modified
+
+    def find(self, artifact_name, build_path_substring, max_results):
+        """
+        Finds indexed items with the artifact name whose build url contains
+        the build path substring.
+        :return: list of at most max_results result dicts, or None if an
+        item with the artifact name has no build url yet
+        """
+        with self._lock:
+            name_items = self._items.get(artifact_name, {})
+            if any(item.build_url == NO_BUILD_URL
+                   for item in name_items.values()):
+                return None
+            results = []
+            for item in name_items.values():
+                if build_path_substring in item.build_url:
+                    results.append(_item_to_result(item))
+                    if len(results) >= max_results:
+                        break
+            return results
+
+    def prune(self, modified_before):
+        """
+        Removes items modified before the given time.
+        :param modified_before: an aware datetime
+        """
+        with self._lock:
+            for name in list(self._items):
+                name_items = self._items[name]
+                for key in [key for key, item in name_items.items()
+                            if item.modified < modified_before]:
+                    del name_items[key]
+                if not name_items:
+                    del self._items[name]
+
+    def newest_modified(self):
+        """
+        :return: the newest indexed modification time, or None
+        """
+        return self._newest_modified
+
+    def close(self):
+        pass
+
+
+class SqliteArtifactIndex:
+    """
+    Artifact index stored in a SQLite database, so it doesn't need to be
+    rebuilt from scratch when the app restarts.
+
+    :param path: the database file, or :memory:
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS items ('
+            ' name TEXT NOT NULL, repo TEXT NOT NULL, path TEXT NOT NULL,'
+            ' build_url TEXT NOT NULL, modified REAL NOT NULL,'
+            ' PRIMARY KEY (name, repo, path, build_url));'
+            'CREATE INDEX IF NOT EXISTS items_modified ON items (modified);')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def add(self, items):
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM items WHERE name = ? AND repo = ? AND path = ?'
+                ' AND build_url = ?',
+                [(item.name, item.repo, item.path, NO_BUILD_URL)
+                 for item in items if item.build_url != NO_BUILD_URL])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)',
+                [(item.name, item.repo, item.path, item.build_url,
+                  item.modified.timestamp()) for item in items])
+
+    def find(self, artifact_name, build_path_substring, max_results):
+        with self._lock:
+            if self._db.execute(
+                    'SELECT 1 FROM items WHERE name = ? AND build_url = ?',
+                    (artifact_name, NO_BUILD_URL)).fetchone():
+                return None
+            rows = self._db.execute(
+                'SELECT repo, path, name FROM items'
+                ' WHERE name = ? AND instr(build_url, ?) > 0 LIMIT ?',
+                (artifact_name, build_path_substring, max_results))
+            return [dict(zip(ITEM_FIELDS, row)) for row in rows]
+
+    def prune(self, modified_before):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM items WHERE modified < ?',
+                             (modified_before.timestamp(),))
+
+    def newest_modified(self):
+        """
+        :return: the newest indexed modification time, or None
+        """
+        with self._lock:
+            newest = self._db.execute(
+                'SELECT MAX(modified) FROM items').fetchone()[0]
+        if newest is None:
+            return None
+        return datetime.datetime.fromtimestamp(newest, datetime.timezone.utc)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def create_index(index_type, path):
+    """
+    Creates an artifact index.
+    :param index_type: memory or sqlite
+    :param path: the database file used by the sqlite index
+    :return: the index
+    """
+    if index_type == 'memory':
+        return MemoryArtifactIndex()
+    if index_type == 'sqlite':
+        return SqliteArtifactIndex(path)
+    raise ValueError("Unknown artifact index type '{}'".format(index_type))
@@ -0,0 +1,350 @@
+"""
+Module for instrumenting the app with counters, gauges and latency
+histograms, served in the Prometheus text format from a local HTTP endpoint.
+When metrics are disabled, the instruments are shared no-op objects, so that
+instrumented code costs a method call and nothing else.
+"""
+import bisect
+import contextlib
+import http.server
+import logging
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')) for name, value in labels) + '}'
+
+
+class Counter:
+    """
+    A value that only goes up.
+
+    :param name: the metric name
+    :param documentation: the help text
+    """
+
+    TYPE = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, (), self.value)]
+
+
+class Gauge:
+    """
+    A value that goes up and down, either set by the app or read from a
+    function when the metrics are scraped.
+
+    :param name: the metric name
+    :param documentation: the help text
+    :param function: optional callable returning the current value
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, documentation, function=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.value if self.function is None else self.function()
+        return [(self.name, (), value)]
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, optionally split by the value
+    of one label, e.g. the processing stage.
+
+    :param name: the metric name
+    :param documentation: the help text
+    :param label: the name of the label, or None
+    :param buckets: the sorted upper bounds of the buckets
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, label=None,
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        """
+        :param value: the value of the label
+        :return: the histogram for that label value
+        """
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(
+                    value, _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value):
+        self.labels(None).observe(value)
+
+    def time(self):
+        return self.labels(None).time()
+
+    def samples(self):
+        samples = []
+        for label_value, child in sorted(self._children.items(),
+                                         key=lambda item: str(item[0])):
+            labels = () if label_value is None else \
+                ((self.label, label_value),)
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),),
+                                           counts):
+                cumulative += bucket_count
+                samples.append((self.name + '_bucket',
+                                labels + (('le', _format_value(bound)),),
+                                cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class _HistogramChild:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def time(self):
+        """
+        :return: context manager observing the seconds spent in its block
+        """
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+
+class _Timer:
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullInstrument:
+    """
+    Stands in for every instrument when metrics are disabled.
+    """
+
+    _NULL_TIMER = contextlib.nullcontext()
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def labels(self, value):
+        return self
+
+    def time(self):
+        return self._NULL_TIMER
+
+
+NULL_INSTRUMENT = _NullInstrument()
+
+
+class Metrics:
+    """
+    Registry of the instruments of the app.
+
+    :param enabled: if False, every instrument is a no-op and nothing is
+    collected
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+        self._stats = []
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, function=None):
+        return self._register(Gauge(name, documentation, function))
+
+    def histogram(self, name, documentation, label=None,
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label, buckets))
+
+    def _register(self, metric):
+        if not self.enabled:
+            return NULL_INSTRUMENT
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix, function, label=None):
+        """
+        Exposes the numbers of a stats dict, like the ones returned by the
+        stats methods of the app components, as gauges named
+        <prefix>_<key>. Values that aren't numbers are left out.
+        :param prefix: the prefix of the metric names
+        :param function: callable returning the stats dict when the metrics
+        are scraped
+        :param label: if set, the stats dict maps values of this label to
+        stats dicts, e.g. the stats per Artifactory node
+        """
+        if self.enabled:
+            self._stats.append((prefix, function, label))
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                                                metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                              _format_value(value)))
+        for prefix, function, label in self._stats:
+            lines.extend(self._render_stats(prefix, function(), label))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_stats(prefix, stats, label):
+        if label is None:
+            stats = {None: stats}
+        samples = {}
+        for label_value, values in stats.items():
+            labels = () if label is None else ((label, label_value),)
+            for key, value in values.items():
+                if isinstance(value, (bool, int, float)):
+                    samples.setdefault(prefix + '_' + key, []).append(
+                        (labels, value))
+        lines = []
+        for name, values in samples.items():
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in values:
+                lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                              _format_value(value)))
+        return lines
+
+
+class MetricsServer:
+    """
+    Serves the metrics on GET /metrics from a daemon thread.
+
+    :param metrics: the Metrics to serve
+    :param host: the address to listen on
+    :param port: the port to listen on, 0 picks a free port
+    """
+
+    def __init__(self, metrics, host, port):
+        self.app_logger = logging.getLogger('app')
+        self.metrics = metrics
+        self.server = http.server.ThreadingHTTPServer(
+            (host, port), self._create_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def _create_handler(self):
+        metrics = self.metrics
+        app_logger = self.app_logger
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = metrics.render().encode('utf-8')
+                except Exception:
+                    app_logger.exception("Failed to render metrics.")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name='metrics-server', daemon=True)
+        self._thread.start()
+        self.app_logger.info("Serving metrics on port %d.", self.port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
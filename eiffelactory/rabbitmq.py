@@ -1,73 +1,673 @@
 """
 Module for sending and receiving messages from RabbitMQ.
 """
+import asyncio
+import collections
 import logging
+import random
+import socket
+import time
 
-from kombu import Connection, Exchange, Queue
-from kombu.utils import json
+from kombu import Connection, Exchange, Producer, Queue
+
+from eiffelactory import codec
+from eiffelactory import metrics
+
+
+# header with the number of times an event has been parked for a retry
+RETRIES_HEADER = 'x-eiffelactory-retries'
+# header with the reason an event was dead-lettered
+REASON_HEADER = 'x-eiffelactory-reason'
+
+Binding = collections.namedtuple('Binding', ['exchange', 'routing_key',
+                                             'arguments'])
+
+
+def derive_bindings(rabbitmq_config, event_type, sources=None):
+    """
+    Derives the queue bindings from the binding_mode option, so that the
+    broker only delivers events of the wanted type and sources.
+
+    routing_key binds with the configured routing_key. derived binds with a
+    routing key per source, built from the binding_routing_key template and
+    its event_type and source fields. The default template follows the Eiffel
+    routing keys, which have no source, so it gives a single binding per
+    event type and the sources are only filtered on the client side. headers
+    binds to headers_exchange with the event type and source in the
+    type_header and source_header headers, the exchange has to be a headers
+    exchange since other exchanges ignore the header arguments.
+
+    :param rabbitmq_config: the rabbitmq config section
+    :param event_type: the Eiffel event type to receive
+    :param sources: a list of source names to receive events from, or None
+    for all sources
+    :return: list of Binding
+    :raises ValueError: if the binding mode is unknown, or is headers
+    without a headers_exchange
+    """
+    mode = rabbitmq_config.binding_mode
+    exchange = rabbitmq_config.exchange
+    if mode == 'routing_key':
+        return [Binding(exchange, rabbitmq_config.routing_key, None)]
+    if mode == 'derived':
+        template = rabbitmq_config.binding_routing_key
+        if not sources or '{source}' not in template:
+            sources = ['*']
+        routing_keys = [template.format(event_type=event_type, source=source)
+                        for source in sources]
+        return [Binding(exchange, routing_key, None)
+                for routing_key in dict.fromkeys(routing_keys)]
+    if mode == 'headers':
+        exchange = rabbitmq_config.headers_exchange
+        if not exchange:
+            raise ValueError("binding_mode headers requires headers_exchange")
+        arguments = {'x-match': 'all',
+                     rabbitmq_config.type_header: event_type}
+        if not sources:
+            return [Binding(exchange, '', arguments)]
+        return [Binding(exchange, '',
+                        dict(arguments, **{rabbitmq_config.source_header:
+                                           source}))
+                for source in sources]
+    raise ValueError("Unknown binding mode '{}'".format(mode))
+
+
+def check_idle_heartbeats(connection):
+    """
+    Checks the heartbeats of a connection that is only read from while it
+    publishes. The frames the broker has sent, e.g. its heartbeats, are read
+    without waiting first, otherwise the connection would be considered dead
+    after two heartbeat intervals without a publish.
+    :param connection: the kombu Connection
+    :return:
+    """
+    while True:
+        try:
+            connection.drain_events(timeout=0)
+        except socket.timeout:
+            break
+    connection.heartbeat_check()
+
+
+def encode_message(message):
+    """
+    Serializes a message for publishing.
+    :param message: the message, or its JSON encoded body as bytes
+    :return: the JSON encoded body as bytes
+    """
+    if isinstance(message, bytes):
+        return message
+    return codec.dumps(message)
+
+
+class NotConfirmedError(Exception):
+    """
+    Raised when the broker didn't confirm a message that has to be
+    confirmed before the received message is acked.
+    """
+
+
+class ConfirmedPublisher:
+    """
+    Publishes messages in batches on a confirm-mode channel. Messages are
+    buffered until batch_size messages are waiting or the oldest one has
+    waited for batch_window seconds, then the batch is published without
+    waiting for each message and the confirms of the whole batch are
+    awaited together.
+
+    :param connection: the connection to publish on, it should not be used
+    for consuming since its events are drained while waiting for confirms
+    :param exchange: the exchange to publish to
+    :param routing_key: the routing key to publish with
+    :param batch_size: the maximum number of messages in one batch
+    :param batch_window: the maximum time in seconds a message is buffered
+    :param confirm_timeout: seconds to wait for the confirms of a batch
+    """
+
+    def __init__(self, connection, exchange, routing_key, batch_size,
+                 batch_window, confirm_timeout):
+        self.app_logger = logging.getLogger('app')
+        self.connection = connection
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.confirm_timeout = confirm_timeout
+        self.channel = connection.channel()
+        self.channel.confirm_select()
+        self.channel.events['basic_ack'].add(self._on_basic_ack)
+        self.channel.events['basic_nack'].add(self._on_basic_nack)
+        self.producer = Producer(self.channel, serializer='json',
+                                 auto_declare=True)
+        self._defaults = {'content_type': codec.CONTENT_TYPE,
+                          'content_encoding': codec.CONTENT_ENCODING,
+                          'exchange': exchange,
+                          'routing_key': routing_key}
+        self.confirmed = 0
+        self.nacked = 0
+        # [(message, on_confirm, options), ...]
+        self._buffer = []
+        self._oldest = None
+        # delivery tag -> on_confirm
+        self._unconfirmed = {}
+        self._delivery_tag = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def publish(self, message, on_confirm=None, **options):
+        """
+        Buffers a message, publishing the batch if it is full.
+        :param message: the message to publish, or its JSON encoded body as
+        bytes
+        :param on_confirm: called with True when the broker has confirmed
+        the message, or with False when it was nacked or not confirmed in
+        time
+        :param options: keyword arguments for kombu's Producer.publish that
+        override the defaults, e.g. routing_key or headers
+        """
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append((message, on_confirm, options))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush_if_due(self):
+        """
+        Publishes the buffered messages if the oldest one has waited for
+        longer than the batch window. Meant to be called periodically.
+        """
+        if self._buffer and \
+                time.monotonic() - self._oldest >= self.batch_window:
+            self.flush()
+
+    def flush(self):
+        """
+        Publishes the buffered messages and waits for their confirms. If
+        publishing fails, every message of the batch that hasn't been
+        confirmed yet is failed, each exactly once, and the error is raised.
+        """
+        batch, self._buffer = self._buffer, []
+        self._oldest = None
+        published = 0
+        try:
+            for message, on_confirm, options in batch:
+                self.producer.publish(encode_message(message),
+                                      **dict(self._defaults, **options))
+                self._delivery_tag += 1
+                self._unconfirmed[self._delivery_tag] = on_confirm
+                published += 1
+            self._wait_for_confirms()
+        except Exception:
+            self._fail_unconfirmed()
+            for _, on_confirm, _ in batch[published:]:
+                if on_confirm:
+                    on_confirm(False)
+            raise
+
+    def _wait_for_confirms(self):
+        deadline = time.monotonic() + self.confirm_timeout
+        while self._unconfirmed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.app_logger.error("%d published messages were not "
+                                      "confirmed within %s seconds",
+                                      len(self._unconfirmed),
+                                      self.confirm_timeout)
+                self._fail_unconfirmed()
+                return
+            try:
+                self.connection.drain_events(timeout=remaining)
+            except socket.timeout:
+                pass
+
+    def _fail_unconfirmed(self):
+        unconfirmed, self._unconfirmed = self._unconfirmed, {}
+        for on_confirm in unconfirmed.values():
+            if on_confirm:
+                on_confirm(False)
+
+    def _on_basic_ack(self, delivery_tag, multiple):
+        self._confirm(delivery_tag, multiple, True)
+
+    def _on_basic_nack(self, delivery_tag, multiple):
+        self._confirm(delivery_tag, multiple, False)
+
+    def _confirm(self, delivery_tag, multiple, confirmed):
+        """
+        Handles a basic.ack or basic.nack from the broker, which confirms
+        every message up to delivery_tag if multiple is set.
+        """
+        if multiple:
+            delivery_tags = [tag for tag in self._unconfirmed
+                             if tag <= delivery_tag]
+        else:
+            delivery_tags = [delivery_tag]
+        for tag in delivery_tags:
+            on_confirm = self._unconfirmed.pop(tag, None)
+            if confirmed:
+                self.confirmed += 1
+            else:
+                self.nacked += 1
+                self.app_logger.error("Broker nacked published message %d",
+                                      tag)
+            if on_confirm:
+                on_confirm(confirmed)
+
+    def heartbeat_check(self):
+        check_idle_heartbeats(self.connection)
+
+    def close(self):
+        """
+        Publishes the buffered messages and releases the connection.
+        """
+        try:
+            if self._buffer:
+                self.flush()
+        finally:
+            self.connection.release()
 
 
 class RabbitMQConnection:
     """
-    Class handling receiving and publishing message on the RabbitMQ messages bus
+    Class handling receiving and publishing message on the RabbitMQ messages
+    bus
+
+    :param rabbitmq_config: the rabbitmq config section
+    :param message_callback: called with the decoded event and the message
+    for every message, and is responsible for acking the message
+    :param raw_filter: optional callable taking the raw message body as bytes,
+    messages it returns False for are acked without being decoded
+    :param bindings: list of Binding to bind the queue with, defaults to the
+    configured exchange and routing_key
+    :param retry_queues: if True, the parking queues and the dead-letter
+    queue are used, see park_message and dead_letter_message
+    :param dead_lettering: if True, the dead-letter queue is declared, see
+    dead_letter_message
+    :param decode_latency: histogram observing the seconds spent decoding
+    each message, see the metrics module
     """
-    def __init__(self,  rabbitmq_config, message_callback):
+    def __init__(self,  rabbitmq_config, message_callback, raw_filter=None,
+                 bindings=None, retry_queues=False, dead_lettering=False,
+                 decode_latency=metrics.NULL_INSTRUMENT):
         self.rabbitmq_config = rabbitmq_config
         self.app_logger = logging.getLogger('app')
         self.message_callback = message_callback
+        self.retry_queues = retry_queues
+        self.dead_lettering = dead_lettering or retry_queues
+        self.decode_latency = decode_latency
+        self.raw_filter = raw_filter
+        self.filtered = 0
+        self.passed = 0
+
+        self.bindings = bindings or [Binding(self.rabbitmq_config.exchange,
+                                             self.rabbitmq_config.routing_key,
+                                             None)]
+        self.reconnects = 0
+        self.downtime = 0.0
 
         self.exchange = Exchange(self.rabbitmq_config.exchange)
-        self.connection = Connection(transport='amqp',
-                                     hostname=self.rabbitmq_config.host,
-                                     port=self.rabbitmq_config.port,
-                                     userid=self.rabbitmq_config.username,
-                                     password=self.rabbitmq_config.password,
-                                     virtual_host=self.rabbitmq_config.vhost,
-                                     ssl=True)
-
-        self.connection.connect()
+        self._connect()
+        self.connection_errors = self.connection.connection_errors + \
+            self.connection.recoverable_connection_errors
+        # raised by park_message and dead_letter_message
+        self.republish_errors = self.connection_errors + (NotConfirmedError,)
+        self.consuming = True
+        self.paused = False
+        self.tick_callbacks = []
+        self.drain_timeout = None
+        if self.confirmed_publisher:
+            self.add_tick_callback(self._flush_publisher_if_due,
+                                   self.rabbitmq_config.publish_batch_window)
+        if self.rabbitmq_config.heartbeat:
+            # kombu expects heartbeats to be checked twice per interval
+            self.add_tick_callback(self._check_heartbeats,
+                                   self.rabbitmq_config.heartbeat / 2)
+
+    def _connect(self):
+        """
+        Connects to RabbitMQ, declares and binds the queue and creates the
+        producer and the consumer.
+        :return:
+        """
+        self.connection = self._create_connection()
         self.producer = self.connection.Producer(serializer='json',
                                                  auto_declare=True)
+        self.confirmed_publisher = None
+        if self.rabbitmq_config.confirm_publish:
+            self.confirmed_publisher = ConfirmedPublisher(
+                self._create_connection(),
+                self.exchange,
+                self.rabbitmq_config.routing_key,
+                self.rabbitmq_config.publish_batch_size,
+                self.rabbitmq_config.publish_batch_window,
+                self.rabbitmq_config.confirm_timeout)
         self.queue = Queue(channel=self.connection.channel(),
                            name=self.rabbitmq_config.queue,
                            routing_key=self.rabbitmq_config.routing_key)
         self.queue.declare()
-        self.queue.bind_to(exchange=Exchange(self.rabbitmq_config.exchange),
-                           routing_key=self.rabbitmq_config.routing_key)
+        self._bind_queue(self.bindings)
+        # delay in seconds -> name of the declared parking queue
+        self.parking_queues = {}
+        self.dead_letter_queue = None
+        self.republisher = None
+        if self.dead_lettering:
+            self._declare_dead_letter_queue()
+            # every republished message is confirmed on its own, before the
+            # received message is acked
+            self.republisher = ConfirmedPublisher(
+                self._create_connection(), '', None, 1, 0,
+                self.rabbitmq_config.confirm_timeout)
+        self.prefetch_count = self.rabbitmq_config.prefetch_count
         self.consumer = self.connection.\
             Consumer(
                     queues=self.queue,
-                    callbacks=[self._handle_message],
-                    prefetch_count=
-                    self.rabbitmq_config.prefetch_count,
+                    on_message=self._handle_raw_message,
+                    prefetch_count=self.prefetch_count,
                     tag_prefix=self.rabbitmq_config.consumer_tag)
-        self.consuming = True
 
-    def _handle_message(self, body, message):
+    def _bind_queue(self, bindings):
+        """
+        Binds the queue and reports the bindings. The binding with the
+        configured routing_key is removed if it isn't one of the bindings,
+        since bindings outlive the app and it would let every event through.
+        :param bindings: list of Binding
+        :return:
+        """
+        default_binding = Binding(self.rabbitmq_config.exchange,
+                                  self.rabbitmq_config.routing_key, None)
+        if default_binding not in bindings:
+            self.queue.unbind_from(exchange=Exchange(default_binding.exchange),
+                                   routing_key=default_binding.routing_key)
+            self.app_logger.info("Unbound queue '%s' from exchange '%s' with "
+                                 "routing key '%s'.", self.queue.name,
+                                 default_binding.exchange,
+                                 default_binding.routing_key)
+        for binding in bindings:
+            self.queue.bind_to(exchange=Exchange(binding.exchange),
+                               routing_key=binding.routing_key,
+                               arguments=binding.arguments)
+            if binding.arguments:
+                self.app_logger.info("Bound queue '%s' to exchange '%s' with "
+                                     "headers %s.", self.queue.name,
+                                     binding.exchange, binding.arguments)
+            else:
+                self.app_logger.info("Bound queue '%s' to exchange '%s' with "
+                                     "routing key '%s'.", self.queue.name,
+                                     binding.exchange, binding.routing_key)
+
+    def _declare_parking_queue(self, delay):
+        """
+        Declares the parking queue for a retry delay, whose messages are
+        dead-lettered back to the queue through the default exchange when
+        they have been in it for delay seconds. Every delay has its own
+        queue, so that the message at the head of a queue always expires
+        first and never holds back messages with shorter delays.
+        :param delay: the retry delay in seconds
+        :return: the name of the parking queue
+        """
+        name = self.parking_queues.get(delay)
+        if name is None:
+            name = '{}.{:g}s'.format(self.rabbitmq_config.parking_queue,
+                                     delay)
+            Queue(channel=self.queue.channel,
+                  name=name,
+                  queue_arguments={
+                      'x-dead-letter-exchange': '',
+                      'x-dead-letter-routing-key': self.rabbitmq_config.queue,
+                      'x-message-ttl': int(delay * 1000)}).declare()
+            self.parking_queues[delay] = name
+        return name
+
+    def _declare_dead_letter_queue(self):
         """
-        Callback called by consumer.
-        :param body:
+        Declares the dead-letter queue for invalid events and events that
+        are given up on.
+        :return:
+        """
+        self.dead_letter_queue = Queue(
+            channel=self.queue.channel,
+            name=self.rabbitmq_config.dead_letter_queue)
+        self.dead_letter_queue.declare()
+
+    def _create_connection(self):
+        connection = Connection(transport='amqp',
+                                hostname=self.rabbitmq_config.host,
+                                port=self.rabbitmq_config.port,
+                                userid=self.rabbitmq_config.username,
+                                password=self.rabbitmq_config.password,
+                                virtual_host=self.rabbitmq_config.vhost,
+                                heartbeat=self.rabbitmq_config.heartbeat,
+                                ssl=True)
+        connection.connect()
+        return connection
+
+    def _flush_publisher_if_due(self):
+        self.confirmed_publisher.flush_if_due()
+
+    def _check_heartbeats(self):
+        """
+        Sends heartbeats to the broker when they are due, and raises a
+        connection error if the broker hasn't sent any for too long.
+        :return:
+        """
+        self.connection.heartbeat_check()
+        if self.confirmed_publisher:
+            self.confirmed_publisher.heartbeat_check()
+        if self.republisher:
+            self.republisher.heartbeat_check()
+
+    def _reconnect(self, error):
+        """
+        Reconnects after a lost connection, waiting a random time between
+        attempts that grows exponentially up to reconnect_max_delay. The
+        consumer is recreated on the new connection, everything else the app
+        holds in memory is kept. Messages that were delivered but not acked
+        on the lost connection are redelivered by the broker.
+        :param error: the error the connection was lost with
+        :return: True if reconnected, False if consuming was stopped first
+        """
+        attempts = self._reconnect_attempts(error)
+        while True:
+            try:
+                delay = next(attempts)
+            except StopIteration as stop:
+                return stop.value
+            time.sleep(delay)
+
+    async def _reconnect_async(self, error):
+        """
+        Coroutine version of _reconnect, which waits between attempts without
+        blocking the event loop.
+        """
+        attempts = self._reconnect_attempts(error)
+        while True:
+            try:
+                delay = next(attempts)
+            except StopIteration as stop:
+                return stop.value
+            await asyncio.sleep(delay)
+
+    def _reconnect_attempts(self, error):
+        """
+        Generator making the reconnect attempts of _reconnect, which yields
+        the seconds to wait before each attempt.
+        :return: True if reconnected, False if consuming was stopped first
+        """
+        self.app_logger.error("Lost connection to RabbitMQ: %s", error)
+        lost_at = time.monotonic()
+        self._release_lost_connections()
+        attempt = 0
+        while self.consuming:
+            delay = min(self.rabbitmq_config.reconnect_max_delay,
+                        self.rabbitmq_config.reconnect_initial_delay *
+                        2 ** attempt)
+            yield random.uniform(0, delay)
+            attempt += 1
+            if not self.consuming:
+                break
+            try:
+                self._connect()
+            except self.connection_errors as ex:
+                self.app_logger.warning("Reconnect attempt %d to RabbitMQ "
+                                        "failed: %s", attempt, ex)
+                self._release_lost_connections()
+                continue
+            downtime = time.monotonic() - lost_at
+            self.reconnects += 1
+            self.downtime += downtime
+            self.app_logger.warning("Reconnected to RabbitMQ after %.1f "
+                                    "seconds and %d attempts, %d reconnects "
+                                    "and %.1f seconds downtime in total.",
+                                    downtime, attempt, self.reconnects,
+                                    self.downtime)
+            return True
+        return False
+
+    def _release_lost_connections(self):
+        """
+        Releases the resources of the current connections without
+        communicating with the broker. The buffered messages of the
+        confirmed publisher are published first if its connection still
+        works.
+        :return:
+        """
+        if self.confirmed_publisher:
+            try:
+                self.confirmed_publisher.close()
+            except self.connection_errors:
+                self.confirmed_publisher.connection.collect()
+        if self.republisher:
+            self.republisher.connection.collect()
+        self.connection.collect()
+
+    def connection_stats(self):
+        """
+        :return: dict with the number of reconnects and the total seconds
+        spent reconnecting
+        """
+        return {'reconnects': self.reconnects, 'downtime': self.downtime}
+
+    def add_tick_callback(self, callback, interval):
+        """
+        Registers a callback that is called after every drained message and
+        at least every interval seconds while the queue is idle.
+        :param callback: callable without arguments
+        :param interval: the maximum time in seconds between two calls
+        :return:
+        """
+        self.tick_callbacks.append(callback)
+        if self.drain_timeout is None or interval < self.drain_timeout:
+            self.drain_timeout = interval
+
+    def _handle_raw_message(self, message):
+        """
+        Callback called by consumer with the undecoded message. Messages are
+        checked with the raw filter, if set, and then decoded and handled.
+        Compressed messages always pass the filter.
         :param message:
         :return:
         """
+        if self.raw_filter:
+            body = message.body
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            if 'compression' not in message.headers and \
+                    not self.raw_filter(body):
+                self.filtered += 1
+                message.ack()
+                return
+            self.passed += 1
+        try:
+            with self.decode_latency.time():
+                decoded = self._decode_message(message)
+        except Exception:
+            self.app_logger.exception("Rejecting message that can't be "
+                                      "decoded.")
+            message.reject()
+            return
+        self.message_callback(decoded, message)
+
+    @staticmethod
+    def _decode_message(message):
+        """
+        Decodes JSON messages with the codec, and other messages with
+        kombu's serializers.
+        :param message:
+        :return: the decoded body
+        """
+        if message.content_type == codec.CONTENT_TYPE and \
+                'compression' not in message.headers:
+            body = codec.loads(message.body)
+        else:
+            body = message.decode()
         # body is sometimes dict and sometimes str
         # make sure it's a json dict before passing it on
-        json_body = dict()
+        if isinstance(body, str):
+            return codec.loads(body)
         if isinstance(body, dict):
-            json_body = body
-        elif isinstance(body, str):
-            json_body = json.loads(body)
+            return body
+        return dict()
 
-        self.message_callback(json_body)
-        message.ack()
+    def filter_stats(self):
+        """
+        :return: dict with the number of messages dropped and let through by
+        the raw filter
+        """
+        return {'filtered': self.filtered, 'passed': self.passed}
 
-    def publish_message(self, message):
+    def pause_consuming(self):
         """
-        Publishes passed message on the RabbitMQ message bus
-        :param message:
+        Cancels the consumer so the broker keeps new messages in the queue.
+        Messages that have already been delivered are still handled.
         :return:
         """
-        self.producer.publish(message,
+        if not self.paused:
+            self.consumer.cancel()
+            self.paused = True
+            self.app_logger.warning("Paused consuming RabbitMQ messages.")
+
+    def resume_consuming(self, prefetch_count=None):
+        """
+        Restarts a consumer that has been paused, or restarts it with
+        another prefetch count. The broker only applies a new prefetch
+        count to consumers started after it is set.
+        :param prefetch_count: the number of unacknowledged messages the
+        broker delivers, defaults to the configured prefetch_count
+        :return:
+        """
+        if prefetch_count is None:
+            prefetch_count = self.rabbitmq_config.prefetch_count
+        if not self.paused and prefetch_count == self.prefetch_count:
+            return
+        if not self.paused:
+            self.consumer.cancel()
+        if prefetch_count != self.prefetch_count:
+            self.consumer.qos(prefetch_count=prefetch_count)
+            self.consumer.prefetch_count = prefetch_count
+            self.prefetch_count = prefetch_count
+        self.consumer.consume()
+        self.paused = False
+        self.app_logger.info("Resumed consuming RabbitMQ messages with "
+                             "prefetch_count %s.", prefetch_count)
+
+    def publish_message(self, message, on_confirm=None):
+        """
+        Publishes passed message on the RabbitMQ message bus. With
+        confirm_publish the message is buffered and published in a batch.
+        :param message: the message, or its JSON encoded body as bytes which
+        is published as it is
+        :param on_confirm: called with True when the message has been
+        published, and confirmed by the broker if confirm_publish is set,
+        or with False if the broker didn't confirm it
+        :return:
+        """
+        if self.confirmed_publisher:
+            self.confirmed_publisher.publish(message, on_confirm)
+            return
+        self.producer.publish(encode_message(message),
+                              content_type=codec.CONTENT_TYPE,
+                              content_encoding=codec.CONTENT_ENCODING,
                               retry=True,
                               retry_policy={
                                   'interval_start': 0,
@@ -77,22 +677,131 @@ class RabbitMQConnection:
                               },
                               exchange=self.exchange,
                               routing_key=self.rabbitmq_config.routing_key)
+        if on_confirm:
+            on_confirm(True)
+
+    def park_message(self, message, retries, delay):
+        """
+        Republishes a received message to the parking queue of its delay,
+        from where the broker routes it back to the queue after delay
+        seconds. Returns when the broker has confirmed the republished
+        message, the message itself still has to be acked.
+        :param message: the received RabbitMQ message
+        :param retries: the number of times the message has been parked,
+        including this time, stored in the RETRIES_HEADER header
+        :param delay: seconds the message stays in the parking queue
+        :return:
+        :raises: one of republish_errors if the message wasn't confirmed
+        """
+        headers = dict(message.headers or {})
+        headers[RETRIES_HEADER] = retries
+        self._republish(message, self._declare_parking_queue(delay), headers)
+
+    def dead_letter_message(self, message, reason):
+        """
+        Republishes a received message to the dead-letter queue, where it
+        stays until it is inspected. Returns when the broker has confirmed
+        the republished message, the message itself still has to be acked.
+        :param message: the received RabbitMQ message
+        :param reason: why the message is dead-lettered, stored in the
+        REASON_HEADER header
+        :return:
+        :raises: one of republish_errors if the message wasn't confirmed
+        """
+        headers = dict(message.headers or {})
+        headers[REASON_HEADER] = reason
+        self._republish(message, self.dead_letter_queue.name, headers)
+
+    def _republish(self, message, queue_name, headers):
+        """
+        Publishes a received message with the republisher and waits for the
+        broker to confirm it. The republisher has its own connection, which
+        isn't consumed from, so that waiting for the confirm doesn't deliver
+        other messages in the middle of handling this one.
+        :raises NotConfirmedError: if the broker nacked the message or didn't
+        confirm it within confirm_timeout seconds
+        """
+        confirmed = []
+        self.republisher.publish(
+            message.body, confirmed.append,
+            content_type=message.content_type or codec.CONTENT_TYPE,
+            content_encoding=message.content_encoding or
+            codec.CONTENT_ENCODING,
+            headers=headers,
+            delivery_mode=2,
+            routing_key=queue_name)
+        if confirmed != [True]:
+            raise NotConfirmedError(
+                "Message republished to {} wasn't confirmed".format(
+                    queue_name))
 
     def read_messages(self):
         """
-        Method reading messages from the queue in a while-true loop.
+        Method reading messages from the queue in a while-true loop,
+        reconnecting if the connection is lost.
         Callback is defined in __init__
         :return:
         """
-        with self.consumer:
-            self.app_logger.info("Consumer is starting to consume"
-                                 " RabbitMQ messages.")
-            while self.consuming:
-                self.connection.drain_events()
-            self.app_logger.info("Consumer is stopping consuming"
-                                 "RabbitMQ messages.")
+        while self.consuming:
+            try:
+                self._start_consumer()
+                while self.consuming:
+                    self._drain_events(self.drain_timeout)
+            except self.connection_errors as ex:
+                if self.consuming:
+                    self._reconnect(ex)
+        self._stop_consumer()
+
+    async def read_messages_async(self, poll_interval):
+        """
+        Coroutine reading messages from the queue until consuming is stopped,
+        reconnecting if the connection is lost. Waits at most poll_interval
+        seconds for a message before yielding to the event loop, so that
+        tasks created by the callback can progress.
+        :param poll_interval: the maximum time in seconds to block the loop
+        :return:
+        """
+        if self.drain_timeout is not None:
+            poll_interval = min(poll_interval, self.drain_timeout)
+        while self.consuming:
+            try:
+                self._start_consumer()
+                while self.consuming:
+                    self._drain_events(poll_interval)
+                    await asyncio.sleep(0)
+            except self.connection_errors as ex:
+                if self.consuming:
+                    await self._reconnect_async(ex)
+        self._stop_consumer()
+
+    def _start_consumer(self):
+        self.app_logger.info("Consumer is starting to consume"
+                             " RabbitMQ messages.")
+        if not self.paused:
+            self.consumer.consume()
+
+    def _stop_consumer(self):
+        self.app_logger.info("Consumer is stopping consuming"
+                             "RabbitMQ messages.")
+        try:
+            self.consumer.cancel()
+        except self.connection_errors:
+            pass
         self.app_logger.info("Consumer stopped consuming RabbitMQ messages.")
 
+    def _drain_events(self, timeout):
+        """
+        Waits for a single message and then calls the tick callbacks.
+        :param timeout: the maximum time in seconds to wait, or None
+        :return:
+        """
+        try:
+            self.connection.drain_events(timeout=timeout)
+        except socket.timeout:
+            pass
+        for callback in self.tick_callbacks:
+            callback()
+
     def close_connection(self):
         """
         Closes the channels/connections.
@@ -100,6 +809,17 @@ class RabbitMQConnection:
         """
         # for now called when you press Ctrl-C
         self.consuming = False
+        if self.raw_filter:
+            self.app_logger.info("Raw filter dropped %d messages and let "
+                                 "%d through.", self.filtered, self.passed)
+        if self.reconnects:
+            self.app_logger.info("Reconnected to RabbitMQ %d times, %.1f "
+                                 "seconds downtime in total.",
+                                 self.reconnects, self.downtime)
+        if self.confirmed_publisher:
+            self.confirmed_publisher.close()
+        if self.republisher:
+            self.republisher.close()
         self.producer.release()
         self.connection.release()
         self.app_logger.info("SIGINT/SIGTERM received. "
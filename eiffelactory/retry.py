@@ -0,0 +1,131 @@
+"""
+Module for retrying Artifactory lookups that found no artifact, e.g. because
+the ArtC event was received before the artifact upload had finished.
+"""
+import heapq
+import itertools
+import logging
+import time
+
+
+class RetryEntry:
+    """
+    A pending retry of an artifact lookup.
+
+    :param artc_meta_id: the id of the ArtC event the lookup belongs to
+    :param lookup: tuple: the artifact filename and the build path substring
+    :param first_seen: the monotonic time of the first lookup
+    """
+
+    def __init__(self, artc_meta_id, lookup, first_seen):
+        self.artc_meta_id = artc_meta_id
+        self.lookup = lookup
+        self.first_seen = first_seen
+        self.attempts = 0
+
+
+class RetryScheduler:
+    """
+    Bounded heap-based scheduler for lookup retries with exponential backoff.
+
+    :param max_pending: the maximum number of pending retries
+    :param initial_delay: seconds to wait before the first retry
+    :param max_delay: the maximum number of seconds between two retries
+    :param backoff: the factor the delay is multiplied with after each retry
+    :param max_age: seconds after the first lookup when retrying gives up
+    """
+
+    def __init__(self, max_pending, initial_delay, max_delay, backoff,
+                 max_age):
+        self.app_logger = logging.getLogger('app')
+        self.max_pending = max_pending
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.max_age = max_age
+        self.scheduled = 0
+        self.dropped = 0
+        self.expired = 0
+        self._heap = []
+        self._pending_ids = set()
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, artc_meta_id, lookup):
+        """
+        Schedules the first retry of a lookup.
+        :param artc_meta_id: the id of the ArtC event the lookup belongs to
+        :param lookup: tuple: the artifact filename and the build path
+        substring
+        :return: True if the retry was scheduled
+        """
+        if artc_meta_id in self._pending_ids:
+            return True
+        if self._drop_if_full(artc_meta_id):
+            return False
+        entry = RetryEntry(artc_meta_id, lookup, time.monotonic())
+        self._pending_ids.add(artc_meta_id)
+        self._push(entry)
+        return True
+
+    def reschedule(self, entry):
+        """
+        Schedules the next retry of a lookup that still found no artifact,
+        unless it has reached its maximum age.
+        :param entry: the RetryEntry returned by pop_due
+        :return: True if the retry was scheduled
+        """
+        if time.monotonic() - entry.first_seen >= self.max_age:
+            self.expired += 1
+            self.app_logger.warning("Giving up on ArtC '%s' after %d retries, "
+                                    "artifact '%s' was not found",
+                                    entry.artc_meta_id, entry.attempts,
+                                    entry.lookup[0])
+            return False
+        if entry.artc_meta_id in self._pending_ids:
+            return True
+        if self._drop_if_full(entry.artc_meta_id):
+            return False
+        self._pending_ids.add(entry.artc_meta_id)
+        self._push(entry)
+        return True
+
+    def _drop_if_full(self, artc_meta_id):
+        if len(self._heap) < self.max_pending:
+            return False
+        self.dropped += 1
+        self.app_logger.warning("Retry queue is full (%d), dropping ArtC "
+                                "'%s'", len(self._heap), artc_meta_id)
+        return True
+
+    def pop_due(self):
+        """
+        Removes and returns all retries that are due.
+        :return: list of RetryEntry objects
+        """
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)[2]
+            self._pending_ids.discard(entry.artc_meta_id)
+            entry.attempts += 1
+            due.append(entry)
+        return due
+
+    def _push(self, entry):
+        delay = min(self.initial_delay * self.backoff ** entry.attempts,
+                    self.max_delay)
+        heapq.heappush(self._heap, (time.monotonic() + delay,
+                                    next(self._sequence), entry))
+        self.scheduled += 1
+
+    def stats(self):
+        """
+        :return: dict with the queue depth and the retry counters
+        """
+        return {'pending': len(self._heap),
+                'scheduled': self.scheduled,
+                'dropped': self.dropped,
+                'expired': self.expired}
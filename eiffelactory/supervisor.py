@@ -0,0 +1,210 @@
+"""
+Module for running several app processes from one config, each with its own
+RabbitMQ consumer on the shared queue and its own Artifactory connection.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+
+from eiffelactory import config
+from eiffelactory import utils
+
+# the maximum number of seconds between two checks for crashed workers
+CHECK_INTERVAL = 1.0
+
+# seconds to wait before restarting a crashed worker, doubled for every
+# crash in a row of a worker that didn't stay up for MIN_UPTIME seconds
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+MIN_UPTIME = 30.0
+
+# seconds the workers get to finish their events after SIGTERM before they
+# are killed
+SHUTDOWN_TIMEOUT = 30.0
+
+
+def run_app(new_process_group=False):
+    """
+    Creates and runs the app for the configured mode.
+    :param new_process_group: if True, the process leaves the process group
+    of the supervisor, so that a Ctrl-C in the terminal only reaches the
+    supervisor, which then shuts the workers down
+    """
+    if new_process_group and hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    # imported here since importing the app module opens the log files and
+    # reads the config, which the supervisor process doesn't need
+    from eiffelactory import app
+    app.create_app().run()
+
+
+def run_worker():
+    run_app(new_process_group=True)
+
+
+class WorkerProcess:
+    """
+    A supervised worker process and its restart state.
+
+    :param index: the number of the worker
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.started = None
+        self.restart_at = None
+        self.crashes = 0
+
+
+class Supervisor:
+    """
+    Starts a number of worker processes, restarts the ones that exit and
+    forwards SIGTERM and SIGINT to them as SIGTERM for a graceful shutdown.
+    SIGUSR1 is forwarded as it is.
+
+    :param processes: the number of worker processes
+    :param target: the function run by each worker process
+    :param restart_delay: seconds to wait before restarting a crashed worker
+    :param shutdown_timeout: seconds to wait for the workers to exit after
+    SIGTERM before they are killed
+    """
+
+    def __init__(self, processes, target=run_worker,
+                 restart_delay=RESTART_DELAY,
+                 shutdown_timeout=SHUTDOWN_TIMEOUT):
+        self.logger = logging.getLogger('supervisor')
+        self.target = target
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [WorkerProcess(index) for index in range(processes)]
+        self.stopping = False
+        self.restarts = 0
+        self._terminated = False
+
+    def run(self):
+        """
+        Runs the workers until SIGTERM or SIGINT is received.
+        """
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._forward_signal_handler)
+        self.start()
+        while not self.stopping:
+            sentinels = [worker.process.sentinel for worker in self.workers
+                         if worker.restart_at is None]
+            multiprocessing.connection.wait(sentinels, CHECK_INTERVAL)
+            if not self.stopping:
+                self.check_workers()
+        self.stop()
+
+    def start(self):
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def _start_worker(self, worker):
+        worker.process = self.context.Process(
+            target=self.target, name='eiffelactory-{}'.format(worker.index))
+        # spawned processes inherit the environment when they are started
+        os.environ[utils.WORKER_INDEX_ENV] = str(worker.index)
+        try:
+            worker.process.start()
+        finally:
+            del os.environ[utils.WORKER_INDEX_ENV]
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        self.logger.info("Started worker %d with pid %d.", worker.index,
+                         worker.process.pid)
+
+    def check_workers(self):
+        """
+        Schedules the restart of workers that have exited, and restarts the
+        ones that are due.
+        """
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self.restarts += 1
+                    self._start_worker(worker)
+                continue
+            if worker.process.is_alive():
+                continue
+            if now - worker.started >= MIN_UPTIME:
+                worker.crashes = 0
+            delay = min(self.restart_delay * 2 ** worker.crashes,
+                        MAX_RESTART_DELAY)
+            worker.crashes += 1
+            worker.restart_at = now + delay
+            self.logger.error("Worker %d exited with code %s, restarting it "
+                              "in %s seconds.", worker.index,
+                              worker.process.exitcode, delay)
+            if delay == 0:
+                self.restarts += 1
+                self._start_worker(worker)
+
+    def _signal_handler(self, signal_received, frame):
+        if not self.stopping:
+            self.logger.info("Received signal %d, stopping workers.",
+                             signal_received)
+        self.stopping = True
+        self._terminate_workers()
+
+    def _forward_signal_handler(self, signal_received, frame):
+        """
+        Forwards a signal to the workers, e.g. SIGUSR1 to profile all of
+        them.
+        """
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signal_received)
+
+    def _terminate_workers(self):
+        # a second SIGTERM would interrupt the graceful shutdown of a worker
+        if self._terminated:
+            return
+        self._terminated = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+
+    def stop(self):
+        """
+        Sends SIGTERM to the workers and waits for them to exit, killing the
+        ones that don't exit within the shutdown timeout.
+        """
+        self.stopping = True
+        self._terminate_workers()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                self.logger.error("Worker %d didn't stop in time, killing "
+                                  "it.", worker.index)
+                worker.process.kill()
+                worker.process.join()
+        self.logger.info("All workers stopped, %d restarts.", self.restarts)
+
+
+def main():
+    """
+    Runs the app in this process, or in the configured number of supervised
+    worker processes.
+    """
+    cfg = config.Config()
+    processes = cfg.eiffelactory.processes
+    if processes <= 1:
+        run_app()
+        return
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    utils.setup_app_logger('supervisor', 'supervisor.log', logging.INFO,
+                           json_lines=cfg.eiffelactory.log_format == 'json')
+    Supervisor(processes).run()
@@ -0,0 +1,214 @@
+"""
+Module for tracing the processing of single ArtC events and for profiling
+the running app. A trace records when an event was received, looked up,
+published and settled, and is written as one JSON object per event. The
+sampling profiler writes the stacks of all threads in the collapsed format
+read by flame graph tools.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+from eiffelactory import codec
+
+# the maximum number of unfinished traces kept, the oldest ones are dropped
+# when events are never settled, e.g. because the connection was lost
+MAX_OPEN_TRACES = 10000
+
+
+class Trace:
+    """
+    The marks recorded for one event.
+
+    :param event_id: the meta.id of the event
+    """
+
+    __slots__ = ('event_id', 'started', 'start', 'marks')
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.started = time.time()
+        self.start = time.monotonic()
+        self.marks = {'receive': 0.0}
+
+    def mark(self, name):
+        self.marks[name] = time.monotonic() - self.start
+
+    def to_dict(self, outcome):
+        """
+        :param outcome: how the event was settled, e.g. ack
+        :return: dict with the marks in seconds since the event was received
+        and the spans between them
+        """
+        marks = self.marks
+        spans = [{'name': 'event', 'start': 0.0,
+                  'duration': marks['settle']}]
+        for name, start, end in (('lookup', 'lookup_start', 'lookup_end'),
+                                 ('publish', 'publish', 'settle')):
+            if start in marks and end in marks:
+                spans.append({'name': name, 'start': marks[start],
+                              'duration': marks[end] - marks[start]})
+        return {'event_id': self.event_id,
+                'time': self.started,
+                'duration': marks['settle'],
+                'outcome': outcome,
+                'marks': marks,
+                'spans': spans}
+
+
+class Tracer:
+    """
+    Traces a sampled fraction of the events, keyed by their meta.id, and
+    writes the trace of each event when it has been settled.
+
+    :param logger: the logger the traces are written to as JSON bytes
+    :param sample_rate: the fraction of the events that are traced
+    :param min_duration: only traces of events that took at least this many
+    seconds are written
+    """
+
+    def __init__(self, logger, sample_rate=1.0, min_duration=0.0):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.min_duration = min_duration
+        self.traces = collections.OrderedDict()
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, event_id):
+        """
+        Starts the trace of a received event, if it is sampled.
+        :param event_id: the meta.id of the event
+        """
+        with self._lock:
+            self._credit += self.sample_rate
+            if self._credit < 1:
+                return
+            self._credit -= 1
+            self.traces[event_id] = Trace(event_id)
+            if len(self.traces) > MAX_OPEN_TRACES:
+                self.traces.popitem(last=False)
+
+    def mark(self, event_id, name):
+        """
+        Records the time of a step of an event, if it is traced.
+        :param event_id: the meta.id of the event
+        :param name: the name of the step, e.g. lookup_start
+        """
+        trace = self.traces.get(event_id)
+        if trace is not None:
+            trace.mark(name)
+
+    def finish(self, event_id, outcome):
+        """
+        Finishes the trace of a settled event and writes it.
+        :param event_id: the meta.id of the event
+        :param outcome: how the event was settled, e.g. ack
+        """
+        with self._lock:
+            trace = self.traces.pop(event_id, None)
+        if trace is None:
+            return
+        trace.mark('settle')
+        if trace.marks['settle'] >= self.min_duration:
+            self.logger.info(codec.dumps(trace.to_dict(outcome)))
+
+
+class _NullTracer:
+    """
+    Stands in for the Tracer when tracing is disabled.
+    """
+
+    def start(self, event_id):
+        pass
+
+    def mark(self, event_id, name):
+        pass
+
+    def finish(self, event_id, outcome):
+        pass
+
+
+NULL_TRACER = _NullTracer()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads of the process at a fixed interval for
+    a while, on a background thread, and writes how often each stack was
+    seen in the collapsed stack format, one "thread;frame;frame count" line
+    per stack.
+
+    :param directory: the directory the profiles are written to
+    :param interval: seconds between two samples
+    """
+
+    def __init__(self, directory, interval=0.01):
+        self.app_logger = logging.getLogger('app')
+        self.directory = directory
+        self.interval = interval
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration):
+        """
+        Starts profiling, unless a profile is already being taken.
+        :param duration: seconds to profile for
+        :return: False if a profile is already being taken
+        """
+        if self.running:
+            return False
+        self._thread = threading.Thread(target=self._profile,
+                                        args=(duration,),
+                                        name='profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def _profile(self, duration):
+        self.app_logger.info("Profiling for %s seconds.", duration)
+        stacks = self.sample(duration)
+        path = os.path.join(self.directory, 'profile-{}-{}.collapsed'.format(
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        with open(path, 'w', encoding='utf-8') as profile_file:
+            for stack, count in stacks.most_common():
+                profile_file.write('{} {}\n'.format(stack, count))
+        self.app_logger.info("Wrote profile of %d samples to %s.",
+                             sum(stacks.values()), path)
+
+    def sample(self, duration):
+        """
+        Samples the stacks of all other threads.
+        :param duration: seconds to sample for
+        :return: Counter of collapsed stacks
+        """
+        stacks = collections.Counter()
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stacks[_collapse(names.get(thread_id, thread_id),
+                                 frame)] += 1
+            time.sleep(self.interval)
+        return stacks
+
+
+def _collapse(thread_name, frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{}:{}'.format(
+            frame.f_globals.get('__name__', code.co_filename),
+            code.co_name))
+        frame = frame.f_back
+    frames.append(str(thread_name))
+    return ';'.join(reversed(frames)).replace(' ', '_')
@@ -2,9 +2,19 @@
 Utils module used by other classes in the app for parsing purl, creating
 timestamps, etc.
 """
+import atexit
+import collections.abc
 import logging
+import logging.handlers
+import os
+import queue
+import threading
 import time
 
+# environment variable with the index of a worker process run by the
+# supervisor, e.g. used to give each worker its own metrics port and files
+WORKER_INDEX_ENV = 'EIFFELACTORY_WORKER_INDEX'
+
 
 def current_time_millis():
     """
@@ -14,57 +24,348 @@ def current_time_millis():
     return int(round(time.time() * 1000))
 
 
-def setup_event_logger(logname, filename, level=logging.WARNING):
+def worker_index():
+    """
+    :return: the index of this worker process if it was started by the
+    supervisor, otherwise None
+    """
+    index = os.environ.get(WORKER_INDEX_ENV)
+    return int(index) if index is not None else None
+
+
+def worker_filename(filename):
+    """
+    Gives each worker process run by the supervisor its own file, by adding
+    the worker index before the file extension.
+    :param filename: the configured filename, e.g. eiffelactory.log
+    :return: the filename, e.g. eiffelactory.2.log for worker 2
+    """
+    index = worker_index()
+    if index is None:
+        return filename
+    root, extension = os.path.splitext(filename)
+    return '{}.{}{}'.format(root, index, extension)
+
+
+def setup_event_logger(logname, filename, level=logging.WARNING,
+                       json_lines=False, **options):
     """
     Creates a logger for Eiffel events (received/published/AQL queries).
+    Events can be logged as dicts or as their JSON bytes, which are written
+    as they are.
 
     :param logname: the name of the logger
     :param filename: the filename to log to
     :param level: the minimum log level
+    :param json_lines: if True, each record is written as a JSON object on
+    its own line, with the event as its message
+    :param options: the options of setup_logger
     """
-    formatter = logging.Formatter('%(asctime)s : %(message)s')
-    return setup_logger(logname, filename, formatter, level=level)
+    if json_lines:
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = EventFormatter('%(asctime)s : %(message)s')
+    return setup_logger(logname, filename, formatter, level=level, **options)
 
 
-def setup_app_logger(logname, filename, level=logging.WARNING):
+def setup_app_logger(logname, filename, level=logging.WARNING,
+                     json_lines=False, **options):
     """
     Creates a logger for app debugging.
 
     :param logname: the name of the logger
     :param filename: the filename to log to
     :param level: the minimum log level
+    :param json_lines: if True, each record is written as a JSON object on
+    its own line
+    :param options: the options of setup_logger
     """
-    formatter = logging.Formatter(
-        '%(asctime)s : %(levelname)-8s [%(module)s:%(lineno)d]  %(message)s')
-    return setup_logger(logname, filename, formatter, level=level)
+    if json_lines:
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s : %(levelname)-8s [%(module)s:%(lineno)d]  '
+            '%(message)s')
+    return setup_logger(logname, filename, formatter, level=level, **options)
 
 
-def setup_logger(logname, filename, formatter, level=logging.WARNING):
+def setup_logger(logname, filename, formatter, level=logging.WARNING,
+                 background=False, max_bytes=0, when=None, backup_count=0,
+                 sample_rate=1.0):
     """
-    Sets up a logger with a file handle.
+    Sets up a logger with a file handle. Worker processes run by the
+    supervisor each log to their own file, see worker_filename.
 
     :param logname: the name of the logger
     :param filename: the filename to log to
     :param formatter: the log message formatter to use
     :param level: the minimum log level
+    :param background: if True, records are formatted and written by the
+    background log writer, which flushes the file once per batch of records
+    :param max_bytes: rotate the file when it would grow larger than this,
+    0 disables size rotation
+    :param when: rotate the file at this interval, e.g. midnight or H, see
+    logging.handlers.TimedRotatingFileHandler. Takes precedence over
+    max_bytes
+    :param backup_count: the number of rotated files to keep
+    :param sample_rate: the fraction of the records that are logged
     :return:
     """
-    handler = logging.FileHandler("logs/%s" % filename)
+    handler = _create_file_handler("logs/%s" % worker_filename(filename),
+                                   background, max_bytes, when, backup_count)
     handler.setFormatter(formatter)
     logger = logging.getLogger(logname)
     logger.setLevel(level)
+    if sample_rate < 1:
+        logger.addFilter(SamplingFilter(sample_rate))
+    if background:
+        handler = _background_writer().add_handler(handler)
     logger.addHandler(handler)
 
     return logger
 
 
+def _create_file_handler(path, background, max_bytes, when, backup_count):
+    if when:
+        handler_class = _BatchedTimedRotatingFileHandler if background \
+            else logging.handlers.TimedRotatingFileHandler
+        return handler_class(path, when=when, backupCount=backup_count,
+                             encoding='utf-8')
+    if max_bytes:
+        handler_class = _BatchedRotatingFileHandler if background \
+            else logging.handlers.RotatingFileHandler
+        return handler_class(path, maxBytes=max_bytes,
+                             backupCount=backup_count, encoding='utf-8')
+    handler_class = _BatchedFileHandler if background \
+        else logging.FileHandler
+    return handler_class(path, encoding='utf-8')
+
+
+class EventFormatter(logging.Formatter):
+    """
+    Formatter for event loggers, which writes events logged as JSON bytes
+    as the JSON text.
+    """
+
+    def format(self, record):
+        if isinstance(record.msg, bytes):
+            record.msg = record.msg.decode('utf-8')
+        return super().format(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats each record as a JSON object on one line, with the time, level,
+    logger name and message. Events logged as JSON bytes are spliced in as
+    the message without being decoded, and events logged as dicts are
+    serialized as JSON objects.
+    """
+
+    def format(self, record):
+        # imported here since the codec isn't needed by text logging
+        from eiffelactory import codec
+
+        if isinstance(record.msg, bytes):
+            message = record.msg
+        elif isinstance(record.msg, (dict, list)) and not record.args:
+            message = codec.dumps(record.msg)
+        else:
+            message = codec.dumps(record.getMessage())
+        fields = {'time': self.formatTime(record),
+                  'level': record.levelname,
+                  'logger': record.name}
+        if record.exc_info:
+            fields['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            fields['exception'] = record.exc_text
+        line = codec.dumps(fields)[:-1] + b',"message":' + message + b'}'
+        return line.decode('utf-8')
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets an evenly spread fraction of the records through, e.g. every tenth
+    record for a rate of 0.1.
+
+    :param rate: the fraction of the records to let through, 0 to 1
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._credit = 0.0
+
+    def filter(self, record):
+        self._credit += self.rate
+        if self._credit < 1:
+            return False
+        self._credit -= 1
+        return True
+
+
+class _BatchFlushMixin:
+    """
+    Mixin for file handlers used by the background log writer, which flushes
+    them once per batch instead of after every record.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class _BatchedFileHandler(_BatchFlushMixin, logging.FileHandler):
+    pass
+
+
+class _BatchedRotatingFileHandler(_BatchFlushMixin,
+                                  logging.handlers.RotatingFileHandler):
+    pass
+
+
+class _BatchedTimedRotatingFileHandler(
+        _BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the background thread, instead of
+    formatting every record on the logging thread. Records with exception
+    info are still prepared on the logging thread, so that the traceback
+    doesn't keep the frames alive.
+    """
+
+    def __init__(self, log_queue, target):
+        super().__init__(log_queue)
+        self.target = target
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.queue.put((self.target, record))
+
+
+class BackgroundLogWriter:
+    """
+    Formats and writes the log records of several loggers on one background
+    thread. Records are handled in batches of up to batch_size records, and
+    each file written to is flushed once per batch.
+
+    :param batch_size: the maximum number of records handled between flushes
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size=512):
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.handlers = []
+        self.queue_handlers = []
+        self._thread = None
+
+    def add_handler(self, handler):
+        """
+        Adds a handler whose records are written on the background thread.
+        :param handler: a file handler created with _BatchFlushMixin
+        :return: the QueueHandler to add to the logger instead of handler
+        """
+        self.handlers.append(handler)
+        queue_handler = _LazyQueueHandler(self.queue, handler)
+        self.queue_handlers.append(queue_handler)
+        return queue_handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='log-writer', daemon=True)
+        self._thread.start()
+
+    def restart_after_fork(self):
+        """
+        Starts a new background thread in a forked process, which only
+        inherits the thread that forked it, with a new queue since the
+        inherited one may have been locked by another thread.
+        """
+        if self._thread is None:
+            return
+        self.queue = queue.SimpleQueue()
+        for queue_handler in self.queue_handlers:
+            queue_handler.queue = self.queue
+        self.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            written = set()
+            for item in batch:
+                if item is self._STOP:
+                    self._flush(written)
+                    return
+                handler, record = item
+                handler.handle(record)
+                written.add(handler)
+            self._flush(written)
+
+    @staticmethod
+    def _flush(handlers):
+        for handler in handlers:
+            handler.acquire()
+            try:
+                handler.flush_batch()
+            finally:
+                handler.release()
+
+    def stop(self):
+        """
+        Writes the records that are queued and stops the background thread.
+        """
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+
+_BACKGROUND_WRITER = None
+
+
+def _background_writer():
+    global _BACKGROUND_WRITER
+    if _BACKGROUND_WRITER is None:
+        _BACKGROUND_WRITER = BackgroundLogWriter()
+        _BACKGROUND_WRITER.start()
+        atexit.register(_BACKGROUND_WRITER.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(
+                after_in_child=_BACKGROUND_WRITER.restart_after_fork)
+    return _BACKGROUND_WRITER
+
+
 def remove_none_from_dict(dictionary):
     """
-    Recursively removes None values from a dictionary
+    Recursively removes None values from a dictionary. Any mapping, such as
+    the Eiffel models, is copied into a plain dict, also inside lists, so the
+    result can be passed to json.dumps
     :param dictionary: the dictionary to clean
     :return: a copy of the dictionary with None values removed
     """
-    if not isinstance(dictionary, dict):
+    if isinstance(dictionary, list):
+        return [remove_none_from_dict(value) for value in dictionary]
+    if not isinstance(dictionary, collections.abc.Mapping):
         return dictionary
 
     return {k: remove_none_from_dict(v)
@@ -90,3 +391,18 @@ def parse_purl(purl):
     artifact_filename = purl.split('@')[0].split('/')[-1]
     build_path = purl.split('?build_path=')[-1]
     return artifact_filename, build_path
+
+
+def parse_purl_directories(purl):
+    """
+    Finds the intermediate directories in the purl of an Eiffel ArtC event
+    :param purl: the purl from the Eiffel ArtC event
+    :return: the directories between pkg: and the artifact filename, joined
+    by '/'
+    """
+    # pkg:<intermediate_directories>/<artifact_filename>@<build_number>?
+    # build_path=< build_path >
+    path = purl.split('?')[0].split('@')[0]
+    if path.startswith('pkg:'):
+        path = path[len('pkg:'):]
+    return '/'.join(path.split('/')[:-1])
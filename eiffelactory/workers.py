@@ -0,0 +1,151 @@
+"""
+Module for processing events on a pool of worker threads or processes, while
+the RabbitMQ messages are consumed and acked on the main thread.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+from eiffelactory import artifactory
+from eiffelactory import config
+from eiffelactory import utils
+
+# the Artifactory connection of a worker process
+_process_connection = None
+
+
+def _init_process_worker(config_filename):
+    """
+    Initializer of the worker processes, which can't share the Artifactory
+    connection of the main process. The processes are spawned, so they set
+    up their own app log. The artifact index is only synced and read in the
+    main process, the worker processes get the lookups it can't answer.
+    :param config_filename: the config file to read the artifactory section
+    from
+    """
+    global _process_connection
+    cfg = config.Config(config_filename)
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    utils.setup_app_logger('app', 'eiffelactory.log', logging.INFO,
+                           json_lines=cfg.eiffelactory.log_format == 'json')
+    _process_connection = artifactory.ArtifactoryConnection(cfg.artifactory,
+                                                            use_index=False)
+
+
+def find_artifact_in_process(lookup, use_cache=True):
+    """
+    Looks up an artifact with the Artifactory connection of the worker
+    process.
+    :param lookup: the lookup tuple
+    :param use_cache: False to bypass the lookup cache
+    :return: tuple: the results list, or None if the query failed, and the
+    seconds the lookup took, so that the main process can feed its flow
+    control with them
+    :raises ArtifactoryUnavailableError: if the query failed
+    """
+    start = time.monotonic()
+    results = _process_connection.find_artifact_on_artifactory(
+        *lookup, use_cache=use_cache)
+    return results, time.monotonic() - start
+
+
+class WorkerPool:
+    """
+    Bounded pool of worker threads or processes. Work items are submitted and
+    their outcomes handled on the consuming thread, so that messages can be
+    acked without sharing the AMQP channel between threads. Outcomes are
+    handled in the order the work items finish, not the order they were
+    submitted in.
+
+    :param worker_type: thread or process
+    :param workers: the number of workers
+    :param max_in_flight: the maximum number of submitted work items whose
+    outcome hasn't been handled, submit blocks when it is reached
+    :param config_filename: the config file read by worker processes
+    :param limit: optional callable returning the current maximum number of
+    work items in flight, e.g. the concurrency limit of an AimdLimiter,
+    capped by max_in_flight
+    """
+
+    def __init__(self, worker_type, workers, max_in_flight,
+                 config_filename=config.DEFAULT_CONFIG_FILENAME, limit=None):
+        self.app_logger = logging.getLogger('app')
+        if worker_type == 'thread':
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers)
+        elif worker_type == 'process':
+            # spawned rather than forked, since the main process has
+            # started threads, e.g. the log writer, by the time the pool
+            # starts its processes
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process_worker,
+                initargs=(config_filename,))
+        else:
+            raise ValueError("Unknown worker type '{}'".format(worker_type))
+        self.max_in_flight = max_in_flight
+        self.limit = limit
+        self.in_flight = 0
+        self.submitted = 0
+        self._done = queue.Queue()
+
+    def submit(self, on_done, function, *args):
+        """
+        Submits a work item, first handling finished work items until fewer
+        than the limit are in flight.
+        :param on_done: called on the consuming thread with the future of the
+        work item when it has finished
+        :param function: the function the worker runs
+        :param args: the arguments of the function
+        """
+        self.wait_for_capacity()
+        future = self.executor.submit(function, *args)
+        self.in_flight += 1
+        self.submitted += 1
+        future.add_done_callback(
+            lambda done_future: self._done.put((on_done, done_future)))
+
+    def wait_for_capacity(self):
+        """
+        Handles finished work items until fewer than the limit are in
+        flight, so that the next submit doesn't block.
+        """
+        while self.in_flight >= self._current_limit():
+            self._handle_done(self._done.get())
+
+    def _current_limit(self):
+        if self.limit is None:
+            return self.max_in_flight
+        return max(min(self.limit(), self.max_in_flight), 1)
+
+    def handle_done(self):
+        """
+        Handles the work items that have finished since the last call.
+        Meant to be called periodically from the consuming thread.
+        """
+        while True:
+            try:
+                done = self._done.get_nowait()
+            except queue.Empty:
+                return
+            self._handle_done(done)
+
+    def _handle_done(self, done):
+        on_done, future = done
+        self.in_flight -= 1
+        on_done(future)
+
+    def shutdown(self):
+        """
+        Waits for the work items in flight to finish and handles them.
+        """
+        if self.in_flight:
+            self.app_logger.info("Waiting for %d events in progress.",
+                                 self.in_flight)
+        self.executor.shutdown(wait=True)
+        self.handle_done()
@@ -1,5 +1,4 @@
-from eiffelactory import app
+from eiffelactory import supervisor
 
 if __name__ == "__main__":
-    APP = app.App()
-    APP.run()
+    supervisor.main()
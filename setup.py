@@ -6,4 +6,6 @@ setup(name='Eiffelactory',
       url="http://github.com/Hedenius/eiffelactory",
       license='MIT',
       packages=['eiffelactory'],
+      python_requires='>=3.7',
+      extras_require={'orjson': ['orjson']},
       test_suite='tests')
@@ -0,0 +1,422 @@
+import asyncio
+import concurrent.futures
+import unittest
+from unittest.mock import call, patch
+
+from eiffelactory import app
+from eiffelactory import config
+from eiffelactory import flowcontrol
+
+ARTC_ID = '5de6f82d-52b6-44ae-bdbb-0be4fc213184'
+IDENTITY = 'pkg:job/DIR/job/PROJECT/{}/artifacts/a.zip@{}'
+ARTIFACT = {'repo': 'repo', 'path': 'path', 'name': 'a.zip'}
+
+
+def create_artc_event(artc_meta_id=ARTC_ID, source='EVENT-source_2',
+                      build=8):
+    return {'meta': {'id': artc_meta_id,
+                     'type': 'EiffelArtifactCreatedEvent',
+                     'source': {'name': source}},
+            'data': {'identity': IDENTITY.format(build, build)}}
+
+
+class FakeMessage:
+    """
+    Stands in for a kombu message, remembering how it was settled.
+    """
+
+    def __init__(self, headers=None):
+        self.body = b'{}'
+        self.headers = headers or {}
+        self.content_type = 'application/json'
+        self.content_encoding = 'utf-8'
+        self.state = None
+
+    @property
+    def acknowledged(self):
+        return self.state is not None
+
+    def _settle(self, state):
+        if self.state is not None:
+            raise AssertionError("Message already {}".format(self.state))
+        self.state = state
+
+    def ack(self):
+        self._settle('ack')
+
+    def requeue(self):
+        self._settle('requeue')
+
+    def reject(self):
+        self._settle('reject')
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Runs an app with mocked RabbitMQ and Artifactory connections, whose
+    published ArtP events are confirmed right away.
+    """
+
+    app_class = app.App
+    options = {}
+
+    def setUp(self):
+        self.config = config.Config('tests/all_options.config')
+        for (section, option), value in self.options.items():
+            self.config._config.set(section, option, value)
+        for patcher in (patch.object(app, 'CFG', self.config),
+                        patch('eiffelactory.rabbitmq.RabbitMQConnection'),
+                        patch('eiffelactory.artifactory.'
+                              'ArtifactoryConnection'),
+                        patch('eiffelactory.app.signal.signal')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.app = self.app_class()
+        self.rmq_connection = self.app.rmq_connection
+        self.rmq_connection.connection_errors = (OSError,)
+        self.rmq_connection.republish_errors = (OSError,)
+        self.rmq_connection.reconnects = 0
+        self.published = []
+        self.rmq_connection.publish_message.side_effect = self._publish
+        self.artifactory_connection = self.app.artifactory_connection
+        self.artifactory_connection.circuit_breaker.state = \
+            flowcontrol.CLOSED
+        self.find = self.artifactory_connection.find_artifact_on_artifactory
+        self.find.return_value = [ARTIFACT]
+
+    def _publish(self, body, on_confirm=None):
+        self.published.append(body)
+        if on_confirm:
+            on_confirm(True)
+
+    def receive(self, event=None, message=None):
+        message = message or FakeMessage()
+        self.app.on_message_received(event or create_artc_event(), message)
+        return message
+
+
+class SettleTests:
+    """
+    How an app settles the messages of the events it receives, run for each
+    mode by receiving an event and waiting until its processing is done.
+    """
+
+    options = {('eiffelactory', 'retry_mode'): 'broker',
+               ('eiffelactory', 'retry_max_attempts'): '2'}
+
+    def process(self, event=None, message=None):
+        return self.receive(event, message)
+
+    def test_found_artifact_is_published_before_ack(self):
+        states = []
+        self.rmq_connection.publish_message.side_effect = \
+            lambda body, on_confirm: (states.append(message.state),
+                                      on_confirm(True))
+        message = FakeMessage()
+
+        self.process(message=message)
+
+        self.assertEqual(states, [None])
+        self.assertEqual(message.state, 'ack')
+        self.assertEqual(self.app.in_flight, 0)
+
+    def test_unconfirmed_artp_requeues(self):
+        self.rmq_connection.publish_message.side_effect = \
+            lambda body, on_confirm: on_confirm(False)
+
+        message = self.process()
+
+        self.assertEqual(message.state, 'requeue')
+        self.assertEqual(self.app.in_flight, 0)
+
+    def test_unavailable_artifactory_requeues(self):
+        self.find.side_effect = \
+            app.artifactory.ArtifactoryUnavailableError('down')
+
+        message = self.process()
+
+        self.assertEqual(message.state, 'requeue')
+        self.assertEqual(self.published, [])
+
+    def test_missing_artifact_is_parked_before_ack(self):
+        self.find.return_value = []
+        states = []
+        self.rmq_connection.park_message.side_effect = \
+            lambda message, retries, delay: states.append(message.state)
+
+        message = self.process()
+
+        self.assertEqual(states, [None])
+        self.assertEqual(message.state, 'ack')
+        self.rmq_connection.park_message.assert_called_once_with(
+            message, 1, self.config.eiffelactory.retry_initial_delay)
+
+    def test_unconfirmed_park_is_requeued(self):
+        self.find.return_value = []
+        self.rmq_connection.park_message.side_effect = OSError('nacked')
+
+        message = self.process()
+
+        self.assertEqual(message.state, 'requeue')
+
+    def test_used_up_retries_are_dead_lettered(self):
+        self.find.return_value = []
+        message = FakeMessage({app.rabbitmq.RETRIES_HEADER: 2})
+
+        self.process(message=message)
+
+        self.assertEqual(message.state, 'ack')
+        self.rmq_connection.dead_letter_message.assert_called_once_with(
+            message, 'artifact not found')
+        self.rmq_connection.park_message.assert_not_called()
+
+    def test_invalid_event_is_rejected(self):
+        self.config._config.set('eiffelactory', 'invalid_events', 'reject')
+        event = create_artc_event()
+        del event['data']['identity']
+
+        message = self.process(event)
+
+        self.assertEqual(message.state, 'reject')
+        self.find.assert_not_called()
+        self.assertEqual(self.app.in_flight, 0)
+
+
+class TestAppSettling(SettleTests, AppTestCase):
+    pass
+
+
+class TestAsyncAppSettling(SettleTests, AppTestCase):
+
+    app_class = app.AsyncApp
+    options = dict(SettleTests.options)
+    options[('eiffelactory', 'mode')] = 'async'
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self.app.async_artifactory_connection.close)
+
+    def process(self, event=None, message=None):
+        async def process():
+            self.app.loop = asyncio.get_running_loop()
+            received = self.receive(event, message)
+            await asyncio.gather(*self.app.tasks)
+            return received
+        return asyncio.run(process())
+
+    def test_failed_processing_is_rejected(self):
+        self.find.side_effect = ValueError('bad results')
+
+        message = self.process()
+
+        self.assertEqual(message.state, 'reject')
+        self.assertEqual(self.app.in_flight, 0)
+
+
+class TestWorkerAppSettling(SettleTests, AppTestCase):
+
+    app_class = app.WorkerApp
+    options = dict(SettleTests.options)
+    options[('eiffelactory', 'mode')] = 'workers'
+
+    def process(self, event=None, message=None):
+        received = self.receive(event, message)
+        self.app.worker_pool.shutdown()
+        return received
+
+    def test_failed_processing_is_rejected(self):
+        self.find.side_effect = ValueError('bad results')
+
+        message = self.process()
+
+        self.assertEqual(message.state, 'reject')
+        self.assertEqual(self.app.in_flight, 0)
+
+
+class TestApp(AppTestCase):
+
+    def test_unwanted_events_are_acked(self):
+        other_type = create_artc_event()
+        other_type['meta']['type'] = 'EiffelActivityStartedEvent'
+        other_source = create_artc_event(source='other')
+
+        messages = [self.receive(event) for event in (other_type,
+                                                      other_source)]
+
+        self.assertEqual([message.state for message in messages],
+                         ['ack', 'ack'])
+        self.find.assert_not_called()
+        self.assertEqual(self.app.in_flight, 0)
+
+    def test_malformed_source_is_rejected(self):
+        event = create_artc_event()
+        event['meta']['source'] = 'source name'
+
+        message = self.receive(event)
+
+        self.assertEqual(message.state, 'ack')
+        self.assertEqual(self.app.rejection_stats(),
+                         {'meta.source is not dict': 1})
+        self.rmq_connection.dead_letter_message.assert_called_once_with(
+            message, 'meta.source is not dict')
+        self.find.assert_not_called()
+
+    def test_duplicate_is_acked_without_processing(self):
+        self.receive()
+        duplicate = self.receive()
+
+        self.assertEqual(duplicate.state, 'ack')
+        self.assertEqual(len(self.published), 1)
+
+    def test_unsettled_event_is_processed_after_reconnect(self):
+        self.rmq_connection.publish_message.side_effect = OSError('lost')
+        lost = FakeMessage()
+        with self.assertRaises(OSError):
+            self.receive(message=lost)
+        self.assertIsNone(lost.state)
+
+        self.rmq_connection.reconnects = 1
+        self.rmq_connection.publish_message.side_effect = self._publish
+        redelivered = self.receive()
+
+        self.assertEqual(redelivered.state, 'ack')
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.app.unsettled, {})
+
+    def test_half_open_breaker_consumes_one_message_at_a_time(self):
+        breaker = self.artifactory_connection.circuit_breaker
+        for state in (flowcontrol.OPEN, flowcontrol.HALF_OPEN,
+                      flowcontrol.CLOSED):
+            breaker.state = state
+            self.app._check_circuit_breaker()
+
+        self.rmq_connection.pause_consuming.assert_called_once_with()
+        self.assertEqual(self.rmq_connection.resume_consuming.call_args_list,
+                         [call(prefetch_count=1), call()])
+
+    def test_received_body_is_logged_on_one_line(self):
+        event = create_artc_event()
+        message = FakeMessage()
+        message.body = b'{"meta": {"id": "a"}}'
+        self.assertIs(self.app._received_body(event, message), message.body)
+
+        message.body = b'{\n  "meta": {\r\n    "id": "a"\n  }\n}'
+        self.assertEqual(self.app._received_body(event, message),
+                         app.codec.dumps(event))
+
+
+class TestBatchingApp(AppTestCase):
+
+    options = {('artifactory', 'batch_size'): '2'}
+
+    def setUp(self):
+        super().setUp()
+        self.find_many = \
+            self.artifactory_connection.find_artifacts_on_artifactory
+        self.find_many.side_effect = \
+            lambda lookups: {lookup: [ARTIFACT] for lookup in lookups}
+
+    def test_message_is_acked_after_batch_is_published(self):
+        first = self.receive(create_artc_event('id1', build=1))
+        self.assertIsNone(first.state)
+
+        second = self.receive(create_artc_event('id2', build=2))
+
+        self.assertEqual(len(self.published), 2)
+        self.assertEqual((first.state, second.state), ('ack', 'ack'))
+        self.assertEqual(self.app.in_flight, 0)
+
+    def test_failed_batch_is_requeued(self):
+        self.find_many.side_effect = \
+            app.artifactory.ArtifactoryUnavailableError('down')
+
+        messages = [self.receive(create_artc_event(artc_meta_id, build=build))
+                    for build, artc_meta_id in enumerate(('id1', 'id2'))]
+
+        self.assertEqual([message.state for message in messages],
+                         ['requeue', 'requeue'])
+        self.assertEqual(self.published, [])
+
+    def test_signal_only_stops_consuming(self):
+        first = self.receive(create_artc_event('id1', build=1))
+
+        self.app._signal_handler(None, None)
+
+        self.assertFalse(self.rmq_connection.consuming)
+        self.assertIsNone(first.state)
+        self.rmq_connection.close_connection.assert_not_called()
+
+    def test_run_flushes_pending_lookups_before_closing(self):
+        first = self.receive(create_artc_event('id1', build=1))
+        self.rmq_connection.close_connection.side_effect = \
+            lambda: self.assertEqual(first.state, 'ack')
+
+        self.app.run()
+
+        self.rmq_connection.read_messages.assert_called_once_with()
+        self.rmq_connection.close_connection.assert_called_once_with()
+        self.artifactory_connection.close.assert_called_once_with()
+
+
+class TestProcessWorkerApp(AppTestCase):
+
+    app_class = app.WorkerApp
+    options = {('eiffelactory', 'mode'): 'workers',
+               ('eiffelactory', 'worker_type'): 'process'}
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self.app.worker_pool.shutdown)
+        self.limiter = flowcontrol.AimdLimiter(2, 1, 2, target_latency=1)
+        self.breaker = flowcontrol.CircuitBreaker(1, 10, reset_timeout=60)
+        self.artifactory_connection.limiter = self.limiter
+        self.artifactory_connection.circuit_breaker = self.breaker
+        self.find_in_index = \
+            self.artifactory_connection.find_artifact_in_index
+        self.find_in_index.return_value = None
+
+    @staticmethod
+    def _future(result=None, exception=None):
+        future = concurrent.futures.Future()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        return future
+
+    def test_lookup_outcomes_feed_flow_control(self):
+        self.assertTrue(self.app._start_process_lookup())
+        self.assertEqual(self.app._lookup_result(
+            self._future(([ARTIFACT], 0.1)), 0.2), [ARTIFACT])
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertEqual(self.breaker.state, flowcontrol.CLOSED)
+
+        self.app._start_process_lookup()
+        with self.assertRaises(app.artifactory.ArtifactoryUnavailableError):
+            self.app._lookup_result(self._future(
+                exception=app.artifactory.ArtifactoryUnavailableError()), 1)
+
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertEqual(self.breaker.state, flowcontrol.OPEN)
+
+    def test_open_breaker_requeues_without_lookup(self):
+        self.breaker.record_failure()
+
+        message = self.receive()
+
+        self.assertEqual(message.state, 'requeue')
+        self.assertEqual(self.app.worker_pool.submitted, 0)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_indexed_lookup_is_processed_without_worker(self):
+        self.find_in_index.return_value = [ARTIFACT]
+
+        message = self.receive()
+
+        self.assertEqual(message.state, 'ack')
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.app.worker_pool.submitted, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
+import asyncio
+import datetime
+import threading
+import time
 import unittest
 from unittest.mock import patch
 
 from eiffelactory import artifactory
 from eiffelactory import config
+from eiffelactory import index
 
 artifact_filename = 'artifact.txt'
 build_path_substring = 'job/TEST/job/BUILD_NAME/255'
@@ -28,12 +33,24 @@ response_dict_binary = str.encode(response_dict)
 empty_response_dict = str.encode(empty_dict)
 
 
-def mocked_requests_post(search_url, auth, data):
-    class MockedPostResponse:
-        def __init__(self, status_code, content):
-            self.content = content
-            self.status_code = status_code
+class MockedPostResponse:
+    def __init__(self, status_code, content, reason='OK'):
+        self.content = content
+        self.status_code = status_code
+        self.reason = reason
+        self.closed = False
 
+    def iter_content(self, chunk_size):
+        # small chunks, so results are split between chunks
+        for i in range(0, len(self.content), 7):
+            yield self.content[i:i + 7]
+
+    def close(self):
+        self.closed = True
+
+
+def mocked_requests_post(search_url, data, timeout, stream=False):
+    data = data.replace('.limit(2)', '')
     if data == query_string:
         return MockedPostResponse(status_code=200,
                                   content=response_dict_binary)
@@ -43,7 +60,8 @@ def mocked_requests_post(search_url, auth, data):
         return MockedPostResponse(status_code=200, content=empty_response_dict)
     elif data == bad_query_string:
         return MockedPostResponse(status_code=400,
-                                  content=b'Failed to parse query')
+                                  content=b'Failed to parse query',
+                                  reason='Bad Request')
 
 
 class MockedConfig:
@@ -63,19 +81,21 @@ class TestArtifactory(unittest.TestCase):
             artifact_filename, build_path_substring),
             query_string)
 
-    @patch('eiffelactory.artifactory.requests.post',
+    @patch('eiffelactory.artifactory.requests.Session.post',
            side_effect=mocked_requests_post)
     def test__execute_aql_query(self, mocked_requests_post):
         response_content = self.artifactory._execute_aql_query(query_string)
-        self.assertEqual(response_content, response_dict)
+        self.assertEqual(response_content,
+                         [{"path": "eiffelactory", "repo": "repo",
+                           "name": "artifact.txt"}])
 
         response_content = self.artifactory._execute_aql_query(wrong_query_string)
-        self.assertEqual(response_content, empty_dict)
+        self.assertEqual(response_content, [])
 
         response_content = self.artifactory._execute_aql_query(bad_query_string)
         self.assertEqual(response_content, None)
 
-    @patch('eiffelactory.artifactory.requests.post',
+    @patch('eiffelactory.artifactory.requests.Session.post',
            side_effect=mocked_requests_post)
     def test_find_artifact_on_artifactory(self, mocked_requests_post):
         result = self.artifactory.\
@@ -90,11 +110,394 @@ class TestArtifactory(unittest.TestCase):
                                          build_path_substring)
         self.assertEqual(result, [])
 
+    def test_session_is_reused_with_configured_pool(self):
+        session = self.artifactory.session
+        adapter = session.get_adapter(self.artifactory.artifactory_search_url)
+
+        self.assertIs(session, self.artifactory.session)
+        self.assertEqual(session.auth, ('artifactory_username',
+                                        'artifactory_password'))
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertEqual(self.artifactory.timeout, (5.0, 30.0))
+
+    def test_pool_stats_without_requests(self):
+        self.assertEqual(self.artifactory.pool_stats(),
+                         {'requests': 0,
+                          'new_connections': 0,
+                          'reused_connections': 0})
+
+    def test__format_batched_aql_query(self):
+        query = self.artifactory._format_batched_aql_query(
+            [('a.txt', 'job/A/1'), ('b.txt', 'job/B/2')])
+
+        self.assertEqual(
+            query,
+            'items.find({"$or":['
+            '{"artifact.name":"a.txt",'
+            '"artifact.module.build.url":{"$match":"*job/A/1*"}},'
+            '{"artifact.name":"b.txt",'
+            '"artifact.module.build.url":{"$match":"*job/B/2*"}}]})'
+            '.include("name","repo","path")')
+
+    def test__split_aql_query_rejects_unknown_format(self):
+        self.assertIsNone(self.artifactory._split_aql_query('not aql'))
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_find_artifacts_on_artifactory(self, mocked_post):
+        mocked_post.return_value = MockedPostResponse(
+            200,
+            b'{"results":[{"path":"p","repo":"r","name":"a.txt"},'
+            b'{"path":"p","repo":"r","name":"a.txt"},'
+            b'{"path":"p","repo":"r","name":"a.txt"}]}')
+
+        results = self.artifactory.find_artifacts_on_artifactory(
+            [('a.txt', 'job/A/1'), ('b.txt', 'job/B/2')])
+
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(len(results[('a.txt', 'job/A/1')]), 2)
+        self.assertEqual(results[('b.txt', 'job/B/2')], [])
+
+    @patch('eiffelactory.artifactory.requests.Session.post',
+           side_effect=mocked_requests_post)
+    def test_find_artifact_on_artifactory_uses_cache(self, mocked_post):
+        for _ in range(2):
+            result = self.artifactory.\
+                find_artifact_on_artifactory(artifact_filename,
+                                             build_path_substring)
+            self.assertEqual(len(result), 1)
+        self.assertEqual(mocked_post.call_count, 1)
+
+        self.artifactory.find_artifact_on_artifactory(
+            artifact_filename, build_path_substring, use_cache=False)
+        self.assertEqual(mocked_post.call_count, 2)
+        self.assertEqual(self.artifactory.cache.hits, 1)
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_failed_queries_are_not_cached(self, mocked_post):
+        mocked_post.return_value = MockedPostResponse(
+            500, b'Internal Server Error', reason='Internal Server Error')
+        for _ in range(2):
+            with self.assertRaises(artifactory.ArtifactoryUnavailableError):
+                self.artifactory.find_artifact_on_artifactory(
+                    artifact_filename, build_path_substring)
+        self.assertEqual(mocked_post.call_count, 2)
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_circuit_breaker_opens_after_failures(self, mocked_post):
+        mocked_post.side_effect = ConnectionError('connection refused')
+        threshold = self.artifactory.circuit_breaker.failure_threshold
+        for _ in range(threshold):
+            with self.assertRaises(artifactory.ArtifactoryUnavailableError):
+                self.artifactory.find_artifact_on_artifactory(
+                    artifact_filename, build_path_substring)
+
+        with self.assertRaises(artifactory.CircuitOpenError):
+            self.artifactory.find_artifact_on_artifactory(
+                artifact_filename, build_path_substring)
+        self.assertEqual(mocked_post.call_count, threshold)
+        self.assertEqual(self.artifactory.flow_stats()['breaker_state'],
+                         'open')
+        self.assertEqual(self.artifactory.flow_stats()['in_flight'], 0)
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_single_lookup_is_limited_and_stops_early(self, mocked_post):
+        response = MockedPostResponse(
+            200,
+            b'{"results":[' + b','.join(
+                [b'{"path":"p","repo":"r%d","name":"a.txt"}' % i
+                 for i in range(100)]) + b']}')
+        mocked_post.return_value = response
+
+        results = self.artifactory.find_artifact_on_artifactory(
+            artifact_filename, build_path_substring)
+
+        self.assertEqual(len(results), 2)
+        self.assertTrue(mocked_post.call_args[1]['data'].endswith(
+            '.limit(2)'))
+        self.assertTrue(mocked_post.call_args[1]['stream'])
+        self.assertTrue(response.closed)
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_lookups_are_answered_from_index(self, mocked_post):
+        mocked_post.return_value = MockedPostResponse(
+            200,
+            b'{"results":[{"repo":"repo","path":"p","name":"artifact.txt",'
+            b'"modified":"2019-07-25T10:20:30.123+02:00","artifacts":['
+            b'{"modules":[{"builds":[{"build.url":'
+            b'"https://jenkins/job/TEST/job/BUILD_NAME/255/"}]}]}]}]}')
+        self._create_index()
+
+        self.artifactory.sync_index()
+        self.assertIn('"$gte"', mocked_post.call_args[1]['data'])
+
+        results = self.artifactory.find_artifact_on_artifactory(
+            artifact_filename, build_path_substring, use_cache=False)
+        self.assertEqual(results, [{'repo': 'repo', 'path': 'p',
+                                    'name': 'artifact.txt'}])
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(self.artifactory.index_hits, 1)
+
+    def _create_index(self):
+        self.artifactory.index = index.create_index('memory', None)
+        self.artifactory.index_hits = 0
+        self.artifactory.index_history = datetime.timedelta(days=36500)
+        self.artifactory.index_poll_interval = 30
+        self.artifactory.index_synced_at = None
+
+    @patch('eiffelactory.artifactory.time.monotonic')
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_outdated_index_isnt_used(self, mocked_post, mocked_monotonic):
+        mocked_monotonic.return_value = 100.0
+        self._create_index()
+        self.artifactory.index.add(index.items_from_aql_result(
+            {'repo': 'repo', 'path': 'p', 'name': 'artifact.txt',
+             'modified': '2019-07-25T10:20:30.123+02:00',
+             'artifacts': [{'build.url': 'https://jenkins/job/TEST/job/'
+                                         'BUILD_NAME/255/'}]}))
+        self.assertIsNone(self.artifactory._find_in_index(
+            (artifact_filename, build_path_substring)))
+
+        self.artifactory.index_synced_at = 100.0
+        self.assertIsNotNone(self.artifactory._find_in_index(
+            (artifact_filename, build_path_substring)))
+
+        mocked_monotonic.return_value = 161.0
+        self.assertIsNone(self.artifactory._find_in_index(
+            (artifact_filename, build_path_substring)))
+
+    def test_index_is_synced_in_background_until_closed(self):
+        self._create_index()
+        self.artifactory._index_thread = None
+        self.artifactory._index_stopped = threading.Event()
+        synced = threading.Event()
+
+        with patch.object(self.artifactory, 'sync_index',
+                          side_effect=synced.set):
+            self.artifactory.start_index_sync()
+            self.assertTrue(synced.wait(5))
+            self.artifactory.close()
+
+        self.assertFalse(self.artifactory._index_thread.is_alive())
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_index_sync_fetches_recent_items_again(self, mocked_post):
+        mocked_post.return_value = MockedPostResponse(200, b'{"results":[]}')
+        self._create_index()
+        self.artifactory.index.add(index.items_from_aql_result(
+            {'repo': 'repo', 'path': 'p', 'name': 'artifact.txt',
+             'modified': '2019-07-25T10:20:30.123+02:00', 'artifacts': []}))
+
+        self.artifactory.sync_index()
+
+        self.assertIn('"2019-07-25T08:10:30.123Z"',
+                      mocked_post.call_args[1]['data'])
+        self.assertIsNotNone(self.artifactory.index_synced_at)
+        self.assertEqual(self.artifactory.flow_stats()['in_flight'], 0)
+
+    def test__format_exact_aql_query(self):
+        self.artifactory.exact_repo_template = '{first_directory}'
+        self.artifactory.exact_path_template = \
+            '{other_directories}/{build_path}'
+
+        self.assertEqual(
+            self.artifactory._format_exact_aql_query(
+                [('a.txt', 'job/A/1/', 'libs-release/com/example')]),
+            'items.find({"repo":"libs-release",'
+            '"path":"com/example/job/A/1","name":"a.txt"})'
+            '.include("name","repo","path")')
+        self.assertEqual(
+            self.artifactory._format_exact_aql_query(
+                [('a.txt', 'job/A/1', 'repo'), ('b.txt', 'job/B/1', 'repo')]),
+            'items.find({"$or":['
+            '{"repo":"repo","path":"job/A/1","name":"a.txt"},'
+            '{"repo":"repo","path":"job/B/1","name":"b.txt"}]})'
+            '.include("name","repo","path")')
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_exact_resolution_falls_back_to_wildcard(self, mocked_post):
+        found = MockedPostResponse(200, response_dict_binary)
+        mocked_post.side_effect = [MockedPostResponse(200, empty_response_dict),
+                                   found]
+        self.artifactory.exact_resolution = True
+
+        results = self.artifactory.find_artifact_on_artifactory(
+            artifact_filename, build_path_substring, 'repo/path')
+
+        self.assertEqual(len(results), 1)
+        queries = [call[1]['data'] for call in mocked_post.call_args_list]
+        self.assertTrue(queries[0].startswith(
+            'items.find({"repo":"repo","path":"path"'))
+        self.assertIn('$match', queries[1])
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_exact_resolution_skips_wildcard_when_found(self, mocked_post):
+        mocked_post.return_value = MockedPostResponse(200,
+                                                      response_dict_binary)
+        self.artifactory.exact_resolution = True
+
+        results = self.artifactory.find_artifacts_on_artifactory(
+            [(artifact_filename, build_path_substring, 'repo/path'),
+             ('b.txt', build_path_substring, 'repo/path')])
+
+        self.assertEqual(mocked_post.call_count, 2)
+        self.assertEqual(
+            len(results[(artifact_filename, build_path_substring,
+                         'repo/path')]), 1)
+        self.assertNotIn('$match', mocked_post.call_args_list[0][1]['data'])
+        self.assertIn('$match', mocked_post.call_args_list[1][1]['data'])
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_exact_resolution_caches_per_directories(self, mocked_post):
+        mocked_post.return_value = MockedPostResponse(200,
+                                                      response_dict_binary)
+        self.artifactory.exact_resolution = True
+
+        for directories in ('repo/path', 'repo/other', 'repo/path'):
+            self.artifactory.find_artifact_on_artifactory(
+                artifact_filename, build_path_substring, directories)
+
+        self.assertEqual(mocked_post.call_count, 2)
+        self.assertEqual(self.artifactory.cache.hits, 1)
+
+    def test__add_result_limit_keeps_configured_limit(self):
+        self.assertEqual(
+            self.artifactory._add_result_limit('items.find().limit(10)', 2),
+            'items.find().limit(10)')
+
     def tearDown(self):
         self.artifactory = None
 
 
-if __name__ == '__main__':
-    unittest.main()
+class TestIterAqlResults(unittest.TestCase):
+
+    def test_parses_results_split_across_chunks(self):
+        chunks = [b'{\n"results" : [ {\n  "repo" : "re', b'po", "name" :',
+                  b' "a.txt"\n}, {"repo":"r2","name":"\xc3',
+                  b'\xa5.txt"} ],\n"range" : {"total" : 2}}']
+
+        results = list(artifactory.iter_aql_results(chunks))
+
+        self.assertEqual(results, [{'repo': 'repo', 'name': 'a.txt'},
+                                   {'repo': 'r2', 'name': '\u00e5.txt'}])
+
+    def test_stops_reading_when_consumer_stops(self):
+        chunks = iter([b'{"results":[{"name":"a"},', b'{"name":"b"},',
+                       b'{"name":"c"}]}'])
+
+        results = artifactory.iter_aql_results(chunks)
+        self.assertEqual(next(results), {'name': 'a'})
+
+        self.assertEqual(next(chunks), b'{"name":"b"},')
+
+    def test_truncated_response_raises(self):
+        with self.assertRaises(ValueError):
+            list(artifactory.iter_aql_results([b'{"results":[{"name":']))
+
+
+class SlowArtifactoryConnection:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def find_artifact_on_artifactory(self, artifact_filename,
+                                     build_path_substring, directories=None,
+                                     use_cache=True):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return [{'name': artifact_filename}]
+
+
+class TestAsyncArtifactory(unittest.TestCase):
+
+    def test_lookups_run_concurrently_up_to_the_limit(self):
+        connection = SlowArtifactoryConnection()
+        async_connection = artifactory.AsyncArtifactoryConnection(connection,
+                                                                  3)
+
+        async def find_all():
+            return await asyncio.gather(*[
+                async_connection.find_artifact_on_artifactory(
+                    'file{}.txt'.format(i), build_path_substring)
+                for i in range(6)])
+
+        results = asyncio.run(find_all())
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[5], [{'name': 'file5.txt'}])
+        self.assertEqual(connection.max_running, 3)
+        self.assertEqual(async_connection.in_flight, 0)
+
 
+class TestArtifactoryCluster(unittest.TestCase):
 
+    def setUp(self):
+        cfg = config.Config('tests/all_options.config')
+        cfg._config.set('artifactory', 'urls',
+                        'https://node1/artifactory,https://node2/artifactory')
+        cfg._config.set('artifactory', 'hedging', 'true')
+        self.artifactory = artifactory.ArtifactoryConnection(cfg.artifactory)
+        self.node1_url = 'https://node1/artifactory/api/search/aql/'
+
+    def tearDown(self):
+        self.artifactory.hedge_executor.shutdown()
+
+    def _warm_up_latencies(self, latency):
+        for _ in range(20):
+            endpoint = self.artifactory.endpoints.acquire()
+            self.artifactory.endpoints.release(endpoint, latency)
+
+    @patch('eiffelactory.artifactory.requests.Session.post',
+           side_effect=mocked_requests_post)
+    def test_queries_are_spread_over_nodes(self, mocked_post):
+        for _ in range(4):
+            self.artifactory._execute_aql_query(query_string)
+
+        urls = [call[0][0] for call in mocked_post.call_args_list]
+        self.assertEqual(urls.count(self.node1_url), 2)
+        self.assertEqual(self.artifactory.hedged_queries, 0)
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_slow_node_is_hedged(self, mocked_post):
+        slow_response = MockedPostResponse(200, empty_response_dict)
+
+        def post(search_url, data, timeout, stream=False):
+            if search_url == self.node1_url:
+                time.sleep(0.2)
+                return slow_response
+            return MockedPostResponse(200, response_dict_binary)
+
+        mocked_post.side_effect = post
+        self._warm_up_latencies(0.01)
+
+        results = self.artifactory._execute_aql_query(query_string)
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(self.artifactory.hedged_queries, 1)
+        self.artifactory.hedge_executor.shutdown(wait=True)
+        self.assertTrue(slow_response.closed)
+
+    @patch('eiffelactory.artifactory.requests.Session.post')
+    def test_hedge_is_used_when_first_node_fails(self, mocked_post):
+        def post(search_url, data, timeout, stream=False):
+            if search_url == self.node1_url:
+                time.sleep(0.1)
+                return MockedPostResponse(503, b'', reason='Unavailable')
+            time.sleep(0.2)
+            return MockedPostResponse(200, response_dict_binary)
+
+        mocked_post.side_effect = post
+        self._warm_up_latencies(0.01)
+
+        results = self.artifactory._execute_aql_query(query_string)
+
+        self.assertEqual(len(results), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
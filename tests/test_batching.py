@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+
+from eiffelactory import batching
+
+
+class TestLookupBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.results = []
+        self.failures = []
+        self.failing = False
+        self.batcher = batching.LookupBatcher(self.lookup_many,
+                                              self.on_result,
+                                              self.on_failure,
+                                              batch_size=3,
+                                              batch_window=0.5)
+
+    def lookup_many(self, lookups):
+        self.batches.append(lookups)
+        if self.failing:
+            return None
+        return {lookup: [{'name': lookup[0]}] for lookup in lookups}
+
+    def on_result(self, artc_meta_id, lookup, results, message):
+        self.results.append((artc_meta_id, results))
+
+    def on_failure(self, artc_meta_id, lookup, message):
+        self.failures.append((artc_meta_id, message))
+
+    def test_flushes_when_batch_is_full(self):
+        self.batcher.add('id1', ('a.txt', 'job/A/1'))
+        self.batcher.add('id2', ('b.txt', 'job/B/1'))
+        self.assertEqual(self.batches, [])
+
+        self.batcher.add('id3', ('c.txt', 'job/C/1'))
+
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(len(self.batches[0]), 3)
+        self.assertEqual([result[0] for result in self.results],
+                         ['id1', 'id2', 'id3'])
+        self.assertEqual(len(self.batcher), 0)
+
+    def test_identical_lookups_share_a_query(self):
+        self.batcher.add('id1', ('a.txt', 'job/A/1'))
+        self.batcher.add('id2', ('a.txt', 'job/A/1'))
+        self.batcher.flush()
+
+        self.assertEqual(self.batches, [[('a.txt', 'job/A/1')]])
+        self.assertEqual(self.results, [('id1', [{'name': 'a.txt'}]),
+                                        ('id2', [{'name': 'a.txt'}])])
+
+    def test_same_filename_is_split_into_separate_batches(self):
+        self.batcher.add('id1', ('a.txt', 'job/A/1'))
+        self.batcher.add('id2', ('a.txt', 'job/A/2'))
+        self.batcher.flush()
+
+        self.assertEqual(self.batches, [[('a.txt', 'job/A/1')],
+                                        [('a.txt', 'job/A/2')]])
+
+    def test_messages_are_handed_back(self):
+        self.failing = True
+        self.batcher.add('id1', ('a.txt', 'job/A/1'), 'message1')
+        self.batcher.add('id2', ('a.txt', 'job/A/1'), 'message2')
+        self.batcher.flush()
+
+        self.assertEqual(self.failures, [('id1', 'message1'),
+                                         ('id2', 'message2')])
+        self.assertEqual(self.results, [])
+
+    @patch('eiffelactory.batching.time.monotonic')
+    def test_flush_if_due_respects_window(self, mocked_monotonic):
+        mocked_monotonic.return_value = 100.0
+        self.batcher.add('id1', ('a.txt', 'job/A/1'))
+
+        mocked_monotonic.return_value = 100.4
+        self.batcher.flush_if_due()
+        self.assertEqual(self.batches, [])
+
+        mocked_monotonic.return_value = 100.5
+        self.batcher.flush_if_due()
+        self.assertEqual(len(self.batches), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
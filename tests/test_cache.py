@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+
+from eiffelactory import cache
+
+
+class TestLookupCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.LookupCache(max_size=2, hit_ttl=60, miss_ttl=5)
+
+    def test_get_returns_missing_for_unknown_key(self):
+        self.assertIs(self.cache.get(('a.txt', 'job/A/1')), cache.MISSING)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_caches_hits_and_misses(self):
+        self.cache.put(('a.txt', 'job/A/1'), [{'name': 'a.txt'}])
+        self.cache.put(('b.txt', 'job/B/1'), [])
+
+        self.assertEqual(self.cache.get(('a.txt', 'job/A/1')),
+                         [{'name': 'a.txt'}])
+        self.assertEqual(self.cache.get(('b.txt', 'job/B/1')), [])
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', [1])
+        self.cache.put('b', [2])
+        self.cache.get('a')
+        self.cache.put('c', [3])
+
+        self.assertIs(self.cache.get('b'), cache.MISSING)
+        self.assertEqual(self.cache.get('a'), [1])
+        self.assertEqual(self.cache.evictions, 1)
+
+    @patch('eiffelactory.cache.time.monotonic')
+    def test_misses_expire_before_hits(self, mocked_monotonic):
+        mocked_monotonic.return_value = 100.0
+        self.cache.put('hit', [1])
+        self.cache.put('miss', [])
+
+        mocked_monotonic.return_value = 105.0
+        self.assertIs(self.cache.get('miss'), cache.MISSING)
+        self.assertEqual(self.cache.get('hit'), [1])
+        self.assertEqual(self.cache.expirations, 1)
+
+    def test_zero_ttl_is_not_cached(self):
+        no_miss_cache = cache.LookupCache(max_size=2, hit_ttl=60, miss_ttl=0)
+        no_miss_cache.put('miss', [])
+
+        self.assertEqual(len(no_miss_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
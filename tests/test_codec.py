@@ -0,0 +1,32 @@
+import unittest
+
+from eiffelactory import codec
+from eiffelactory import eiffel
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_dumps_is_compact_bytes(self):
+        self.assertEqual(codec.dumps({'a': [1, None], 'b': 'c'}),
+                         b'{"a":[1,null],"b":"c"}')
+
+    def test_dumps_keeps_key_order(self):
+        self.assertEqual(codec.dumps({'b': 1, 'a': 2}), b'{"b":1,"a":2}')
+
+    def test_dumps_encodes_non_ascii_as_utf8(self):
+        self.assertEqual(codec.dumps('sändare'),
+                         '"sändare"'.encode('utf-8'))
+
+    def test_loads_bytes_and_str(self):
+        self.assertEqual(codec.loads(b'{"a":1}'), {'a': 1})
+        self.assertEqual(codec.loads('{"a":1}'), {'a': 1})
+
+    def test_round_trips_eiffel_event(self):
+        event = eiffel.create_artifact_published_event(
+            'artc-id', [eiffel.Location('https://host/repo/path/a.txt')])
+
+        self.assertEqual(codec.loads(codec.dumps(event)), event)
+
+
+if __name__ == '__main__':
+    unittest.main()
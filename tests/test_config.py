@@ -1,4 +1,6 @@
+import os
 import unittest
+
 from eiffelactory import config
 
 
@@ -30,6 +32,34 @@ class TestConfig(unittest.TestCase):
         self.assertIs(cfg.eiffelactory.event_sources, defaults['event_sources'])
         self.assertIs(cfg.artifactory.aql_search_string,
                       defaults['aql_search_string'])
+        self.assertEqual(cfg.artifactory.pool_size,
+                         int(defaults['pool_size']))
+        self.assertEqual(cfg.artifactory.connect_timeout,
+                         float(defaults['connect_timeout']))
+        self.assertEqual(cfg.artifactory.read_timeout,
+                         float(defaults['read_timeout']))
+        self.assertEqual(cfg.artifactory.max_retries,
+                         int(defaults['max_retries']))
+        self.assertEqual(cfg.eiffelactory.processes, os.cpu_count() or 1)
+
+    def test_urls_default_to_url(self):
+        self.assertEqual(self.config.artifactory.urls,
+                         ['https://localhost:8081/artifactory'])
+
+    def test_option_urls_should_be_parsed_to_list(self):
+        self.config._config.set('artifactory', 'urls',
+                                'https://node1/artifactory, '
+                                'https://node2/artifactory')
+
+        self.assertEqual(self.config.artifactory.urls,
+                         ['https://node1/artifactory',
+                          'https://node2/artifactory'])
+
+    def test_retry_queues_default_to_queue_name(self):
+        self.assertEqual(self.config.rabbitmq.parking_queue,
+                         'rmq_queue.parking')
+        self.assertEqual(self.config.rabbitmq.dead_letter_queue,
+                         'rmq_queue.dead-letter')
 
     def test_missing_sections_are_added(self):
         cfg = self.no_default_options
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch
+
+from eiffelactory import dedup
+
+
+@patch('eiffelactory.dedup.time.monotonic', return_value=0.0)
+class TestDuplicateFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = dedup.DuplicateFilter(max_size=2, window=60.0)
+
+    def test_second_check_is_duplicate(self, mocked_monotonic):
+        self.assertFalse(self.filter.check('id1'))
+        self.assertTrue(self.filter.check('id1'))
+        self.assertFalse(self.filter.check('id2'))
+
+        self.assertEqual(self.filter.stats(),
+                         {'size': 2, 'duplicates': 1, 'evictions': 0})
+
+    def test_ids_are_forgotten_after_window(self, mocked_monotonic):
+        self.filter.check('id1')
+
+        mocked_monotonic.return_value = 60.0
+        self.assertFalse(self.filter.check('id1'))
+
+        mocked_monotonic.return_value = 90.0
+        self.filter.check('id2')
+        mocked_monotonic.return_value = 125.0
+        self.filter.check('id3')
+        self.assertEqual(len(self.filter), 2)
+        self.assertEqual(self.filter.evictions, 0)
+
+    def test_oldest_id_is_evicted_when_full(self, mocked_monotonic):
+        for event_id in ('id1', 'id2', 'id3'):
+            self.filter.check(event_id)
+
+        self.assertEqual(len(self.filter), 2)
+        self.assertEqual(self.filter.evictions, 1)
+        self.assertFalse(self.filter.check('id1'))
+        self.assertTrue(self.filter.check('id3'))
+
+    def test_forgotten_id_is_not_duplicate(self, mocked_monotonic):
+        self.filter.check('id1')
+        self.filter.forget('id1')
+        self.filter.forget('unknown')
+
+        self.assertFalse(self.filter.check('id1'))
+        self.assertEqual(self.filter.duplicates, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
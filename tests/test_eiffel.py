@@ -1,6 +1,10 @@
+import json
 import unittest
+import uuid
 
+from eiffelactory import codec
 from eiffelactory import eiffel
+from eiffelactory import utils
 
 
 class TestEiffel(unittest.TestCase):
@@ -24,6 +28,72 @@ class TestEiffel(unittest.TestCase):
                          'https://some.location/some-repo/'
                          'some-path/artifact.txt')
 
+    def test_artifact_published_event_to_json(self):
+        event = eiffel.create_artifact_published_event(
+            'artc-id', [eiffel.Location('https://host/repo/path/a.txt')])
+        event.meta.event_id = 'artp-id'
+        event.meta.time = 1563540212984
+
+        self.assertEqual(
+            event.to_json(),
+            b'{"data":{"locations":[{"type":"ARTIFACTORY",'
+            b'"uri":"https://host/repo/path/a.txt"}]},'
+            b'"links":[{"type":"ARTIFACT","target":"artc-id"}],'
+            b'"meta":{"id":"artp-id","type":"EiffelArtifactPublishedEvent",'
+            b'"version":"3.0.0","time":1563540212984,'
+            b'"source":{"name":"EIFFELACTORY"}}}')
+
+    def test_artifact_published_event_with_json_dumps(self):
+        event = eiffel.create_artifact_published_event(
+            'artc-id', [eiffel.Location('https://host/repo/path/a.txt')])
+
+        dumped = json.dumps(utils.remove_none_from_dict(event),
+                            separators=(',', ':'))
+
+        self.assertEqual(dumped.encode(), event.to_json())
+
+    def test_template_renders_same_bytes_as_models(self):
+        locations = [eiffel.Location('https://host/repo/path/ä "b".txt'),
+                     eiffel.Location('https://mirror/a.txt', 'OTHER')]
+        event = eiffel.create_artifact_published_event('artc-id', locations)
+
+        rendered = eiffel.ArtifactPublishedTemplate().render(
+            'artc-id', locations, event['meta']['id'], event['meta']['time'])
+
+        self.assertEqual(rendered, event.to_json())
+
+    def test_render_generates_id_and_time(self):
+        event = codec.loads(eiffel.render_artifact_published_event(
+            'artc-id', [eiffel.Location('https://host/a.txt')]))
+
+        self.assertEqual(uuid.UUID(event['meta']['id']).version, 4)
+        self.assertIsInstance(event['meta']['time'], int)
+
+    def test_uuid_generator_generates_version_4_uuids(self):
+        generator = eiffel.UuidGenerator(batch_size=4)
+
+        ids = [generator() for _ in range(10)]
+
+        self.assertEqual(len(set(ids)), 10)
+        for event_id in ids:
+            parsed = uuid.UUID(event_id)
+            self.assertEqual(str(parsed), event_id)
+            self.assertEqual(parsed.version, 4)
+            self.assertEqual(parsed.variant, uuid.RFC_4122)
+
+    def test_models_read_like_dicts_without_none_fields(self):
+        meta = eiffel.Meta(eiffel.EIFFEL_ARTIFACT_CREATED_EVENT,
+                           eiffel.VERSION_3_0_0, event_id='id', time=1)
+
+        self.assertEqual(meta, {'id': 'id',
+                                'type': 'EiffelArtifactCreatedEvent',
+                                'version': '3.0.0',
+                                'time': 1})
+        self.assertNotIn('source', meta)
+        self.assertIsNone(meta.get('source'))
+        with self.assertRaises(KeyError):
+            meta['tags']
+
     def test_is_eiffel_event_type(self):
         event = {'links': [],
                  'meta': {
@@ -86,6 +156,54 @@ class TestEiffel(unittest.TestCase):
         self.assertFalse(eiffel.is_sent_from_sources(
             event4, ['JENKINS_EIFFEL_BROADCASTER']))
 
+    def test_event_validator_accepts_valid_artc(self):
+        validate = eiffel.create_event_validator(
+            eiffel.ARTIFACT_CREATED_FIELDS)
+        event = {'meta': {'id': 'artc-id',
+                          'source': {'name': 'JENKINS'}},
+                 'data': {'identity': 'pkg:a/b.zip@1'}}
+
+        self.assertIsNone(validate(event))
+        del event['meta']['source']
+        self.assertIsNone(validate(event))
+
+    def test_event_validator_reports_reason(self):
+        validate = eiffel.create_event_validator(
+            eiffel.ARTIFACT_CREATED_FIELDS)
+
+        self.assertEqual(validate([]), 'event is not an object')
+        self.assertEqual(validate({'data': {'identity': 'pkg:a'}}),
+                         'missing meta.id')
+        self.assertEqual(validate({'meta': {'id': 'x'}, 'data': 'pkg:a'}),
+                         'missing data.identity')
+        self.assertEqual(validate({'meta': {'id': 'x'},
+                                   'data': {'identity': 1}}),
+                         'data.identity is not str')
+        self.assertEqual(validate({'meta': {'id': 'x', 'source': 'JENKINS'},
+                                   'data': {'identity': 'pkg:a'}}),
+                         'meta.source is not dict')
+
+    def test_raw_event_filter_checks_type(self):
+        raw_filter = eiffel.create_raw_event_filter(
+            'EiffelArtifactCreatedEvent')
+
+        self.assertTrue(raw_filter(
+            b'{"meta": {"type": "EiffelArtifactCreatedEvent"}}'))
+        self.assertFalse(raw_filter(
+            b'{"meta": {"type": "EiffelActivityStartedEvent"}}'))
+        self.assertFalse(raw_filter(
+            b'{"meta": {"type": "EiffelArtifactCreatedEventV2"}}'))
+
+    def test_raw_event_filter_checks_sources(self):
+        raw_filter = eiffel.create_raw_event_filter(
+            'EiffelArtifactCreatedEvent', ['JENKINS', 'S\u00e4ndare'])
+        event = '{"meta":{"type":"EiffelArtifactCreatedEvent",' \
+                '"source":{"name":"%s"}}}'
+
+        self.assertTrue(raw_filter((event % 'JENKINS').encode()))
+        self.assertTrue(raw_filter((event % 'S\u00e4ndare').encode()))
+        self.assertFalse(raw_filter((event % 'JENKINS_2').encode()))
+
 
 if __name__ == '__main__':
     unittest.main()
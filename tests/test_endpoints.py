@@ -0,0 +1,70 @@
+import unittest
+from unittest.mock import patch
+
+from eiffelactory import endpoints
+
+URLS = ['https://node1/artifactory', 'https://node2/artifactory/']
+
+
+@patch('eiffelactory.endpoints.time.monotonic', return_value=0.0)
+class TestEndpointPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = endpoints.EndpointPool(URLS, eject_failures=2,
+                                           eject_duration=30.0)
+        self.node1, self.node2 = self.pool.endpoints
+
+    def test_search_url_is_built_from_base_url(self, mocked_monotonic):
+        self.assertEqual(self.node2.search_url,
+                         'https://node2/artifactory/api/search/aql/')
+
+    def test_picks_least_outstanding_node(self, mocked_monotonic):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+
+        self.pool.release(second, 0.1)
+        self.assertIs(self.pool.acquire(), second)
+
+    def test_idle_nodes_are_used_round_robin(self, mocked_monotonic):
+        picked = []
+        for _ in range(4):
+            endpoint = self.pool.acquire()
+            self.pool.release(endpoint, 0.1)
+            picked.append(endpoint)
+
+        self.assertEqual(picked, [self.node1, self.node2] * 2)
+
+    def test_failing_node_is_ejected(self, mocked_monotonic):
+        for _ in range(2):
+            self.pool.acquire(exclude=self.node2)
+            self.pool.release(self.node1, 0.1, success=False)
+
+        self.assertTrue(self.pool.stats()[self.node1.url]['ejected'])
+        for _ in range(3):
+            self.assertIs(self.pool.acquire(), self.node2)
+        self.assertIsNone(self.pool.acquire(exclude=self.node2))
+
+        mocked_monotonic.return_value = 30.0
+        self.assertIs(self.pool.acquire(), self.node1)
+
+    def test_ejected_node_is_used_if_all_are_ejected(self, mocked_monotonic):
+        for endpoint in (self.node2, self.node1):
+            for _ in range(2):
+                self.pool.release(endpoint, 0.1, success=False)
+            mocked_monotonic.return_value += 1
+
+        self.assertIs(self.pool.acquire(), self.node2)
+
+    def test_hedge_delay_is_latency_percentile(self, mocked_monotonic):
+        self.assertIsNone(self.pool.hedge_delay())
+
+        for latency in range(1, 101):
+            endpoint = self.pool.acquire()
+            self.pool.release(endpoint, latency / 100)
+
+        self.assertEqual(self.pool.hedge_delay(), 0.96)
+
+
+if __name__ == '__main__':
+    unittest.main()
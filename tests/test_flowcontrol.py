@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import patch
+
+from eiffelactory import flowcontrol
+
+
+class TestAimdLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = flowcontrol.AimdLimiter(initial_limit=4,
+                                               min_limit=1,
+                                               max_limit=8,
+                                               target_latency=1.0)
+
+    def test_limit_increases_additively(self):
+        for _ in range(4):
+            self.limiter.acquire()
+            self.limiter.release(0.1)
+
+        self.assertEqual(self.limiter.current_limit, 4)
+        self.assertGreater(self.limiter.limit, 4.9)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_limit_decreases_multiplicatively(self):
+        self.limiter.acquire()
+        self.limiter.release(2.0)
+        self.assertEqual(self.limiter.current_limit, 2)
+
+        self.limiter.acquire()
+        self.limiter.release(0.1, success=False)
+        self.limiter.acquire()
+        self.limiter.release(0.1, success=False)
+        self.assertEqual(self.limiter.current_limit, 1)
+
+    def test_limit_stays_within_bounds(self):
+        for _ in range(100):
+            self.limiter.acquire()
+            self.limiter.release(0.1)
+
+        self.assertEqual(self.limiter.current_limit, 8)
+
+
+@patch('eiffelactory.flowcontrol.time.monotonic')
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = flowcontrol.CircuitBreaker(failure_threshold=2,
+                                                  latency_threshold=5.0,
+                                                  reset_timeout=30.0)
+
+    def test_opens_after_consecutive_failures(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow_request())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, flowcontrol.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_slow_requests_count_as_failures(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.breaker.record_success(6.0)
+        self.breaker.record_success(6.0)
+
+        self.assertEqual(self.breaker.state, flowcontrol.OPEN)
+
+    def test_success_resets_failures(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.breaker.record_failure()
+        self.breaker.record_success(0.1)
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, flowcontrol.CLOSED)
+
+    def test_half_open_allows_single_trial(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        mocked_monotonic.return_value = 30.0
+        self.assertEqual(self.breaker.state, flowcontrol.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, flowcontrol.CLOSED)
+
+    def test_failed_trial_reopens(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        mocked_monotonic.return_value = 30.0
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, flowcontrol.OPEN)
+        self.assertEqual(self.breaker.times_opened, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import datetime
+import unittest
+
+from eiffelactory import index
+
+aql_result = {
+    'repo': 'repo',
+    'path': 'some/path',
+    'name': 'artifact.txt',
+    'modified': '2019-07-25T10:20:30.123+02:00',
+    'artifacts': [{'modules': [{'builds': [
+        {'build.url': 'https://jenkins/job/TEST/job/BUILD_NAME/255/'}]}]}]}
+
+
+class ArtifactIndexTests:
+
+    def create_index(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.index = self.create_index()
+        self.index.add(index.items_from_aql_result(aql_result))
+
+    def test_find_matches_name_and_build_path_substring(self):
+        self.assertEqual(
+            self.index.find('artifact.txt', 'job/TEST/job/BUILD_NAME/255', 2),
+            [{'repo': 'repo', 'path': 'some/path', 'name': 'artifact.txt'}])
+        self.assertEqual(
+            self.index.find('artifact.txt', 'job/TEST/job/BUILD_NAME/256', 2),
+            [])
+        self.assertEqual(
+            self.index.find('other.txt', 'job/TEST/job/BUILD_NAME/255', 2),
+            [])
+
+    def test_add_replaces_same_item(self):
+        self.index.add(index.items_from_aql_result(aql_result))
+
+        self.assertEqual(len(self.index), 1)
+
+    def test_prune_removes_old_items(self):
+        self.index.prune(index.parse_modified('2019-07-25T08:20:30.123Z'))
+        self.assertEqual(len(self.index), 1)
+
+        self.index.prune(index.parse_modified('2019-07-25T08:20:30.124Z'))
+        self.assertEqual(len(self.index), 0)
+
+    def test_unbuilt_item_makes_name_unanswerable(self):
+        unbuilt = dict(aql_result, path='other/path', artifacts=[])
+        self.index.add(index.items_from_aql_result(unbuilt))
+
+        self.assertIsNone(
+            self.index.find('artifact.txt', 'job/TEST/job/BUILD_NAME/255', 2))
+
+        self.index.add(index.items_from_aql_result(
+            dict(aql_result, path='other/path')))
+
+        self.assertEqual(
+            len(self.index.find('artifact.txt',
+                                'job/TEST/job/BUILD_NAME/255', 2)), 2)
+        self.assertEqual(len(self.index), 2)
+
+    def test_newest_modified(self):
+        self.assertEqual(index.format_modified(self.index.newest_modified()),
+                         '2019-07-25T08:20:30.123Z')
+
+    def tearDown(self):
+        self.index.close()
+
+
+class TestMemoryArtifactIndex(ArtifactIndexTests, unittest.TestCase):
+
+    def create_index(self):
+        return index.create_index('memory', None)
+
+
+class TestSqliteArtifactIndex(ArtifactIndexTests, unittest.TestCase):
+
+    def create_index(self):
+        return index.create_index('sqlite', ':memory:')
+
+
+class TestIndexHelpers(unittest.TestCase):
+
+    def test_items_from_aql_result_without_builds(self):
+        result = dict(aql_result, artifacts=[])
+
+        items = index.items_from_aql_result(result)
+
+        self.assertEqual([item.build_url for item in items],
+                         [index.NO_BUILD_URL])
+
+    def test_format_modified_uses_utc(self):
+        timestamp = datetime.datetime(2019, 7, 25, 10, 20, 30, 123000,
+                                      datetime.timezone.utc)
+
+        self.assertEqual(index.format_modified(timestamp),
+                         '2019-07-25T10:20:30.123Z')
+
+
+if __name__ == '__main__':
+    unittest.main()
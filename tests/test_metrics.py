@@ -0,0 +1,109 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from eiffelactory import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def test_counter_and_gauge(self):
+        counter = self.metrics.counter('events_total', 'Events')
+        self.metrics.gauge('in_flight', 'In flight', lambda: 3)
+
+        counter.inc()
+        counter.inc(2)
+
+        text = self.metrics.render()
+        self.assertIn('# TYPE events_total counter\nevents_total 3\n', text)
+        self.assertIn('# TYPE in_flight gauge\nin_flight 3\n', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.metrics.histogram('stage_seconds', 'Stages',
+                                           label='stage',
+                                           buckets=(0.1, 1.0))
+
+        histogram.labels('lookup').observe(0.05)
+        histogram.labels('lookup').observe(0.5)
+        histogram.labels('lookup').observe(5)
+
+        lines = self.metrics.render().splitlines()
+        self.assertIn('stage_seconds_bucket{stage="lookup",le="0.1"} 1',
+                      lines)
+        self.assertIn('stage_seconds_bucket{stage="lookup",le="1.0"} 2',
+                      lines)
+        self.assertIn('stage_seconds_bucket{stage="lookup",le="+Inf"} 3',
+                      lines)
+        self.assertIn('stage_seconds_sum{stage="lookup"} 5.55', lines)
+        self.assertIn('stage_seconds_count{stage="lookup"} 3', lines)
+
+    def test_timer_observes_block(self):
+        histogram = self.metrics.histogram('block_seconds', 'Block')
+
+        with histogram.time():
+            pass
+
+        self.assertIn('block_seconds_count 1', self.metrics.render())
+
+    def test_stats_are_exposed_as_gauges(self):
+        self.metrics.add_stats('cache', lambda: {'hits': 2, 'state': 'open'})
+        self.metrics.add_stats(
+            'node', lambda: {'https://a': {'requests': 1, 'ejected': True}},
+            label='url')
+
+        lines = self.metrics.render().splitlines()
+        self.assertIn('cache_hits 2', lines)
+        self.assertNotIn('cache_state', '\n'.join(lines))
+        self.assertIn('node_requests{url="https://a"} 1', lines)
+        self.assertIn('node_ejected{url="https://a"} 1', lines)
+
+    def test_disabled_metrics_are_no_ops(self):
+        disabled = metrics.Metrics(enabled=False)
+        counter = disabled.counter('events_total', 'Events')
+        histogram = disabled.histogram('stage_seconds', 'Stages',
+                                       label='stage')
+
+        counter.inc()
+        with histogram.labels('lookup').time():
+            pass
+        disabled.add_stats('cache', lambda: {'hits': 2})
+
+        self.assertIs(counter, metrics.NULL_INSTRUMENT)
+        self.assertEqual(disabled.render(), '\n')
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+        self.metrics.counter('events_total', 'Events').inc()
+        self.server = metrics.MetricsServer(self.metrics, '127.0.0.1', 0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_serves_metrics(self):
+        url = 'http://127.0.0.1:{}/metrics'.format(self.server.port)
+
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode('utf-8')
+            content_type = response.headers['Content-Type']
+
+        self.assertIn('events_total 1', body)
+        self.assertEqual(content_type, metrics.CONTENT_TYPE)
+
+    def test_other_paths_are_not_found(self):
+        url = 'http://127.0.0.1:{}/other'.format(self.server.port)
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url, timeout=5)
+        context.exception.close()
+        self.assertEqual(context.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
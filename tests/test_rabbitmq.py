@@ -1,6 +1,15 @@
+import asyncio
+import collections
+import socket
 import unittest
+from unittest.mock import MagicMock, patch
+
+from eiffelactory import config
+from eiffelactory import metrics
 from eiffelactory import rabbitmq
 
+ARTC = 'EiffelArtifactCreatedEvent'
+
 
 def on_event_received(event):
     print(str(event))
@@ -20,5 +29,508 @@ class TestRabbitMQ(unittest.TestCase):
         self.rabbitmq_connection = None
 
 
+class TestDeriveBindings(unittest.TestCase):
+
+    def setUp(self):
+        self.config = config.Config('tests/all_options.config')
+
+    def _set(self, option, value):
+        self.config._config.set('rabbitmq', option, value)
+
+    def test_routing_key_mode_uses_configured_routing_key(self):
+        self.assertEqual(
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC, ['A']),
+            [rabbitmq.Binding('rmq_exchange', 'rmq_routing_key', None)])
+
+    def test_derived_mode_without_source_field(self):
+        self._set('binding_mode', 'derived')
+
+        self.assertEqual(
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC, ['A', 'B']),
+            [rabbitmq.Binding('rmq_exchange',
+                              'eiffel.*.EiffelArtifactCreatedEvent.*.*',
+                              None)])
+
+    def test_derived_mode_binds_per_source(self):
+        self._set('binding_mode', 'derived')
+        self._set('binding_routing_key', '{source}.{event_type}')
+
+        bindings = rabbitmq.derive_bindings(self.config.rabbitmq, ARTC,
+                                            ['A', 'B', 'A'])
+
+        self.assertEqual([binding.routing_key for binding in bindings],
+                         ['A.EiffelArtifactCreatedEvent',
+                          'B.EiffelArtifactCreatedEvent'])
+        self.assertEqual(
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC)[0].routing_key,
+            '*.EiffelArtifactCreatedEvent')
+
+    def test_headers_mode(self):
+        self._set('binding_mode', 'headers')
+        self._set('headers_exchange', 'rmq_headers')
+
+        self.assertEqual(
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC, ['A']),
+            [rabbitmq.Binding('rmq_headers', '',
+                              {'x-match': 'all', 'eiffel-type': ARTC,
+                               'eiffel-source': 'A'})])
+        self.assertEqual(
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC)[0].arguments,
+            {'x-match': 'all', 'eiffel-type': ARTC})
+
+    def test_headers_mode_requires_headers_exchange(self):
+        self._set('binding_mode', 'headers')
+
+        with self.assertRaises(ValueError):
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC, ['A'])
+
+    def test_unknown_mode(self):
+        self._set('binding_mode', 'fanout')
+
+        with self.assertRaises(ValueError):
+            rabbitmq.derive_bindings(self.config.rabbitmq, ARTC)
+
+
+class TestBindQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = rabbitmq.RabbitMQConnection.__new__(
+            rabbitmq.RabbitMQConnection)
+        self.connection.app_logger = MagicMock()
+        self.connection.rabbitmq_config = \
+            config.Config('tests/all_options.config').rabbitmq
+        self.connection.queue = MagicMock()
+
+    def test_default_binding_is_kept(self):
+        default = rabbitmq.Binding('rmq_exchange', 'rmq_routing_key', None)
+
+        self.connection._bind_queue([default])
+
+        self.connection.queue.unbind_from.assert_not_called()
+        self.assertEqual(self.connection.queue.bind_to.call_count, 1)
+
+    def test_default_binding_is_removed(self):
+        bindings = [rabbitmq.Binding('rmq_exchange', 'a.b', None),
+                    rabbitmq.Binding('rmq_exchange', 'a.c', None)]
+
+        self.connection._bind_queue(bindings)
+
+        unbind_kwargs = self.connection.queue.unbind_from.call_args[1]
+        self.assertEqual(unbind_kwargs['routing_key'], 'rmq_routing_key')
+        self.assertEqual(
+            [call[1]['routing_key']
+             for call in self.connection.queue.bind_to.call_args_list],
+            ['a.b', 'a.c'])
+        self.assertEqual(self.connection.app_logger.info.call_count, 3)
+
+
+class TestRetryQueues(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = rabbitmq.RabbitMQConnection.__new__(
+            rabbitmq.RabbitMQConnection)
+        self.connection.rabbitmq_config = \
+            config.Config('tests/all_options.config').rabbitmq
+        self.connection.queue = MagicMock()
+        self.connection.republisher = MagicMock()
+        self.connection.republisher.publish.side_effect = \
+            lambda body, on_confirm, **options: on_confirm(self.confirmed)
+        self.confirmed = True
+        self.connection.parking_queues = {}
+        self.message = MagicMock(body=b'{}', headers={'eiffel-type': ARTC},
+                                 content_type='application/json',
+                                 content_encoding='utf-8')
+
+    @patch('eiffelactory.rabbitmq.Queue')
+    def test_parking_queue_dead_letters_to_queue(self, mocked_queue):
+        self.connection._declare_parking_queue(2.5)
+        self.connection._declare_dead_letter_queue()
+
+        parking_kwargs, dead_letter_kwargs = \
+            [call[1] for call in mocked_queue.call_args_list]
+        self.assertEqual(parking_kwargs['name'], 'rmq_queue.parking.2.5s')
+        self.assertEqual(parking_kwargs['queue_arguments'],
+                         {'x-dead-letter-exchange': '',
+                          'x-dead-letter-routing-key': 'rmq_queue',
+                          'x-message-ttl': 2500})
+        self.assertEqual(dead_letter_kwargs['name'], 'rmq_queue.dead-letter')
+        self.assertEqual(mocked_queue.return_value.declare.call_count, 2)
+
+    @patch('eiffelactory.rabbitmq.Queue')
+    def test_each_delay_has_its_own_parking_queue(self, mocked_queue):
+        names = [self.connection._declare_parking_queue(delay)
+                 for delay in (10.0, 20.0, 10.0)]
+
+        self.assertEqual(names, ['rmq_queue.parking.10s',
+                                 'rmq_queue.parking.20s',
+                                 'rmq_queue.parking.10s'])
+        self.assertEqual(mocked_queue.return_value.declare.call_count, 2)
+
+    @patch('eiffelactory.rabbitmq.Queue')
+    def test_park_message(self, mocked_queue):
+        self.connection.park_message(self.message, 2, 10.0)
+
+        args, kwargs = self.connection.republisher.publish.call_args
+        self.assertEqual(args[0], b'{}')
+        self.assertEqual(kwargs['routing_key'], 'rmq_queue.parking.10s')
+        self.assertNotIn('expiration', kwargs)
+        self.assertEqual(kwargs['headers'],
+                         {'eiffel-type': ARTC,
+                          rabbitmq.RETRIES_HEADER: 2})
+        # the received message is left as it was
+        self.assertEqual(self.message.headers, {'eiffel-type': ARTC})
+
+    def test_dead_letter_message(self):
+        self.connection.dead_letter_queue = MagicMock()
+        self.connection.dead_letter_queue.name = 'rmq_queue.dead-letter'
+        self.message.headers = None
+
+        self.connection.dead_letter_message(self.message, 'not found')
+
+        kwargs = self.connection.republisher.publish.call_args[1]
+        self.assertEqual(kwargs['routing_key'], 'rmq_queue.dead-letter')
+        self.assertEqual(kwargs['delivery_mode'], 2)
+        self.assertEqual(kwargs['headers'],
+                         {rabbitmq.REASON_HEADER: 'not found'})
+
+    @patch('eiffelactory.rabbitmq.Queue')
+    def test_unconfirmed_republish_raises(self, mocked_queue):
+        self.confirmed = False
+
+        with self.assertRaises(rabbitmq.NotConfirmedError):
+            self.connection.park_message(self.message, 1, 10.0)
+
+
+class TestIdleHeartbeats(unittest.TestCase):
+
+    def test_pending_frames_are_read_before_checking(self):
+        connection = MagicMock()
+        calls = []
+        frames = [None, None, socket.timeout()]
+
+        def drain_events(timeout):
+            calls.append(('drain', timeout))
+            frame = frames.pop(0)
+            if frame is not None:
+                raise frame
+        connection.drain_events.side_effect = drain_events
+        connection.heartbeat_check.side_effect = \
+            lambda: calls.append(('check',))
+
+        rabbitmq.check_idle_heartbeats(connection)
+
+        self.assertEqual(calls, [('drain', 0)] * 3 + [('check',)])
+
+
+@patch('eiffelactory.rabbitmq.time.sleep')
+class TestReconnect(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = rabbitmq.RabbitMQConnection.__new__(
+            rabbitmq.RabbitMQConnection)
+        self.connection.app_logger = MagicMock()
+        self.connection.rabbitmq_config = \
+            config.Config('tests/all_options.config').rabbitmq
+        self.connection.connection = MagicMock()
+        self.connection.consumer = MagicMock()
+        self.connection.confirmed_publisher = None
+        self.connection.republisher = None
+        self.connection.connection_errors = (OSError,)
+        self.connection.consuming = True
+        self.connection.paused = False
+        self.connection.tick_callbacks = []
+        self.connection.drain_timeout = 1
+        self.connection.reconnects = 0
+        self.connection.downtime = 0.0
+        self.connection._connect = MagicMock()
+
+    def test_reconnects_with_growing_delays(self, mocked_sleep):
+        self.connection._connect.side_effect = [OSError('refused'),
+                                                OSError('refused'), None]
+
+        self.assertTrue(self.connection._reconnect(OSError('lost')))
+
+        self.assertEqual(self.connection._connect.call_count, 3)
+        delays = [call[0][0] for call in mocked_sleep.call_args_list]
+        self.assertTrue(0 <= delays[0] <= 1)
+        self.assertTrue(0 <= delays[2] <= 4)
+        self.assertEqual(self.connection.connection_stats()['reconnects'], 1)
+
+    def test_stops_reconnecting_when_consuming_stops(self, mocked_sleep):
+        def stop(delay):
+            self.connection.consuming = False
+        mocked_sleep.side_effect = stop
+
+        self.assertFalse(self.connection._reconnect(OSError('lost')))
+        self.connection._connect.assert_not_called()
+
+    def test_read_messages_resumes_after_lost_connection(self, mocked_sleep):
+        drained = []
+
+        def drain_events(timeout):
+            drained.append(timeout)
+            if len(drained) == 1:
+                raise OSError('connection reset')
+            self.connection.consuming = False
+
+        self.connection.connection.drain_events.side_effect = drain_events
+
+        self.connection.read_messages()
+
+        self.assertEqual(len(drained), 2)
+        self.assertEqual(self.connection.reconnects, 1)
+        self.assertEqual(self.connection.consumer.consume.call_count, 2)
+        self.connection.connection.collect.assert_called_once_with()
+
+    def test_async_reconnect_doesnt_block_event_loop(self, mocked_sleep):
+        self.connection._connect.side_effect = [OSError('refused'), None]
+
+        delays = []
+
+        async def async_sleep(delay):
+            delays.append(delay)
+
+        with patch('eiffelactory.rabbitmq.asyncio.sleep', async_sleep):
+            self.assertTrue(asyncio.run(
+                self.connection._reconnect_async(OSError('lost'))))
+
+        self.assertEqual(len(delays), 2)
+        mocked_sleep.assert_not_called()
+        self.assertEqual(self.connection.reconnects, 1)
+
+    def test_paused_consumer_stays_paused(self, mocked_sleep):
+        self.connection.paused = True
+
+        self.connection._start_consumer()
+
+        self.connection.consumer.consume.assert_not_called()
+
+    def test_resume_with_other_prefetch_count_restarts_consumer(
+            self, mocked_sleep):
+        self.connection.prefetch_count = 10
+
+        self.connection.resume_consuming(prefetch_count=1)
+        self.connection.resume_consuming(prefetch_count=1)
+
+        self.connection.consumer.cancel.assert_called_once_with()
+        self.connection.consumer.qos.assert_called_once_with(prefetch_count=1)
+        self.connection.consumer.consume.assert_called_once_with()
+
+        self.connection.resume_consuming()
+
+        self.connection.consumer.qos.assert_called_with(
+            prefetch_count=self.connection.rabbitmq_config.prefetch_count)
+        self.assertEqual(self.connection.consumer.consume.call_count, 2)
+
+
+class TestRawFilter(unittest.TestCase):
+
+    def setUp(self):
+        # the consumer side only, without connecting to a broker
+        self.connection = rabbitmq.RabbitMQConnection.__new__(
+            rabbitmq.RabbitMQConnection)
+        self.connection.app_logger = MagicMock()
+        self.connection.raw_filter = lambda body: b'"wanted"' in body
+        self.connection.filtered = 0
+        self.connection.passed = 0
+        self.connection.decode_latency = metrics.NULL_INSTRUMENT
+        self.received = []
+        self.connection.message_callback = \
+            lambda event, message: self.received.append(event)
+
+    @staticmethod
+    def _message(body, headers=None):
+        message = MagicMock()
+        message.body = body
+        message.headers = headers or {}
+        message.decode.return_value = {'type': 'decoded'}
+        return message
+
+    def test_filtered_message_is_acked_without_decoding(self):
+        message = self._message(b'{"type":"unwanted"}')
+
+        self.connection._handle_raw_message(message)
+
+        message.decode.assert_not_called()
+        message.ack.assert_called_once_with()
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.connection.filter_stats(),
+                         {'filtered': 1, 'passed': 0})
+
+    def test_passed_message_is_decoded(self):
+        message = self._message('{"type":"wanted"}')
+
+        self.connection._handle_raw_message(message)
+
+        self.assertEqual(self.received, [{'type': 'decoded'}])
+        message.ack.assert_not_called()
+        self.assertEqual(self.connection.filter_stats(),
+                         {'filtered': 0, 'passed': 1})
+
+    def test_json_message_is_decoded_with_codec(self):
+        message = self._message(b'{"type":"wanted"}')
+        message.content_type = 'application/json'
+
+        self.connection._handle_raw_message(message)
+
+        message.decode.assert_not_called()
+        self.assertEqual(self.received, [{'type': 'wanted'}])
+
+    def test_message_is_decoded_without_filter(self):
+        self.connection.raw_filter = None
+        message = self._message(b'{"type":"unwanted"}')
+        message.content_type = 'application/json'
+
+        self.connection._handle_raw_message(message)
+
+        self.assertEqual(self.received, [{'type': 'unwanted'}])
+        self.assertEqual(self.connection.filter_stats(),
+                         {'filtered': 0, 'passed': 0})
+
+    def test_compressed_message_is_not_filtered(self):
+        message = self._message(b'compressed',
+                                headers={'compression': 'application/zlib'})
+
+        self.connection._handle_raw_message(message)
+
+        self.assertEqual(self.received, [{'type': 'decoded'}])
+
+    def test_undecodable_message_is_rejected(self):
+        message = self._message(b'"wanted"')
+        message.decode.side_effect = ValueError('bad json')
+
+        self.connection._handle_raw_message(message)
+
+        message.reject.assert_called_once_with()
+        self.assertEqual(self.received, [])
+
+    def test_undecodable_string_body_is_rejected(self):
+        message = self._message(b'"wanted"')
+        message.decode.return_value = '{"type": "wanted"'
+
+        self.connection._handle_raw_message(message)
+
+        message.reject.assert_called_once_with()
+        self.assertEqual(self.received, [])
+
+
+@patch('eiffelactory.rabbitmq.Producer')
+class TestConfirmedPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = MagicMock()
+        self.channel = self.connection.channel.return_value
+        self.channel.events = collections.defaultdict(set)
+        self.confirms = []
+
+    def _create_publisher(self, batch_size=2):
+        return rabbitmq.ConfirmedPublisher(self.connection, 'exchange', '#',
+                                           batch_size=batch_size,
+                                           batch_window=0.05,
+                                           confirm_timeout=0.1)
+
+    def _on_confirm(self, name):
+        return lambda confirmed: self.confirms.append((name, confirmed))
+
+    def _broker_sends(self, *frames):
+        def drain_events(timeout):
+            if not frames_left:
+                raise socket.timeout()
+            method, delivery_tag, multiple = frames_left.pop(0)
+            for callback in list(self.channel.events[method]):
+                callback(delivery_tag, multiple)
+        frames_left = list(frames)
+        self.connection.drain_events.side_effect = drain_events
+
+    def test_batch_is_published_when_full(self, mocked_producer):
+        publisher = self._create_publisher()
+        self._broker_sends(('basic_ack', 2, True))
+
+        publisher.publish({'id': 1}, self._on_confirm('first'))
+        self.assertEqual(mocked_producer.return_value.publish.call_count, 0)
+        publisher.publish({'id': 2}, self._on_confirm('second'))
+
+        self.channel.confirm_select.assert_called_once_with()
+        publish = mocked_producer.return_value.publish
+        self.assertEqual(publish.call_count, 2)
+        self.assertEqual(publish.call_args_list[0][0][0], b'{"id":1}')
+        self.assertEqual(publish.call_args_list[0][1]['content_type'],
+                         'application/json')
+        self.assertEqual(self.confirms, [('first', True), ('second', True)])
+        self.assertEqual(publisher.confirmed, 2)
+
+    def test_nacked_messages_are_not_confirmed(self, mocked_producer):
+        publisher = self._create_publisher()
+        self._broker_sends(('basic_nack', 1, False), ('basic_ack', 2, False))
+
+        publisher.publish({'id': 1}, self._on_confirm('first'))
+        publisher.publish({'id': 2}, self._on_confirm('second'))
+
+        self.assertEqual(self.confirms, [('first', False), ('second', True)])
+        self.assertEqual(publisher.nacked, 1)
+
+    def test_unconfirmed_messages_time_out(self, mocked_producer):
+        publisher = self._create_publisher(batch_size=1)
+        self._broker_sends()
+
+        publisher.publish({'id': 1}, self._on_confirm('first'))
+
+        self.assertEqual(self.confirms, [('first', False)])
+
+    def test_failed_publish_fails_whole_batch(self, mocked_producer):
+        publisher = self._create_publisher()
+        mocked_producer.return_value.publish.side_effect = [None, OSError()]
+
+        publisher.publish({'id': 1}, self._on_confirm('first'))
+        with self.assertRaises(OSError):
+            publisher.publish({'id': 2}, self._on_confirm('second'))
+
+        self.assertEqual(self.confirms, [('first', False), ('second', False)])
+
+    def test_partially_confirmed_batch_fails_once(self, mocked_producer):
+        publisher = self._create_publisher(batch_size=2)
+        self._broker_sends(('basic_ack', 1, False))
+
+        def publish(body, **kwargs):
+            if body == b'{"id":2}':
+                # the first message is confirmed before publishing the
+                # second one fails
+                self.connection.drain_events(timeout=0)
+                raise OSError()
+        mocked_producer.return_value.publish.side_effect = publish
+
+        publisher.publish({'id': 1}, self._on_confirm('first'))
+        with self.assertRaises(OSError):
+            publisher.publish({'id': 2}, self._on_confirm('second'))
+
+        self.assertEqual(self.confirms, [('first', True), ('second', False)])
+
+    def test_options_override_defaults(self, mocked_producer):
+        publisher = self._create_publisher(batch_size=1)
+        self._broker_sends(('basic_ack', 1, False))
+
+        publisher.publish(b'{}', self._on_confirm('a'), routing_key='queue',
+                          delivery_mode=2)
+
+        kwargs = mocked_producer.return_value.publish.call_args[1]
+        self.assertEqual(kwargs['routing_key'], 'queue')
+        self.assertEqual(kwargs['exchange'], 'exchange')
+        self.assertEqual(kwargs['delivery_mode'], 2)
+        self.assertEqual(self.confirms, [('a', True)])
+
+    def test_close_flushes_buffer(self, mocked_producer):
+        publisher = self._create_publisher()
+        self._broker_sends(('basic_ack', 1, False))
+
+        publisher.publish(b'{"id": 1}', self._on_confirm('first'))
+        publisher.close()
+
+        self.assertEqual(
+            mocked_producer.return_value.publish.call_args[0][0],
+            b'{"id": 1}')
+        self.assertEqual(self.confirms, [('first', True)])
+        self.connection.release.assert_called_once_with()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+
+from eiffelactory import retry
+
+LOOKUP = ('artifact.txt', 'job/TEST/1')
+
+
+@patch('eiffelactory.retry.time.monotonic')
+class TestRetryScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = retry.RetryScheduler(max_pending=2,
+                                              initial_delay=5,
+                                              max_delay=15,
+                                              backoff=2,
+                                              max_age=30)
+
+    def test_retry_is_due_after_initial_delay(self, mocked_monotonic):
+        mocked_monotonic.return_value = 100.0
+        self.assertTrue(self.scheduler.schedule('id1', LOOKUP))
+
+        mocked_monotonic.return_value = 104.9
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+        mocked_monotonic.return_value = 105.0
+        due = self.scheduler.pop_due()
+        self.assertEqual([entry.artc_meta_id for entry in due], ['id1'])
+        self.assertEqual(due[0].attempts, 1)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_backoff_is_exponential_and_capped(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.scheduler.schedule('id1', LOOKUP)
+        delays = []
+        now = 0.0
+        for _ in range(3):
+            mocked_monotonic.return_value = now = now + 100.0
+            self.scheduler.max_age = now + 100.0
+            entry = self.scheduler.pop_due()[0]
+            self.scheduler.reschedule(entry)
+            delays.append(self.scheduler._heap[0][0] - now)
+
+        self.assertEqual(delays, [10.0, 15.0, 15.0])
+
+    def test_reschedule_gives_up_after_max_age(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.scheduler.schedule('id1', LOOKUP)
+
+        mocked_monotonic.return_value = 30.0
+        entry = self.scheduler.pop_due()[0]
+
+        self.assertFalse(self.scheduler.reschedule(entry))
+        self.assertEqual(self.scheduler.stats()['expired'], 1)
+
+    def test_pending_entries_are_bounded(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.assertTrue(self.scheduler.schedule('id1', LOOKUP))
+        self.assertTrue(self.scheduler.schedule('id1', LOOKUP))
+        self.assertTrue(self.scheduler.schedule('id2', LOOKUP))
+        self.assertFalse(self.scheduler.schedule('id3', LOOKUP))
+
+        self.assertEqual(self.scheduler.stats(),
+                         {'pending': 2, 'scheduled': 2,
+                          'dropped': 1, 'expired': 0})
+
+    def test_reschedule_is_bounded(self, mocked_monotonic):
+        mocked_monotonic.return_value = 0.0
+        self.scheduler.schedule('id1', LOOKUP)
+        mocked_monotonic.return_value = 5.0
+        entry = self.scheduler.pop_due()[0]
+        self.scheduler.schedule('id2', LOOKUP)
+        self.scheduler.schedule('id3', LOOKUP)
+
+        self.assertFalse(self.scheduler.reschedule(entry))
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.stats()['dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
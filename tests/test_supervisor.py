@@ -0,0 +1,78 @@
+import signal
+import sys
+import time
+import unittest
+
+from eiffelactory import supervisor
+
+
+def crashing_worker():
+    sys.exit(1)
+
+
+def sleeping_worker():
+    time.sleep(60)
+
+
+def stubborn_worker():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def _wait_for_exit(self, supervisor_):
+        for worker in supervisor_.workers:
+            worker.process.join(10)
+
+    def test_crashed_worker_is_restarted(self):
+        supervisor_ = supervisor.Supervisor(1, target=crashing_worker,
+                                            restart_delay=0)
+        supervisor_.start()
+        first_process = supervisor_.workers[0].process
+        self._wait_for_exit(supervisor_)
+
+        supervisor_.check_workers()
+
+        self.assertEqual(first_process.exitcode, 1)
+        self.assertIsNot(supervisor_.workers[0].process, first_process)
+        self.assertEqual(supervisor_.restarts, 1)
+        supervisor_.stop()
+
+    def test_restart_is_delayed_after_crash_loop(self):
+        supervisor_ = supervisor.Supervisor(1, target=crashing_worker,
+                                            restart_delay=10)
+        supervisor_.start()
+        self._wait_for_exit(supervisor_)
+
+        supervisor_.check_workers()
+        supervisor_.check_workers()
+
+        self.assertEqual(supervisor_.restarts, 0)
+        self.assertIsNotNone(supervisor_.workers[0].restart_at)
+        self.assertEqual(supervisor_.workers[0].crashes, 1)
+
+    def test_stop_terminates_workers(self):
+        supervisor_ = supervisor.Supervisor(2, target=sleeping_worker)
+        supervisor_.start()
+
+        supervisor_.stop()
+
+        for worker in supervisor_.workers:
+            self.assertEqual(worker.process.exitcode, -signal.SIGTERM)
+
+    def test_stop_kills_workers_that_ignore_sigterm(self):
+        supervisor_ = supervisor.Supervisor(1, target=stubborn_worker,
+                                            shutdown_timeout=1)
+        supervisor_.start()
+        # gives the worker time to ignore SIGTERM
+        time.sleep(0.5)
+
+        supervisor_.stop()
+
+        self.assertEqual(supervisor_.workers[0].process.exitcode,
+                         -signal.SIGKILL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from eiffelactory import codec
+from eiffelactory import tracing
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = MagicMock()
+
+    def test_trace_has_spans(self):
+        tracer = tracing.Tracer(self.logger)
+
+        tracer.start('id')
+        tracer.mark('id', 'lookup_start')
+        tracer.mark('id', 'lookup_end')
+        tracer.mark('id', 'publish')
+        tracer.finish('id', 'ack')
+
+        trace = codec.loads(self.logger.info.call_args[0][0])
+        self.assertEqual(trace['event_id'], 'id')
+        self.assertEqual(trace['outcome'], 'ack')
+        self.assertEqual(list(trace['marks']), ['receive', 'lookup_start',
+                                                'lookup_end', 'publish',
+                                                'settle'])
+        self.assertEqual([span['name'] for span in trace['spans']],
+                         ['event', 'lookup', 'publish'])
+        self.assertFalse(tracer.traces)
+
+    def test_trace_without_lookup(self):
+        tracer = tracing.Tracer(self.logger)
+
+        tracer.start('id')
+        tracer.finish('id', 'reject')
+
+        trace = codec.loads(self.logger.info.call_args[0][0])
+        self.assertEqual([span['name'] for span in trace['spans']],
+                         ['event'])
+
+    def test_sample_rate(self):
+        tracer = tracing.Tracer(self.logger, sample_rate=0.25)
+
+        for index in range(8):
+            tracer.start(str(index))
+        for index in range(8):
+            tracer.finish(str(index), 'ack')
+
+        self.assertEqual(self.logger.info.call_count, 2)
+
+    def test_min_duration(self):
+        tracer = tracing.Tracer(self.logger, min_duration=60)
+
+        tracer.start('id')
+        tracer.finish('id', 'ack')
+
+        self.logger.info.assert_not_called()
+
+    def test_untraced_events_are_ignored(self):
+        tracer = tracing.Tracer(self.logger)
+
+        tracer.mark('id', 'publish')
+        tracer.finish('id', 'ack')
+
+        self.logger.info.assert_not_called()
+
+    def test_open_traces_are_bounded(self):
+        tracer = tracing.Tracer(self.logger)
+
+        for index in range(tracing.MAX_OPEN_TRACES + 1):
+            tracer.start(index)
+
+        self.assertEqual(len(tracer.traces), tracing.MAX_OPEN_TRACES)
+        self.assertNotIn(0, tracer.traces)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = tracing.SamplingProfiler(self.directory,
+                                                 interval=0.001)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.stop.wait,
+                                       name='sleeping thread')
+        self.thread.start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_sample_collapses_stacks(self):
+        stacks = self.profiler.sample(0.05)
+
+        sleeping = [stack for stack in stacks
+                    if stack.startswith('sleeping_thread;')]
+        self.assertTrue(sleeping)
+        self.assertIn('threading:wait', sleeping[0])
+
+    def test_start_writes_profile(self):
+        self.assertTrue(self.profiler.start(0.05))
+        self.assertFalse(self.profiler.start(0.05))
+        self.profiler._thread.join()
+
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].endswith('.collapsed'))
+        with open(os.path.join(self.directory, files[0])) as profile_file:
+            line = profile_file.readline()
+        stack, count = line.rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertFalse(self.profiler.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,18 @@
+import json
+import logging
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
 
 from eiffelactory import utils
 
 
+def make_record(msg, args=None, name='received'):
+    return logging.LogRecord(name, logging.INFO, __file__, 1, msg, args,
+                             None)
+
+
 class TestUtils(unittest.TestCase):
 
     def test_remove_none_from_dict(self):
@@ -26,6 +36,84 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(build_url,
                 'job/DEPT/job/USR/job/TEST/job/FOO/job/BAR_BAR/1234/')
 
+    def test_parse_purl_directories(self):
+        purl = 'pkg:artifacts/some/dir/some_file.txt@1234?build_path=' \
+               'job/DEPT/job/USR/1234/'
+
+        self.assertEqual(utils.parse_purl_directories(purl),
+                         'artifacts/some/dir')
+        self.assertEqual(
+            utils.parse_purl_directories('pkg:some_file.txt@1234'), '')
+
+    def test_worker_filename_adds_worker_index(self):
+        with patch.dict(os.environ, {utils.WORKER_INDEX_ENV: '2'}):
+            self.assertEqual(utils.worker_filename('eiffelactory.log'),
+                             'eiffelactory.2.log')
+            self.assertEqual(utils.worker_filename('data/index.sqlite'),
+                             'data/index.2.sqlite')
+
+    def test_worker_filename_without_supervisor(self):
+        with patch.dict(os.environ):
+            os.environ.pop(utils.WORKER_INDEX_ENV, None)
+            self.assertEqual(utils.worker_filename('eiffelactory.log'),
+                             'eiffelactory.log')
+
+
+class TestLogging(unittest.TestCase):
+
+    def test_json_lines_splice_event_bytes(self):
+        formatter = utils.JsonLinesFormatter()
+
+        line = formatter.format(make_record(b'{"meta":{"id":"x"}}'))
+
+        parsed = json.loads(line)
+        self.assertEqual(parsed['message'], {'meta': {'id': 'x'}})
+        self.assertEqual(parsed['logger'], 'received')
+        self.assertEqual(parsed['level'], 'INFO')
+
+    def test_json_lines_format_dicts_and_text(self):
+        formatter = utils.JsonLinesFormatter()
+
+        event_line = formatter.format(make_record({'a': 'ä'}))
+        text_line = formatter.format(make_record('%d events', (2,)))
+
+        self.assertEqual(json.loads(event_line)['message'], {'a': 'ä'})
+        self.assertEqual(json.loads(text_line)['message'], '2 events')
+
+    def test_event_formatter_writes_bytes_as_text(self):
+        formatter = utils.EventFormatter('%(message)s')
+
+        self.assertEqual(formatter.format(make_record(b'{"a":1}')),
+                         '{"a":1}')
+
+    def test_sampling_filter_keeps_rate(self):
+        sampling_filter = utils.SamplingFilter(0.25)
+
+        kept = [sampling_filter.filter(make_record('x'))
+                for _ in range(100)]
+
+        self.assertEqual(sum(kept), 25)
+
+    def test_background_writer_writes_all_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.log')
+            writer = utils.BackgroundLogWriter(batch_size=3)
+            handler = utils._BatchedFileHandler(path, encoding='utf-8')
+            handler.setFormatter(utils.EventFormatter('%(message)s'))
+            logger = logging.getLogger('test_background_writer')
+            logger.propagate = False
+            logger.addHandler(writer.add_handler(handler))
+            writer.start()
+
+            for index in range(10):
+                logger.warning(b'{"index":%d}' % index)
+            writer.stop()
+
+            with open(path, encoding='utf-8') as log_file:
+                lines = log_file.read().splitlines()
+        self.assertEqual(lines, ['{"index":%d}' % index
+                                 for index in range(10)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+import threading
+import unittest
+
+from eiffelactory import workers
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = workers.WorkerPool('thread', workers=2, max_in_flight=2)
+        self.done = []
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def _on_done(self, name, future):
+        self.done.append((name, future.result()))
+
+    def test_outcomes_are_handled_in_completion_order(self):
+        release_first = threading.Event()
+        self.pool.submit(lambda future: self._on_done('first', future),
+                         release_first.wait, 5)
+        self.pool.submit(lambda future: self._on_done('second', future),
+                         lambda: 'fast')
+
+        while not self.done:
+            self.pool.handle_done()
+        release_first.set()
+        self.pool.shutdown()
+
+        self.assertEqual(self.done, [('second', 'fast'), ('first', True)])
+        self.assertEqual(self.pool.in_flight, 0)
+
+    def test_submit_blocks_at_max_in_flight(self):
+        release = threading.Event()
+        for name in ('first', 'second'):
+            self.pool.submit(
+                lambda future, name=name: self._on_done(name, future),
+                release.wait, 5)
+        self.assertEqual(self.pool.in_flight, 2)
+
+        threading.Timer(0.1, release.set).start()
+        self.pool.submit(lambda future: self._on_done('third', future),
+                         lambda: 'third')
+
+        self.assertEqual(len(self.done), 1)
+        self.assertEqual(self.pool.in_flight, 2)
+
+    def test_limit_lowers_max_in_flight(self):
+        self.pool.limit = lambda: 1
+        release = threading.Event()
+        self.pool.submit(lambda future: self._on_done('first', future),
+                         release.wait, 5)
+
+        threading.Timer(0.1, release.set).start()
+        self.pool.submit(lambda future: self._on_done('second', future),
+                         lambda: 'second')
+
+        self.assertEqual(self.done, [('first', True)])
+        self.assertEqual(self.pool.in_flight, 1)
+
+    def test_failed_work_is_handed_to_callback(self):
+        errors = []
+
+        def on_done(future):
+            errors.append(future.exception())
+
+        self.pool.submit(on_done, int, 'not a number')
+        self.pool.shutdown()
+
+        self.assertIsInstance(errors[0], ValueError)
+
+    def test_process_workers(self):
+        pool = workers.WorkerPool('process', workers=1, max_in_flight=2,
+                                  config_filename='tests/all_options.config')
+        pool.submit(lambda future: self._on_done('abs', future), abs, -3)
+        pool.shutdown()
+
+        self.assertEqual(self.done, [('abs', 3)])
+
+    def test_unknown_worker_type(self):
+        with self.assertRaises(ValueError):
+            workers.WorkerPool('fiber', workers=1, max_in_flight=1)
+
+
+if __name__ == '__main__':
+    unittest.main()